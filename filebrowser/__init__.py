@@ -1 +1,3 @@
 VERSION = '3.7.2'
+
+default_app_config = 'filebrowser.apps.FileBrowserConfig'
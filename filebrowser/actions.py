@@ -1,13 +1,12 @@
 # coding: utf-8
 
 import os
-import tempfile
 
 from django.contrib import messages
-from django.core.files import File
 from django.utils.translation import ugettext_lazy as _
 
 from filebrowser.settings import VERSION_QUALITY, STRICT_PIL
+from filebrowser.utils import spooled_file
 
 if STRICT_PIL:
     from PIL import Image
@@ -30,7 +29,7 @@ def transpose_image(request, fileobjects, operation):
         f = fileobject.site.storage.open(fileobject.path)
         im = Image.open(f)
         new_image = im.transpose(operation)
-        tmpfile = File(tempfile.NamedTemporaryFile())
+        tmpfile = spooled_file()
 
         try:
             new_image.save(tmpfile, format=Image.EXTENSION[ext], quality=VERSION_QUALITY, optimize=(os.path.splitext(fileobject.path)[1].lower() != '.gif'))
@@ -0,0 +1,11 @@
+# coding: utf-8
+
+from django.apps import AppConfig
+
+
+class FileBrowserConfig(AppConfig):
+    name = 'filebrowser'
+    verbose_name = 'FileBrowser'
+
+    def ready(self):
+        from filebrowser import receivers  # NOQA
@@ -1,19 +1,28 @@
 # coding: utf-8
 
 import datetime
+import heapq
+import itertools
 import mimetypes
 import os
 import platform
-import tempfile
 import time
+import uuid
+
+from functools import partial
+from multiprocessing.pool import ThreadPool
+from operator import attrgetter, itemgetter
 
-from django.core.files import File
 from django.utils.encoding import python_2_unicode_compatible, force_text
 from django.utils.six import string_types
 from django.utils.functional import cached_property
 
-from filebrowser.settings import EXTENSIONS, VERSIONS, ADMIN_VERSIONS, VERSIONS_BASEDIR, VERSION_QUALITY, STRICT_PIL, IMAGE_MAXBLOCK, DEFAULT_PERMISSIONS
-from filebrowser.utils import path_strip, process_image
+from filebrowser.settings import EXTENSION_MAP, VERSIONS, ADMIN_VERSIONS, VERSIONS_BASEDIR, VERSION_QUALITY, STRICT_PIL, IMAGE_MAXBLOCK, DEFAULT_PERMISSIONS, WALK_WORKERS
+from filebrowser.settings import VERSION_PROCESSORS, VERSION_DRAFT, VERSION_LOCK_TIMEOUT
+from filebrowser.dimensions import get_dimensions
+from filebrowser.locks import get_lock
+from filebrowser.manifest import options_signature
+from filebrowser.utils import path_strip, process_image, scale_and_crop_geometry, spooled_file
 from .namers import get_namer
 
 if STRICT_PIL:
@@ -31,6 +40,69 @@ else:
 ImageFile.MAXBLOCK = IMAGE_MAXBLOCK  # default is 64k
 
 
+def _timestamp_to_date(timestamp):
+    """
+    Converts a stat() timestamp to FileObject.date, the same way as
+    storage.modified_time() (naive local time) followed by mktime does.
+    """
+    return time.mktime(datetime.datetime.fromtimestamp(timestamp).timetuple())
+
+
+class LazySortedList(object):
+    """
+    A sequence of objects sorted by attr, which only sorts as much as needed
+    for the items being accessed (e.g. one page of a Paginator).
+
+    The first k of n objects are selected with a heap in O(n log k), the
+    sequence is sorted completely only when iterating over all objects
+    (or accessing items near the end). The order is the same as with
+    sorting the sequence (and reversing it afterwards with reverse).
+    """
+
+    def __init__(self, seq, attr, reverse=False):
+        if isinstance(attr, string_types):
+            attr = (attr, )
+        self.seq = list(seq)
+        self.key = attrgetter(*attr)
+        self.reverse = reverse
+        self._sorted = None
+
+    def __len__(self):
+        return len(self.seq)
+
+    def __iter__(self):
+        return iter(self.sorted())
+
+    def sorted(self):
+        "All objects, sorted"
+        if self._sorted is None:
+            self._sorted = sorted(self.seq, key=self.key)
+            if self.reverse:
+                self._sorted.reverse()
+        return self._sorted
+
+    def head(self, k):
+        "The first k objects"
+        if self._sorted is not None or k * 4 >= len(self.seq):
+            return self.sorted()[:k]
+        if self.reverse:
+            # nlargest is stable, so start with the reversed sequence (like sorted().reverse())
+            return heapq.nlargest(k, reversed(self.seq), key=self.key)
+        return heapq.nsmallest(k, self.seq, key=self.key)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self.seq))
+            if step < 0:
+                return self.sorted()[index]
+            return self.head(stop)[start:stop:step]
+        if index < 0:
+            index += len(self.seq)
+        if not 0 <= index < len(self.seq):
+            raise IndexError('list index out of range')
+        return self.head(index + 1)[index]
+
+
 class FileListing():
     """
     The FileListing represents a group of FileObjects/FileDirObjects.
@@ -65,6 +137,7 @@ class FileListing():
 
     # HELPER METHODS
     # sort_by_attr
+    # sort_lazily
 
     def sort_by_attr(self, seq, attr):
         """
@@ -77,11 +150,22 @@ class FileListing():
         Returns:
         the sorted list of objects.
         """
-        from operator import attrgetter
         if isinstance(attr, string_types):  # Backward compatibility hack
             attr = (attr, )
         return sorted(seq, key=attrgetter(*attr))
 
+    def sort_lazily(self, seq):
+        """
+        Sort the sequence of objects with sorting_by and sorting_order, but
+        only as far as needed for the objects being accessed (see LazySortedList).
+        """
+        if self.sorting_by:
+            return LazySortedList(seq, self.sorting_by, reverse=self.sorting_order == "desc")
+        seq = list(seq)
+        if self.sorting_order == "desc":
+            seq.reverse()
+        return seq
+
     @cached_property
     def is_folder(self):
         return self.site.storage.isdir(self.path)
@@ -93,81 +177,281 @@ class FileListing():
             return (f for f in dirs + files)
         return []
 
-    def _walk(self, path, filelisting):
+    def _scandir(self, path):
+        """
+        List all directory entries (including their stat data) for path,
+        folders first. Returns None if site.storage is not able to scan directories.
         """
-        Recursively walks the path and collects all files and
-        directories.
+        try:
+            entries = self.site.storage.scandir(path)
+        except (AttributeError, NotImplementedError):
+            return None
+        # Folders first (same order as with listing)
+        return [e for e in entries if e.is_dir()] + [e for e in entries if not e.is_dir()]
 
-        Danger: Symbolic links can create cycles and this function
-        ends up in a regression.
+    def entries(self):
         """
-        dirs, files = self.site.storage.listdir(path)
+        List all directory entries (including their stat data) for path.
 
-        if dirs:
-            for d in dirs:
-                self._walk(os.path.join(path, d), filelisting)
-                filelisting.extend([path_strip(os.path.join(path, d), self.site.directory)])
+        Returns None if site.storage is not able to scan directories.
+        """
+        if not self.is_folder:
+            return []
+        return self._scandir(self.path)
 
-        if files:
-            for f in files:
-                filelisting.extend([path_strip(os.path.join(path, f), self.site.directory)])
+    def _fileobject_from_entry(self, path, entry):
+        "Returns a FileObject with the stat data of entry already filled in"
+        fileobject = FileObject(os.path.join(path, entry.name), site=self.site)
+        try:
+            stat = entry.stat()
+        except OSError:
+            # e.g. a broken symlink
+            fileobject._prefill(exists=False, is_folder=False, filesize=None, date=None)
+        else:
+            fileobject._prefill(
+                exists=True,
+                is_folder=entry.is_dir(),
+                filesize=stat.st_size,
+                date=_timestamp_to_date(stat.st_mtime))
+        return fileobject
+
+    def _walk_listing(self, path):
+        """
+        Returns (FileObject, key) for all entries of path, where key identifies
+        a folder on its device (None if unknown, e.g. with remote storages).
+        """
+        entries = self._scandir(path)
+        if entries is None:
+            dirs, files = self.site.storage.listdir(path)
+            result = []
+            for name in dirs:
+                fileobject = FileObject(os.path.join(path, name), site=self.site)
+                fileobject._prefill(exists=True, is_folder=True)
+                result.append((fileobject, None))
+            for name in files:
+                fileobject = FileObject(os.path.join(path, name), site=self.site)
+                fileobject._prefill(exists=True, is_folder=False)
+                result.append((fileobject, None))
+            return result
+        result = []
+        for entry in entries:
+            fileobject = self._fileobject_from_entry(path, entry)
+            key = None
+            if fileobject.is_folder:
+                stat = entry.stat()
+                # st_ino is 0 on platforms where scandir doesn't provide it
+                if stat.st_ino:
+                    key = (stat.st_dev, stat.st_ino)
+            result.append((fileobject, key))
+        return result
+
+    def _folder_key(self, path):
+        "Identifies the folder path on its device (None if unknown)"
+        try:
+            stat = os.stat(self.site.storage.path(path))
+        except (AttributeError, NotImplementedError, OSError):
+            return None
+        return (stat.st_dev, stat.st_ino) if stat.st_ino else None
+
+    def walk_iter(self, max_depth=None, workers=None):
+        """
+        Yields FileObjects for all files and folders below path, read from
+        site.storage while walking (same order as walk: the contents of a folder
+        before the folder itself, folders before files).
+
+        Folders which have already been visited (e.g. with symbolic links
+        creating cycles) are not read again. With max_depth, only max_depth
+        levels are read (1 = only the contents of path).
+
+        With more than one worker (defaults to WALK_WORKERS), the subfolders of
+        a folder are read ahead with a pool of threads, which speeds up walking
+        storages with a high latency (e.g. network filesystems). The order
+        stays the same.
+        """
+        if not self.is_folder or (max_depth is not None and max_depth < 1):
+            return
+        if workers is None:
+            workers = WALK_WORKERS
+        pool = ThreadPool(workers) if workers > 1 else None
+        visited = set([self._folder_key(self.path)])
+
+        def expand(listing, depth):
+            "Returns (FileObject, read) for listing, where read returns the listing of a folder to walk into"
+            result = []
+            for fileobject, key in listing:
+                read = None
+                if fileobject.is_folder and (max_depth is None or depth < max_depth) and (key is None or key not in visited):
+                    visited.add(key)
+                    if pool is None:
+                        read = partial(self._walk_listing, fileobject.path)
+                    else:
+                        read = pool.apply_async(self._walk_listing, (fileobject.path,)).get
+                result.append((fileobject, read))
+            return result
+
+        try:
+            stack = [(None, iter(expand(self._walk_listing(self.path), 1)), 1)]
+            while stack:
+                folder, listing, depth = stack[-1]
+                for fileobject, read in listing:
+                    if read is not None:
+                        stack.append((fileobject, iter(expand(read(), depth + 1)), depth + 1))
+                        break
+                    yield fileobject
+                else:
+                    stack.pop()
+                    if folder is not None:
+                        yield folder
+        finally:
+            if pool is not None:
+                pool.terminate()
 
     def walk(self):
         "Walk all files for path"
-        filelisting = []
-        if self.is_folder:
-            self._walk(self.path, filelisting)
-        return filelisting
+        return [path_strip(fileobject.path, self.site.directory) for fileobject in self.walk_iter()]
+
+    @property
+    def index(self):
+        "The metadata index of site (see filebrowser.index), if it has been built for path"
+        index = getattr(self.site, 'index', None)
+        if index is not None and index.covers(self.path):
+            return index
+        return None
+
+    def index_query(self, recursive=False):
+        """
+        Returns an IndexQuery for path (ordered with sorting_by and sorting_order, if
+        possible), or None if there's no index for path.
+        """
+        index = self.index
+        if index is None:
+            return None
+        query = index.query(self.path, recursive=recursive)
+        if self.sorting_by and query.can_order_by(self.sorting_by):
+            query = query.order_by(self.sorting_by, self.sorting_order)
+        return query
+
+    def files_listing_storage(self):
+        "Returns FileObjects for all files in listing, read from site.storage (bypassing the index)"
+        entries = self.entries()
+        if entries is not None:
+            return [self._fileobject_from_entry(self.path, e) for e in entries]
+        return [FileObject(os.path.join(self.path, item), site=self.site) for item in self.listing()]
 
     # Cached results of files_listing_total (without any filters and sorting applied)
     _fileobjects_total = None
 
-    def files_listing_total(self):
-        "Returns FileObjects for all files in listing"
+    def files_listing_total(self, sort=True):
+        """
+        Returns FileObjects for all files in listing
+
+        With sort=False, sorting_by and sorting_order may not have been applied.
+        """
+        query = self.index_query()
+        if query is not None and query.is_ordered:
+            files = list(query)
+            self._results_listing_total = len(files)
+            return files
+
         if self._fileobjects_total is None:
-            self._fileobjects_total = []
-            for item in self.listing():
-                fileobject = FileObject(os.path.join(self.path, item), site=self.site)
-                self._fileobjects_total.append(fileobject)
+            if query is not None:
+                self._fileobjects_total = list(query)
+            else:
+                self._fileobjects_total = self.files_listing_storage()
 
-        files = self._fileobjects_total
+        files = list(self._fileobjects_total)
 
-        if self.sorting_by:
-            files = self.sort_by_attr(files, self.sorting_by)
-        if self.sorting_order == "desc":
-            files.reverse()
+        if sort:
+            if self.sorting_by:
+                files = self.sort_by_attr(files, self.sorting_by)
+            if self.sorting_order == "desc":
+                files.reverse()
 
         self._results_listing_total = len(files)
         return files
 
-    def files_walk_total(self):
-        "Returns FileObjects for all files in walk"
-        files = []
-        for item in self.walk():
-            fileobject = FileObject(os.path.join(self.site.directory, item), site=self.site)
-            files.append(fileobject)
-        if self.sorting_by:
-            files = self.sort_by_attr(files, self.sorting_by)
-        if self.sorting_order == "desc":
-            files.reverse()
+    def files_walk_total(self, sort=True):
+        """
+        Returns FileObjects for all files in walk
+
+        With sort=False, sorting_by and sorting_order may not have been applied.
+        """
+        query = self.index_query(recursive=True)
+        if query is not None and query.is_ordered:
+            files = list(query)
+            self._results_walk_total = len(files)
+            return files
+
+        if query is not None:
+            files = list(query)
+        else:
+            files = list(self.walk_iter())
+        if sort:
+            if self.sorting_by:
+                files = self.sort_by_attr(files, self.sorting_by)
+            if self.sorting_order == "desc":
+                files.reverse()
         self._results_walk_total = len(files)
         return files
 
-    def files_listing_filtered(self):
+    def files_walk_iter(self):
+        "Yields FileObjects for filtered files in walk (not sorted, while walking)"
+        query = self.index_query(recursive=True)
+        files = iter(query) if query is not None else self.walk_iter()
+        for fileobject in files:
+            if not self.filter_func or self.filter_func(fileobject):
+                yield fileobject
+
+    def files_walk_head(self, count):
+        """
+        Returns the first count FileObjects of files_walk_total (sorted with
+        sorting_by and sorting_order) and the number of all FileObjects,
+        without keeping all FileObjects in memory.
+        """
+        query = self.index_query(recursive=True)
+        if query is not None and query.is_ordered:
+            self._results_walk_total = query.count()
+            return list(query[:count]), self._results_walk_total
+        # (position, FileObject), the position breaks ties when sorting
+        # (same order as sorting and reversing afterwards)
+        positions = itertools.count()
+        files = ((next(positions), f) for f in (query if query is not None else self.walk_iter()))
+        if self.sorting_by:
+            attr = self.sorting_by
+            if isinstance(attr, string_types):
+                attr = (attr, )
+            getter = attrgetter(*attr)
+
+            def key(item):
+                return (getter(item[1]), item[0])
+
+            if self.sorting_order == "desc":
+                head = heapq.nlargest(count, files, key=key)
+            else:
+                head = heapq.nsmallest(count, files, key=key)
+        else:
+            head = list(files)
+            if self.sorting_order == "desc":
+                head.reverse()
+            head = head[:count]
+        self._results_walk_total = next(positions)
+        return [fileobject for i, fileobject in head], self._results_walk_total
+
+    def files_listing_filtered(self, sort=True):
         "Returns FileObjects for filtered files in listing"
         if self.filter_func:
-            listing = list(filter(self.filter_func, self.files_listing_total()))
+            listing = list(filter(self.filter_func, self.files_listing_total(sort=sort)))
         else:
-            listing = self.files_listing_total()
+            listing = self.files_listing_total(sort=sort)
         self._results_listing_filtered = len(listing)
         return listing
 
-    def files_walk_filtered(self):
+    def files_walk_filtered(self, sort=True):
         "Returns FileObjects for filtered files in walk"
         if self.filter_func:
-            listing = list(filter(self.filter_func, self.files_walk_total()))
+            listing = list(filter(self.filter_func, self.files_walk_total(sort=sort)))
         else:
-            listing = self.files_walk_total()
+            listing = self.files_walk_total(sort=sort)
         self._results_walk_filtered = len(listing)
         return listing
 
@@ -196,8 +480,54 @@ class FileListing():
         return len(self.files_walk_filtered())
 
 
+# Options of a version which are only used by scale_and_crop (and versions_generate)
+SCALE_OPTIONS = ('verbose_name', 'width', 'height', 'size', 'opts', 'draft')
+# Images are decoded with (at least) DRAFT_MARGIN times the size of a version
+DRAFT_MARGIN = 2
+
+
+def _is_pure_version(options):
+    """
+    True, if a version with options is only scaled (and cropped) with the
+    default VERSION_PROCESSORS, i.e. it doesn't change its source image.
+    """
+    return list(VERSION_PROCESSORS) == ['filebrowser.utils.scale_and_crop'] and all(k in SCALE_OPTIONS for k in options)
+
+
+class cached_slot(object):
+    """
+    Like django.utils.functional.cached_property, but for classes with
+    __slots__: the value is computed on first access and stored in the
+    slot named like the function with a leading underscore.
+    """
+
+    def __init__(self, func):
+        self.func = func
+        self.slot = '_' + func.__name__
+        self.__doc__ = getattr(func, '__doc__')
+
+    def __get__(self, instance, cls=None):
+        if instance is None:
+            return self
+        try:
+            return getattr(instance, self.slot)
+        except AttributeError:
+            value = self.func(instance)
+            setattr(instance, self.slot, value)
+            return value
+
+    def __set__(self, instance, value):
+        setattr(instance, self.slot, value)
+
+    def __delete__(self, instance):
+        try:
+            delattr(instance, self.slot)
+        except AttributeError:
+            pass
+
+
 @python_2_unicode_compatible
-class FileObject():
+class FileObject(object):
     """
     The FileObject represents a file (or directory) on the server.
 
@@ -209,6 +539,15 @@ class FileObject():
     where path is a relative path to a storage location
     """
 
+    # Listings create lots of FileObjects, so they don't have a __dict__ and
+    # everything besides site and path is computed on first access (see cached_slot).
+    __slots__ = (
+        'site', 'path',
+        '_head', '_filename', '_filename_lower', '_filename_root', '_extension', '_mimetype',
+        '_filetype', '_filesize', '_date', '_exists', '_dimensions', '_is_folder',
+        '_known_versions',
+    )
+
     def __init__(self, path, site=None):
         if not site:
             from filebrowser.sites import site as default_site
@@ -218,11 +557,6 @@ class FileObject():
             self.path = path.replace('\\', '/')
         else:
             self.path = path
-        self.head = os.path.dirname(path)
-        self.filename = os.path.basename(path)
-        self.filename_lower = self.filename.lower()
-        self.filename_root, self.extension = os.path.splitext(self.filename)
-        self.mimetype = mimetypes.guess_type(self.filename)
 
     def __str__(self):
         return force_text(self.path)
@@ -237,17 +571,57 @@ class FileObject():
     def __len__(self):
         return len(self.path)
 
+    def _prefill(self, **attributes):
+        """
+        Sets cached properties (e.g. exists, is_folder, filesize and date)
+        with data which is already known, so they don't hit the storage.
+        """
+        for name, value in attributes.items():
+            setattr(self, name, value)
+
+    # FILENAME ATTRIBUTES/PROPERTIES
+    # head
+    # filename
+    # filename_lower
+    # filename_root
+    # extension
+    # mimetype
+
+    @cached_slot
+    def head(self):
+        "The directory of path"
+        return os.path.dirname(self.path)
+
+    @cached_slot
+    def filename(self):
+        return os.path.basename(self.path)
+
+    @cached_slot
+    def filename_lower(self):
+        return self.filename.lower()
+
+    @cached_slot
+    def filename_root(self):
+        "The filename without its extension"
+        return os.path.splitext(self.filename)[0]
+
+    @cached_slot
+    def extension(self):
+        "The extension of the filename (including the dot)"
+        return os.path.splitext(self.filename)[1]
+
+    @cached_slot
+    def mimetype(self):
+        "The (type, encoding) tuple guessed from the filename"
+        return mimetypes.guess_type(self.filename)
+
     # HELPER METHODS
     # _get_file_type
 
     def _get_file_type(self):
-        "Get file type as defined in EXTENSIONS."
-        file_type = ''
-        for k, v in EXTENSIONS.items():
-            for extension in v:
-                if self.extension.lower() == extension.lower():
-                    file_type = k
-        return file_type
+        "Get file type as defined in EXTENSIONS (of site)."
+        extension_map = getattr(self.site, 'extension_map', EXTENSION_MAP)
+        return extension_map.get(self.extension.lower(), '')
 
     # GENERAL ATTRIBUTES/PROPERTIES
     # filetype
@@ -256,17 +630,17 @@ class FileObject():
     # datetime
     # exists
 
-    @cached_property
+    @cached_slot
     def filetype(self):
         "Filetype as defined with EXTENSIONS"
         return 'Folder' if self.is_folder else self._get_file_type()
 
-    @cached_property
+    @cached_slot
     def filesize(self):
         "Filesize in bytes"
         return self.site.storage.size(self.path) if self.exists else None
 
-    @cached_property
+    @cached_slot
     def date(self):
         "Modified time (from site.storage) as float (mktime)"
         if self.exists:
@@ -280,7 +654,7 @@ class FileObject():
             return datetime.datetime.fromtimestamp(self.date)
         return None
 
-    @cached_property
+    @cached_slot
     def exists(self):
         "True, if the path exists, False otherwise"
         return self.site.storage.exists(self.path)
@@ -319,16 +693,12 @@ class FileObject():
     # aspectratio
     # orientation
 
-    @cached_property
+    @cached_slot
     def dimensions(self):
         "Image dimensions as a tuple"
         if self.filetype != 'Image':
             return None
-        try:
-            im = Image.open(self.site.storage.open(self.path))
-            return im.size
-        except:
-            pass
+        return get_dimensions(self)
 
     @property
     def width(self):
@@ -365,7 +735,7 @@ class FileObject():
     # is_folder
     # is_empty
 
-    @cached_property
+    @cached_slot
     def is_folder(self):
         "True, if path is a folder"
         return self.site.storage.isdir(self.path)
@@ -472,31 +842,226 @@ class FileObject():
 
     def version_generate(self, version_suffix, extra_options=None):
         "Generate a version"  # FIXME: version_generate for version?
-        path = self.path
-        options = self._get_options(version_suffix, extra_options)
+        return self.versions_generate([version_suffix], extra_options)[version_suffix]
 
-        version_path = self.version_path(version_suffix, extra_options)
-        if not self.site.storage.isfile(version_path):
-            version_path = self._generate_version(version_path, options)
-        elif self.site.storage.modified_time(path) > self.site.storage.modified_time(version_path):
-            version_path = self._generate_version(version_path, options)
-        return FileObject(version_path, site=self.site)
+    def versions_generate(self, version_suffixes, extra_options=None, source=None, force=False):
+        """
+        Generate versions (if they don't exist or are outdated, with force
+        in any case) and return a dict with the FileObject for every
+        version suffix.
+
+        The original image is decoded only once, and smaller versions are
+        processed from larger (downscaled) versions where possible. source
+        is an optional file with the content of the original (e.g. an
+        uploaded file), which is read instead of site.storage.
+        """
+        if force:
+            versions = {}
+            pending = [(version_suffix, self.version_path(version_suffix, extra_options), self._get_options(version_suffix, extra_options))
+                       for version_suffix in version_suffixes]
+        else:
+            versions, pending = self._find_versions(version_suffixes, extra_options)
+        if not pending:
+            return versions
 
-    def _generate_version(self, version_path, options):
+        locks, pending = self._lock_versions(pending, versions)
+        try:
+            if pending:
+                self._generate_versions(pending, versions, source=source)
+        finally:
+            for lock in locks:
+                lock.release()
+        # versions found missing or outdated with find_versions are up to date now
+        known = getattr(self, '_known_versions', None)
+        if known:
+            for version_suffix, version_path, options in pending:
+                known.pop(version_path, None)
+                if versions.get(version_suffix) and versions[version_suffix].path == version_path:
+                    known[version_path] = versions[version_suffix]
+        manifest = getattr(self.site, 'manifest', None)
+        if manifest is not None:
+            signatures = dict((version_path, options_signature(options)) for version_suffix, version_path, options in pending)
+            manifest.add(self, dict((version.path, signatures[version.path]) for version in versions.values() if version.path in signatures))
+        index = getattr(self.site, 'index', None)
+        if index is not None:
+            index.add_versions(self, set(version.path for version in versions.values()))
+        return versions
+
+    def _find_versions(self, version_suffixes, extra_options=None):
         """
-        Generate Version for an Image.
-        value has to be a path relative to the storage location.
+        Returns a dict with the FileObject for every up to date version and a
+        list of (version_suffix, version_path, options) for all other versions.
+
+        Versions are looked up with the manifest of the site first (see
+        VERSION_MANIFEST), and with site.storage otherwise.
         """
+        manifest = getattr(self.site, 'manifest', None)
+        recorded = manifest.versions(self) if manifest is not None else {}
+        # versions already found with find_versions
+        known = getattr(self, '_known_versions', None) or {}
+        versions, pending, found = {}, [], {}
+        for version_suffix in version_suffixes:
+            version_path = self.version_path(version_suffix, extra_options)
+            options = self._get_options(version_suffix, extra_options)
+            if manifest is not None and recorded.get(version_path) == options_signature(options):
+                versions[version_suffix] = FileObject(version_path, site=self.site)
+            elif version_path in known:
+                if known[version_path] is not None:
+                    versions[version_suffix] = known[version_path]
+                else:
+                    pending.append((version_suffix, version_path, options))
+            elif self._version_is_current(version_path):
+                versions[version_suffix] = FileObject(version_path, site=self.site)
+                if manifest is not None:
+                    found[version_path] = options_signature(options)
+            else:
+                pending.append((version_suffix, version_path, options))
+        if manifest is not None:
+            manifest.add(self, found)
+        return versions, pending
 
-        tmpfile = File(tempfile.NamedTemporaryFile())
+    def _lock_versions(self, pending, versions):
+        """
+        Locks the pending versions (see filebrowser.locks) and returns the
+        locks and the versions which still need to be generated.
+
+        A version locked by another process is waited for (at most
+        VERSION_LOCK_TIMEOUT seconds) and added to versions if it has been
+        generated meanwhile. Without the lock, a version is never generated:
+        if the lock times out, an empty FileObject is added instead (like
+        with an image which can't be opened).
+        """
+        locks, remaining = [], []
+        # Always in the same order, so that processes don't wait for each other
+        for version_suffix, version_path, options in sorted(pending, key=itemgetter(1)):
+            lock = get_lock(self.site, version_path)
+            if lock.acquire(0):
+                locks.append(lock)
+                remaining.append((version_suffix, version_path, options))
+                continue
+            acquired = lock.acquire(VERSION_LOCK_TIMEOUT)
+            if acquired:
+                locks.append(lock)
+            invalidate = getattr(self.site.storage, 'invalidate', None)
+            if invalidate is not None:
+                invalidate(version_path)
+            if self._version_is_current(version_path):
+                versions[version_suffix] = FileObject(version_path, site=self.site)
+            elif acquired:
+                remaining.append((version_suffix, version_path, options))
+            else:
+                versions[version_suffix] = FileObject("", site=self.site)
+        return locks, remaining
+
+    def _generate_versions(self, pending, versions, source=None):
+        "Generate the pending versions and add them to versions"
+        def geometry(size, options):
+            return scale_and_crop_geometry(size, options.get('width'), options.get('height'), options.get('opts', ''))
+
+        def draft(size):
+            "The size needed for all pending versions (None, if the image needs to be decoded completely)"
+            needed = (0, 0)
+            for version_suffix, version_path, options in pending:
+                resize = geometry(size, options)[0]
+                if not _is_pure_version(options) or not options.get('draft', VERSION_DRAFT) or not resize:
+                    return None
+                needed = (max(needed[0], resize[0] * DRAFT_MARGIN), max(needed[1], resize[1] * DRAFT_MARGIN))
+            return needed
+
+        store = getattr(self.site, 'version_store', None)
+        if store is not None and not store.hardlinks:
+            store = None
+        if store is not None:
+            # versions of identical originals are generated only once (see VERSION_STORE)
+            try:
+                pending, store_paths = store.share(self, pending, versions, source=source)
+            except (IOError, OSError):
+                store = None
+            if not pending:
+                return
+
+        im, size = self._open_image(draft=draft, source=source)
+        if im is None:
+            for version_suffix, version_path, options in pending:
+                versions[version_suffix] = FileObject("", site=self.site)
+            return
+
+        def area(options):
+            resize = geometry(size, options)[0] if _is_pure_version(options) else None
+            return (resize or size)[0] * (resize or size)[1]
+
+        # Largest versions first, so their downscaled images can be used for the smaller ones
+        pending.sort(key=lambda item: area(item[2]), reverse=True)
+        downscaled = []
+        for version_suffix, version_path, options in pending:
+            if _is_pure_version(options):
+                # the same as scale_and_crop with the original image, but resized
+                # from the smallest (drafted or downscaled) image possible
+                resize, box = geometry(size, options)
+                version = im
+                if resize:
+                    source = im
+                    for image in downscaled:
+                        if image.size[0] >= resize[0] and image.size[1] >= resize[1]:
+                            source = image
+                    version = source.resize(resize, resample=Image.ANTIALIAS)
+                    if resize[0] < im.size[0] and resize[1] < im.size[1]:
+                        downscaled.append(version)
+                if box:
+                    version = version.crop(box)
+            else:
+                # processors or methods might change their source
+                version = self._process_version(im.copy(), options)
+            versions[version_suffix] = FileObject(self._save_version(version, version_path), site=self.site)
+            if store is not None:
+                try:
+                    store.add(version_path, store_paths[version_path])
+                except (IOError, OSError):
+                    pass
+
+    def _version_is_current(self, version_path):
+        "True, if the version exists and is not older than the original"
+        if not self.site.storage.isfile(version_path):
+            return False
+        return self.site.storage.modified_time(self.path) <= self.site.storage.modified_time(version_path)
 
+    def _open_image(self, draft=None, source=None):
+        """
+        Returns the decoded original image and its size ((None, None), if the
+        original can't be opened).
+
+        draft is a function returning the size needed for the original size.
+        The image is then decoded with a smaller size (JPEG, see Image.draft)
+        or reduced right after decoding, but not smaller than needed.
+
+        source is a file read instead of the original (it is not closed).
+        """
+        if source is not None:
+            source.seek(0)
+            f = source
+        else:
+            try:
+                f = self.site.storage.open(self.path)
+            except IOError:
+                return None, None
         try:
-            f = self.site.storage.open(self.path)
-        except IOError:
-            return ""
-        im = Image.open(f)
-        version_dir, version_basename = os.path.split(version_path)
-        root, ext = os.path.splitext(version_basename)
+            im = Image.open(f)
+            size = im.size
+            needed = draft(size) if draft is not None else None
+            if needed and im.format == 'JPEG':
+                im.draft(im.mode, needed)
+            im.load()
+        finally:
+            if source is None:
+                f.close()
+        if needed and hasattr(im, 'reduce') and im.mode in ('L', 'RGB', 'RGBA', 'CMYK'):
+            factor = min(im.size[0] // needed[0], im.size[1] // needed[1])
+            if factor > 1:
+                im = im.reduce(factor)
+        return im, size
+
+    def _process_version(self, im, options):
+        "Process the image im for a version with options (see VERSION_PROCESSORS)"
         version = process_image(im, options)
         if not version:
             version = im
@@ -504,6 +1069,13 @@ class FileObject():
             for m in options['methods']:
                 if callable(m):
                     version = m(version)
+        return version
+
+    def _save_version(self, version, version_path):
+        "Save the image version to version_path and return version_path"
+        tmpfile = spooled_file()
+        version_dir, version_basename = os.path.split(version_path)
+        root, ext = os.path.splitext(version_basename)
 
         # IF need Convert RGB
         if ext in [".jpg", ".jpeg"] and version.mode not in ("L", "RGB"):
@@ -514,15 +1086,28 @@ class FileObject():
             version.save(tmpfile, format=Image.EXTENSION[ext.lower()], quality=VERSION_QUALITY, optimize=(os.path.splitext(version_path)[1] != '.gif'))
         except IOError:
             version.save(tmpfile, format=Image.EXTENSION[ext.lower()], quality=VERSION_QUALITY)
-        # remove old version, if any
-        if version_path != self.site.storage.get_available_name(version_path):
-            self.site.storage.delete(version_path)
-        self.site.storage.save(version_path, tmpfile)
+        # save to a temporary name and replace the old version (if any) with it,
+        # so that an incomplete version is never visible
+        try:
+            tmp_path = self.site.storage.save(os.path.join(version_dir, '.%s.%s.tmp' % (version_basename, uuid.uuid4().hex)), tmpfile)
+        finally:
+            tmpfile.close()
         # set permissions
         if DEFAULT_PERMISSIONS is not None:
-            os.chmod(self.site.storage.path(version_path), DEFAULT_PERMISSIONS)
+            os.chmod(self.site.storage.path(tmp_path), DEFAULT_PERMISSIONS)
+        self.site.storage.move(tmp_path, version_path, allow_overwrite=True)
         return version_path
 
+    def _generate_version(self, version_path, options):
+        """
+        Generate Version for an Image.
+        value has to be a path relative to the storage location.
+        """
+        im, size = self._open_image()
+        if im is None:
+            return ""
+        return self._save_version(self._process_version(im, options), version_path)
+
     # DELETE METHODS
     # delete()
     # delete_versions()
@@ -542,6 +1127,7 @@ class FileObject():
                 self.site.storage.delete(version)
             except:
                 pass
+        self._forget_versions()
 
     def delete_admin_versions(self):
         "Delete admin versions"
@@ -550,3 +1136,63 @@ class FileObject():
                 self.site.storage.delete(version)
             except:
                 pass
+        self._forget_versions()
+
+    def _forget_versions(self):
+        self._known_versions = None
+        manifest = getattr(self.site, 'manifest', None)
+        if manifest is not None:
+            manifest.forget(self.path)
+        index = getattr(self.site, 'index', None)
+        if index is not None:
+            index.forget_versions(self.path)
+
+
+def _version_folder(site, folder):
+    "Returns a dict with a FileObject for every file in folder (with a single scan of folder)"
+    listing = FileListing(folder, site=site)
+    try:
+        entries = listing._scandir(folder)
+        if entries is None:
+            return dict((name, FileObject(os.path.join(folder, name), site=site)) for name in site.storage.listdir(folder)[1])
+    except (OSError, IOError):
+        return {}
+    return dict((entry.name, listing._fileobject_from_entry(folder, entry)) for entry in entries if not entry.is_dir())
+
+
+def find_versions(fileobjects, version_suffixes=None, extra_options=None):
+    """
+    Finds the up to date versions version_suffixes (defaults to ADMIN_VERSIONS)
+    of several images at once, with a single scan of every version folder
+    (scandir or listdir) instead of storage calls for every version.
+
+    Returns a dict with a dict for the path of every image, which maps every
+    version suffix to the FileObject of the version (None if the version is
+    missing or outdated). The results are kept with the images, so that
+    version_generate (e.g. with the version templatetag) doesn't check them again.
+    """
+    if version_suffixes is None:
+        version_suffixes = ADMIN_VERSIONS
+    images = [fileobject for fileobject in fileobjects if fileobject.filetype == "Image" and not fileobject.is_version]
+    paths = dict((fileobject.path, [(version_suffix, fileobject.version_path(version_suffix, extra_options)) for version_suffix in version_suffixes])
+                 for fileobject in images)
+    folders = {}
+    for fileobject in images:
+        for version_suffix, version_path in paths[fileobject.path]:
+            key = (fileobject.site, os.path.dirname(version_path))
+            if key not in folders:
+                folders[key] = _version_folder(*key)
+
+    result = {}
+    for fileobject in images:
+        versions = {}
+        known = getattr(fileobject, '_known_versions', None) or {}
+        for version_suffix, version_path in paths[fileobject.path]:
+            folder, name = os.path.split(version_path)
+            version = folders[(fileobject.site, folder)].get(name)
+            if version is not None and (version.date is None or fileobject.date is None or fileobject.date > version.date):
+                version = None
+            versions[version_suffix] = known[version_path] = version
+        fileobject._known_versions = known
+        result[fileobject.path] = versions
+    return result
@@ -0,0 +1,136 @@
+# coding: utf-8
+
+import hashlib
+import struct
+
+from django.core.cache import caches
+from django.utils.encoding import force_bytes
+
+from filebrowser.settings import DIMENSIONS_CACHE, DIMENSIONS_CACHE_TIMEOUT, STRICT_PIL
+
+if STRICT_PIL:
+    from PIL import Image
+else:
+    try:
+        from PIL import Image
+    except ImportError:
+        import Image
+
+
+# Bytes read first and (for JPEG with large metadata segments) at most
+HEADER_SIZE = 4096
+MAX_HEADER_SIZE = 128 * 1024
+
+# Start of frame markers of JPEG (without DHT, JPG and DAC)
+JPEG_SOF = set(range(0xC0, 0xD0)) - set([0xC4, 0xC8, 0xCC])
+
+
+def _jpeg_dimensions(header):
+    offset = 2
+    while offset + 9 < len(header):
+        if header[offset:offset + 1] != b'\xff':
+            return None
+        marker = ord(header[offset + 1:offset + 2])
+        if marker == 0xFF:
+            # fill byte
+            offset += 1
+            continue
+        if marker in JPEG_SOF:
+            height, width = struct.unpack('>HH', header[offset + 5:offset + 9])
+            return width, height
+        if 0xD0 <= marker <= 0xD9 or marker == 0x01:
+            # markers without a segment
+            offset += 2
+            continue
+        offset += 2 + struct.unpack('>H', header[offset + 2:offset + 4])[0]
+    return None
+
+
+def _webp_dimensions(header):
+    chunk = header[12:16]
+    if chunk == b'VP8 ' and len(header) >= 30:
+        width, height = struct.unpack('<HH', header[26:30])
+        return width & 0x3FFF, height & 0x3FFF
+    if chunk == b'VP8L' and len(header) >= 25:
+        bits = struct.unpack('<I', header[21:25])[0]
+        return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+    if chunk == b'VP8X' and len(header) >= 30:
+        width = struct.unpack('<I', header[24:27] + b'\0')[0]
+        height = struct.unpack('<I', header[27:30] + b'\0')[0]
+        return width + 1, height + 1
+    return None
+
+
+def parse_dimensions(header):
+    """
+    Returns the dimensions (width, height) of a JPEG, PNG, GIF or WebP image
+    with the first bytes of the file, None if they are not found in header.
+    """
+    if header[:2] == b'\xff\xd8':
+        return _jpeg_dimensions(header)
+    if header[:8] == b'\x89PNG\r\n\x1a\n' and header[12:16] == b'IHDR' and len(header) >= 24:
+        return struct.unpack('>II', header[16:24])
+    if header[:6] in (b'GIF87a', b'GIF89a') and len(header) >= 10:
+        return struct.unpack('<HH', header[6:10])
+    if header[:4] == b'RIFF' and header[8:12] == b'WEBP':
+        return _webp_dimensions(header)
+    return None
+
+
+def read_header(storage, name, size):
+    "Returns the first size bytes of name (with a ranged read, if storage supports read_header)"
+    if hasattr(storage, 'read_header'):
+        try:
+            return storage.read_header(name, size)
+        except NotImplementedError:
+            pass
+    f = storage.open(name)
+    try:
+        return f.read(size)
+    finally:
+        f.close()
+
+
+def probe_dimensions(storage, name):
+    """
+    Returns the dimensions of an image with reading only the header, or
+    with PIL and the whole file for other formats (None if the file is not
+    an image).
+    """
+    try:
+        header = read_header(storage, name, HEADER_SIZE)
+        dimensions = parse_dimensions(header)
+        if dimensions is None and header[:2] == b'\xff\xd8' and len(header) == HEADER_SIZE:
+            # metadata (e.g. EXIF) before the frame header
+            dimensions = parse_dimensions(read_header(storage, name, MAX_HEADER_SIZE))
+        if dimensions is not None:
+            return tuple(dimensions)
+        f = storage.open(name)
+        try:
+            return Image.open(f).size
+        finally:
+            f.close()
+    except Exception:
+        return None
+
+
+def get_dimensions(fileobject):
+    """
+    Returns the dimensions of fileobject, from DIMENSIONS_CACHE (with the
+    path and date of fileobject) or probed with the storage.
+    """
+    if DIMENSIONS_CACHE is None:
+        return probe_dimensions(fileobject.site.storage, fileobject.path)
+    date = fileobject.date
+    if date is None:
+        return None
+    site = fileobject.site
+    cache = caches[DIMENSIONS_CACHE]
+    cache_key = 'filebrowser:%s:%s:dimensions:%s:%s' % (
+        site.app_name, site.name, hashlib.md5(force_bytes(fileobject.path)).hexdigest(), date)
+    dimensions = cache.get(cache_key)
+    if dimensions is None:
+        # () is cached for files without dimensions
+        dimensions = probe_dimensions(site.storage, fileobject.path) or ()
+        cache.set(cache_key, dimensions, DIMENSIONS_CACHE_TIMEOUT)
+    return tuple(dimensions) or None
@@ -0,0 +1,464 @@
+# coding: utf-8
+
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from filebrowser.base import FileListing, FileObject, find_versions
+from filebrowser.settings import VERSIONS
+
+
+# Attributes of FileObject which can be used for sorting with the index
+ORDERING_COLUMNS = {
+    'date': 'date',
+    'filesize': 'filesize',
+    'filename': 'filename',
+    'filename_lower': 'filename_lower',
+    'filetype': 'filetype',
+    'path': 'path',
+}
+
+SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS filebrowser_file (
+        site TEXT NOT NULL,
+        path TEXT NOT NULL,
+        parent TEXT NOT NULL,
+        filename TEXT NOT NULL,
+        filename_lower TEXT NOT NULL,
+        is_folder INTEGER NOT NULL,
+        filesize INTEGER,
+        date REAL,
+        filetype TEXT,
+        width INTEGER,
+        height INTEGER,
+        versions TEXT,
+        PRIMARY KEY (site, path)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS filebrowser_file_parent ON filebrowser_file (site, parent)",
+    """
+    CREATE TABLE IF NOT EXISTS filebrowser_root (
+        site TEXT NOT NULL,
+        path TEXT NOT NULL,
+        built REAL NOT NULL,
+        PRIMARY KEY (site, path)
+    )
+    """,
+)
+
+FIELDS = 'path, is_folder, filesize, date, filetype, width, height, versions'
+
+_regex_cache = {}
+
+
+def _regexp(pattern, value):
+    "REGEXP function for SQLite (X REGEXP Y calls regexp(Y, X))"
+    if value is None:
+        return False
+    regex = _regex_cache.get(pattern)
+    if regex is None:
+        regex = _regex_cache[pattern] = re.compile(pattern)
+    return regex.search(value) is not None
+
+
+def _filterdate(filter_date, date):
+    "FILTERDATE function for SQLite, see filebrowser.sites.get_filterdate"
+    from filebrowser.sites import get_filterdate
+    return bool(get_filterdate(filter_date, date or 0))
+
+
+def regex_source(regex):
+    "Pattern of a compiled regular expression, including its inline flags"
+    flags = ''
+    if regex.flags & re.IGNORECASE:
+        flags += 'i'
+    if regex.flags & re.MULTILINE:
+        flags += 'm'
+    if flags:
+        return '(?%s)%s' % (flags, regex.pattern)
+    return regex.pattern
+
+
+def normalize_path(path):
+    return path.rstrip('/')
+
+
+class FileIndex(object):
+    """
+    A persistent index with the metadata of all files and folders of a
+    FileBrowserSite, stored with a local SQLite database.
+
+    An example::
+
+        from filebrowser.sites import site
+        from filebrowser.index import FileIndex
+        site.index = FileIndex('/var/lib/filebrowser/index.sqlite', site=site)
+        site.index.build()
+
+    Once the index has been built, FileListing uses the index (instead of
+    site.storage) for listing, sorting, filtering and pagination.
+    """
+
+    def __init__(self, database, site):
+        self.database = database
+        self.site = site
+        self._local = threading.local()
+
+    @property
+    def connection(self):
+        "The connection to the database (one per thread)"
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.database)
+            connection.create_function('REGEXP', 2, _regexp)
+            connection.create_function('FILTERDATE', 2, _filterdate)
+            for statement in SCHEMA:
+                connection.execute(statement)
+            self._local.connection = connection
+        return connection
+
+    @property
+    def site_name(self):
+        return self.site.name or ''
+
+    # ROOTS
+    # covers(path)
+    # roots()
+
+    def roots(self):
+        "Paths the index has been built for"
+        cursor = self.connection.execute("SELECT path FROM filebrowser_root WHERE site = ?", (self.site_name,))
+        return [row[0] for row in cursor]
+
+    def covers(self, path):
+        "True, if the index has been built for path (or one of its parents)"
+        path = normalize_path(path)
+        for root in self.roots():
+            if not root or path == root or path.startswith(root + '/'):
+                return True
+        return False
+
+    # BUILDING THE INDEX
+    # build(path)
+    # scan(path)
+
+    def build(self, path=None, workers=None):
+        """
+        (Re)Builds the index for path (defaults to site.directory) by
+        scanning site.storage. Returns the number of indexed entries.
+        workers: see FileListing.walk_iter
+        """
+        root = normalize_path(self.site.directory if path is None else path)
+        versions = self._scan_versions(workers)
+        count = 0
+        with self.connection as connection:
+            self._delete_tree(connection, root)
+            for fileobject in self.scan(root, workers=workers):
+                connection.execute(
+                    "INSERT OR REPLACE INTO filebrowser_file VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    self._row(fileobject, self._current_versions(fileobject, versions)))
+                count += 1
+            connection.execute(
+                "INSERT OR REPLACE INTO filebrowser_root VALUES (?, ?, ?)",
+                (self.site_name, root, time.time()))
+        return count
+
+    def scan(self, path, workers=None):
+        "Yields FileObjects for all files and folders below path, read from site.storage"
+        return FileListing(path, site=self.site).walk_iter(workers=workers)
+
+    def _scan_versions(self, workers=None):
+        "dict with the modification date for the path of every existing version"
+        basedir = FileObject('', site=self.site).versions_basedir
+        if not basedir or not self.site.storage.isdir(basedir):
+            return {}
+        return dict((f.path, f.date) for f in self.scan(normalize_path(basedir), workers=workers) if not f.is_folder)
+
+    def _current_versions(self, fileobject, dates):
+        "Set with the paths of the versions of fileobject in dates which are not older than fileobject"
+        return set(path for path in fileobject.versions()
+                   if dates.get(path) is not None and fileobject.date is not None and dates[path] >= fileobject.date)
+
+    def _find_versions(self, fileobjects):
+        "Set with the paths of the up to date versions of fileobjects (with a single scan of every version folder)"
+        versions = set()
+        for found in find_versions(fileobjects, sorted(VERSIONS)).values():
+            versions.update(version.path for version in found.values() if version is not None)
+        return versions
+
+    # UPDATING THE INDEX
+    # update(path)
+    # delete(path)
+    # rename(path, new_path)
+    # add_versions(fileobject, paths)
+    # forget_versions(path)
+
+    def _is_indexed(self, path):
+        "True, if path is (or should be) an entry of the index"
+        return self.covers(path) and path not in self.roots()
+
+    def update(self, path, recursive=False):
+        """
+        Inserts or updates the entry for path, read from site.storage.
+        With recursive, all entries below a folder are read again as well.
+        """
+        path = normalize_path(path)
+        if not self.covers(path):
+            return
+        # roots do not have an entry themselves, but their contents may be read again
+        is_root = path in self.roots()
+        if is_root and not recursive:
+            return
+        fileobject = FileObject(path, site=self.site)
+        with self.connection as connection:
+            if not fileobject.exists:
+                self._delete_tree(connection, path, below=is_root)
+                return
+            if not is_root:
+                versions = set(v for v in fileobject.versions() if fileobject._version_is_current(v))
+                connection.execute(
+                    "INSERT OR REPLACE INTO filebrowser_file VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    self._row(fileobject, versions))
+            if recursive and fileobject.is_folder:
+                files = list(self.scan(path))
+                versions = self._find_versions(files)
+                self._delete_tree(connection, path, below=True)
+                for f in files:
+                    connection.execute(
+                        "INSERT OR REPLACE INTO filebrowser_file VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        self._row(f, versions))
+
+    def delete(self, path):
+        "Deletes the entry for path (including all entries below path)"
+        path = normalize_path(path)
+        if not self._is_indexed(path):
+            return
+        with self.connection as connection:
+            self._delete_tree(connection, path)
+
+    def rename(self, path, new_path):
+        "Moves the entry for path (including all entries below path) to new_path"
+        path, new_path = normalize_path(path), normalize_path(new_path)
+        if not self._is_indexed(path):
+            self.update(new_path)
+            return
+        if not self._is_indexed(new_path):
+            self.delete(path)
+            return
+        with self.connection as connection:
+            self._delete_tree(connection, new_path)
+            connection.execute(
+                "UPDATE filebrowser_file SET path = ? || substr(path, ?), parent = ? || substr(parent, ?) "
+                "WHERE site = ? AND path >= ? AND path < ?",
+                (new_path, len(path) + 1, new_path, len(path) + 1, self.site_name) + self._prefix_range(path))
+            connection.execute("DELETE FROM filebrowser_file WHERE site = ? AND path = ?", (self.site_name, path))
+        self.update(new_path)
+
+    def add_versions(self, fileobject, paths):
+        "Adds the up to date versions (paths, e.g. just generated) to the entry for fileobject"
+        path = normalize_path(fileobject.path)
+        if not self._is_indexed(path):
+            return
+        suffixes = set(s for s in VERSIONS if fileobject.version_path(s) in paths)
+        if not suffixes:
+            return
+        with self.connection as connection:
+            row = connection.execute(
+                "SELECT versions FROM filebrowser_file WHERE site = ? AND path = ?", (self.site_name, path)).fetchone()
+            if row is None or row[0] is None:
+                # the versions are not known
+                return
+            suffixes.update(s for s in row[0].split(',') if s)
+            connection.execute(
+                "UPDATE filebrowser_file SET versions = ? WHERE site = ? AND path = ?",
+                (','.join(sorted(suffixes)), self.site_name, path))
+
+    def forget_versions(self, path, recursive=False):
+        "Forgets the versions of path (with recursive, of all entries below path as well)"
+        path = normalize_path(path)
+        if not self.covers(path):
+            return
+        with self.connection as connection:
+            if recursive:
+                connection.execute(
+                    "UPDATE filebrowser_file SET versions = NULL WHERE site = ? AND (path = ? OR (path >= ? AND path < ?))",
+                    (self.site_name, path) + self._prefix_range(path))
+            else:
+                connection.execute(
+                    "UPDATE filebrowser_file SET versions = NULL WHERE site = ? AND path = ?", (self.site_name, path))
+
+    def _row(self, fileobject, versions=None):
+        """
+        Values for the entry of fileobject. versions is the set of paths of
+        the up to date versions (None, if they are not known).
+        """
+        dimensions = fileobject.dimensions or (None, None)
+        current = None
+        if versions is not None and fileobject.filetype == 'Image' and not fileobject.is_version:
+            current = ','.join(s for s in sorted(VERSIONS) if fileobject.version_path(s) in versions)
+        return (
+            self.site_name,
+            fileobject.path,
+            os.path.dirname(fileobject.path),
+            fileobject.filename,
+            fileobject.filename_lower,
+            fileobject.is_folder,
+            fileobject.filesize,
+            fileobject.date,
+            fileobject.filetype,
+            dimensions[0],
+            dimensions[1],
+            current,
+        )
+
+    def _delete_tree(self, connection, path, below=False):
+        connection.execute(
+            "DELETE FROM filebrowser_file WHERE site = ? AND ((path = ? AND NOT ?) OR (path >= ? AND path < ?))",
+            (self.site_name, path, below) + self._prefix_range(path))
+
+    def _prefix_range(self, path):
+        "Range of paths (lower, upper) with the prefix path + '/'"
+        if not path:
+            return (u'', u'\U0010ffff')
+        return (path + '/', path + '0')  # '0' follows '/'
+
+    # QUERYING THE INDEX
+    # query(path, recursive)
+
+    def query(self, path, recursive=False):
+        "Returns an IndexQuery with all entries within path"
+        return IndexQuery(self, normalize_path(path), recursive)
+
+    def fileobject(self, row):
+        "Returns a FileObject with the data of row already filled in"
+        path, is_folder, filesize, date, filetype, width, height, versions = row
+        fileobject = FileObject(path, site=self.site)
+        fileobject._prefill(
+            exists=True,
+            is_folder=bool(is_folder),
+            filesize=filesize,
+            date=date,
+            filetype=filetype,
+            dimensions=(width, height) if width is not None else None)
+        if versions is not None:
+            # up to date and missing versions, so that version_generate doesn't check them again
+            suffixes = versions.split(',')
+            known = {}
+            for version_suffix in VERSIONS:
+                version_path = fileobject.version_path(version_suffix)
+                known[version_path] = FileObject(version_path, site=self.site) if version_suffix in suffixes else None
+            fileobject._known_versions = known
+        return fileobject
+
+
+class IndexQuery(object):
+    """
+    A lazy, sliceable list of FileObjects read from a FileIndex.
+
+    The query is executed with slicing, iteration or count(), so it can be
+    used with Django's Paginator (e.g. fetching a single page with LIMIT).
+    """
+
+    def __init__(self, index, path, recursive=False):
+        self.index = index
+        self.path = path
+        self.recursive = recursive
+        self.where = []
+        self.params = []
+        self.ordering = None
+        self._count = None
+
+    def _clone(self):
+        clone = IndexQuery(self.index, self.path, self.recursive)
+        clone.where = list(self.where)
+        clone.params = list(self.params)
+        clone.ordering = self.ordering
+        return clone
+
+    def filter(self, filetype=None, filter_date=None, search=None, exclude=None):
+        """
+        Returns a new IndexQuery, limited to files matching all the given arguments.
+
+        filetype    - filetype as defined with EXTENSIONS (or 'Folder')
+        filter_date - see filebrowser.sites.get_filterdate
+        search      - compiled regular expression, matching the lowercase filename
+        exclude     - list of compiled regular expressions, excluding matching filenames
+        """
+        clone = self._clone()
+        if filetype:
+            clone.where.append("filetype = ?")
+            clone.params.append(filetype)
+        if filter_date:
+            clone.where.append("FILTERDATE(?, date)")
+            clone.params.append(filter_date)
+        if search is not None:
+            clone.where.append("filename_lower REGEXP ?")
+            clone.params.append(regex_source(search))
+        for regex in exclude or []:
+            clone.where.append("NOT filename REGEXP ?")
+            clone.params.append(regex_source(regex))
+        return clone
+
+    @classmethod
+    def can_order_by(cls, sorting_by):
+        return sorting_by in ORDERING_COLUMNS
+
+    def order_by(self, sorting_by, sorting_order=None):
+        "Returns a new IndexQuery, ordered by the FileObject attribute sorting_by"
+        clone = self._clone()
+        direction = 'DESC' if sorting_order == 'desc' else 'ASC'
+        clone.ordering = "%s %s, path %s" % (ORDERING_COLUMNS[sorting_by], direction, direction)
+        return clone
+
+    @property
+    def is_ordered(self):
+        return self.ordering is not None
+
+    def _sql(self, fields):
+        if self.recursive:
+            where = ["site = ?", "path >= ?", "path < ?"]
+            params = [self.index.site_name] + list(self.index._prefix_range(self.path))
+        else:
+            where = ["site = ?", "parent = ?"]
+            params = [self.index.site_name, self.path]
+        sql = "SELECT %s FROM filebrowser_file WHERE %s" % (fields, " AND ".join(where + self.where))
+        return sql, params + self.params
+
+    def count(self):
+        "Number of matching entries"
+        if self._count is None:
+            sql, params = self._sql("COUNT(*)")
+            self._count = self.index.connection.execute(sql, params).fetchone()[0]
+        return self._count
+
+    def __len__(self):
+        return self.count()
+
+    def _fetch(self, offset=0, limit=None):
+        sql, params = self._sql(FIELDS)
+        if self.ordering:
+            sql += " ORDER BY %s" % self.ordering
+        if limit is not None or offset:
+            sql += " LIMIT ? OFFSET ?"
+            params = params + [-1 if limit is None else limit, offset]
+        return [self.index.fileobject(row) for row in self.index.connection.execute(sql, params)]
+
+    def __iter__(self):
+        return iter(self._fetch())
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            if key.step is not None or (key.start or 0) < 0 or (key.stop is not None and key.stop < 0):
+                return list(self)[key]
+            start = key.start or 0
+            limit = None if key.stop is None else max(key.stop - start, 0)
+            return self._fetch(start, limit)
+        if key < 0:
+            return list(self)[key]
+        result = self._fetch(key, 1)
+        if not result:
+            raise IndexError("IndexQuery index out of range")
+        return result[0]
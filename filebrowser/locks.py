@@ -0,0 +1,131 @@
+# coding: utf-8
+
+import errno
+import hashlib
+import os
+import tempfile
+import time
+import uuid
+
+from django.core.cache import caches
+from django.core.files.storage import FileSystemStorage
+from django.utils.encoding import force_bytes
+from django.utils.module_loading import import_string
+
+from filebrowser.settings import STORAGE_CACHE, VERSION_LOCK
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+class BaseLock(object):
+    """
+    A lock for name (a path of site.storage), shared by all processes using
+    the same kind of lock. Subclasses implement try_acquire and release.
+    """
+
+    def __init__(self, site, name):
+        self.site = site
+        self.name = name
+
+    def try_acquire(self):
+        "Returns True if the lock has been acquired (without waiting)"
+        raise NotImplementedError()
+
+    def release(self):
+        raise NotImplementedError()
+
+    def acquire(self, timeout=None):
+        "Waits at most timeout seconds (None waits forever), returns True if the lock has been acquired"
+        deadline = None if timeout is None else time.time() + timeout
+        while not self.try_acquire():
+            if deadline is not None and time.time() >= deadline:
+                return False
+            time.sleep(0.05)
+        return True
+
+
+class FileLock(BaseLock):
+    """
+    Locks with flock on a file in the temporary directory (for processes on
+    the same host, e.g. with FileSystemStorage).
+    """
+
+    def __init__(self, site, name):
+        super(FileLock, self).__init__(site, name)
+        directory = os.path.join(tempfile.gettempdir(), 'filebrowser-locks')
+        try:
+            os.makedirs(directory)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        key = hashlib.sha1(force_bytes(site.storage.path(name))).hexdigest()
+        self.path = os.path.join(directory, key)
+        self.fd = None
+
+    def try_acquire(self):
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except (IOError, OSError) as e:
+            os.close(fd)
+            if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EACCES):
+                return False
+            raise
+        # The previous owner removes the file, so the file locked might not be the current one
+        try:
+            current = os.stat(self.path).st_ino == os.fstat(fd).st_ino
+        except OSError:
+            current = False
+        if not current:
+            os.close(fd)
+            return False
+        self.fd = fd
+        return True
+
+    def release(self):
+        if self.fd is None:
+            return
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+        fcntl.flock(self.fd, fcntl.LOCK_UN)
+        os.close(self.fd)
+        self.fd = None
+
+
+class CacheLock(BaseLock):
+    """
+    Locks with the (atomic) add of a Django cache, STORAGE_CACHE or the default
+    cache. A lock expires after expire seconds. Please note that the local
+    memory cache is not shared by processes.
+    """
+
+    expire = 300
+
+    def __init__(self, site, name):
+        super(CacheLock, self).__init__(site, name)
+        self.cache = caches[STORAGE_CACHE or 'default']
+        prefix = getattr(site.storage, 'key_prefix', 'filebrowser:%s:%s' % (site.app_name, site.name))
+        self.key = '%s:lock:%s' % (prefix, hashlib.sha1(force_bytes(name)).hexdigest())
+        self.token = uuid.uuid4().hex
+
+    def try_acquire(self):
+        return self.cache.add(self.key, self.token, self.expire)
+
+    def release(self):
+        if self.cache.get(self.key) == self.token:
+            self.cache.delete(self.key)
+
+
+def get_lock(site, name):
+    "Returns a lock for name with site (VERSION_LOCK, a FileLock or a CacheLock)"
+    if VERSION_LOCK:
+        return import_string(VERSION_LOCK)(site, name)
+    storage = getattr(site.storage, 'storage', site.storage)
+    if fcntl is not None and isinstance(storage, FileSystemStorage):
+        return FileLock(site, name)
+    return CacheLock(site, name)
@@ -0,0 +1,38 @@
+# coding: utf-8
+
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from filebrowser.sites import site as default_site, get_site_dict
+
+
+class Command(BaseCommand):
+    help = "(Re)Build the metadata index of a FileBrowser site (see FILEBROWSER_INDEX_DATABASE)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', default=None,
+                            help='Path relative to the storage location (defaults to site.directory).')
+        parser.add_argument('--site', default=None,
+                            help='Name of the FileBrowser site (defaults to the default site).')
+        parser.add_argument('--workers', type=int, default=None,
+                            help='Number of threads reading folders (defaults to FILEBROWSER_WALK_WORKERS).')
+
+    def handle(self, *args, **options):
+        site = default_site
+        if options['site']:
+            try:
+                site = get_site_dict()[options['site']]
+            except KeyError:
+                raise CommandError('FileBrowser site "%s" does not exist.' % options['site'])
+
+        if site.index is None:
+            raise CommandError('The site "%s" has no index. Please define FILEBROWSER_INDEX_DATABASE.' % site.name)
+
+        path = options['path'] if options['path'] is not None else site.directory
+        if not site.storage.isdir(path):
+            raise CommandError('"%s" is no directory.' % path)
+
+        start = time.time()
+        count = site.index.build(path, workers=options['workers'])
+        self.stdout.write('%d files/folders indexed in %.1f seconds.\n' % (count, time.time() - start))
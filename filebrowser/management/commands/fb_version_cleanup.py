@@ -0,0 +1,169 @@
+# coding: utf-8
+
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.template.defaultfilters import filesizeformat
+from django.utils.six.moves import input
+
+from filebrowser import receivers
+from filebrowser.base import FileListing, FileObject
+from filebrowser.manifest import options_signature
+from filebrowser.settings import VERSIONS, VERSIONS_BASEDIR, VERSION_LOCK_TIMEOUT
+from filebrowser.sites import site as default_site, get_site_dict
+
+# Temporary files of versions being saved are removed only after this many
+# seconds (versions are saved while locked for at most VERSION_LOCK_TIMEOUT)
+TEMPORARY_MAX_AGE = max(VERSION_LOCK_TIMEOUT * 10, 60 * 60)
+
+
+class VersionChecker(object):
+    """
+    Maps versions back to their original (with the namer) and tells orphaned
+    versions and versions with outdated options. Folders of originals are
+    listed only once (versions are checked folder by folder while walking).
+    """
+
+    def __init__(self, site):
+        self.site = site
+        self.manifest = getattr(site, 'manifest', None)
+        self.folders = {}
+        self.original = None
+        self.current = None
+
+    def original_exists(self, original):
+        head = original.head
+        if head not in self.folders:
+            if len(self.folders) > 1000:
+                self.folders.clear()
+            try:
+                self.folders[head] = set(self.site.storage.listdir(head)[1])
+            except (OSError, IOError):
+                self.folders[head] = set()
+        return original.filename in self.folders[head]
+
+    def current_versions(self, original):
+        "dict with the options signature for the path of every version in VERSIONS"
+        if self.original is None or self.original.path != original.path:
+            self.original = original
+            self.current = dict((original.version_path(suffix), options_signature(original._get_options(suffix))) for suffix in VERSIONS)
+        return self.current
+
+    def check(self, version):
+        "Returns None for up to date versions, 'orphaned', 'outdated' or 'stale' otherwise"
+        if version.filename.startswith('.') and version.filename.endswith('.tmp'):
+            # temporary file of a version being saved or linked (left over, if it is old)
+            date = version.date
+            return 'stale' if date is not None and date < time.time() - TEMPORARY_MAX_AGE else None
+        store = getattr(self.site, 'version_store', None)
+        if store is not None and store.is_stored(version.path):
+            # orphaned, if no version links to it anymore (see VERSION_STORE)
+            return 'orphaned' if store.is_unreferenced(version) else None
+        if not version.is_version:
+            return None
+        try:
+            if not version.original_filename:
+                # the version suffix is not in VERSIONS anymore
+                return 'orphaned'
+            original = version.original
+        except Exception:
+            return 'orphaned'
+        if not self.original_exists(original):
+            return 'orphaned'
+        current = self.current_versions(original)
+        if version.path not in current:
+            # e.g. named with other options (see OptionsNamer)
+            return 'outdated'
+        if self.manifest is not None:
+            recorded = self.manifest.versions(original).get(version.path)
+            if recorded is not None and recorded != current[version.path]:
+                return 'outdated'
+        return None
+
+
+class Command(BaseCommand):
+    help = ("Remove versions without an original image (e.g. deleted or moved outside of the FileBrowser "
+            "or with a version suffix not in VERSIONS anymore), versions with outdated options, "
+            "unreferenced versions of VERSION_STORE and left over temporary files.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', default=None,
+                            help='Path relative to the storage location (defaults to VERSIONS_BASEDIR).')
+        parser.add_argument('--site', default=None,
+                            help='Name of the FileBrowser site (defaults to the default site).')
+        parser.add_argument('--dry-run', action='store_true', default=False,
+                            help='Only count (and with --verbosity 2 list) the versions which would be removed.')
+        parser.add_argument('--batch-size', type=int, default=100,
+                            help='Number of versions removed at once (default: 100).')
+        parser.add_argument('--noinput', '--no-input', action='store_false', dest='interactive', default=True,
+                            help='Do not ask for confirmation.')
+
+    def handle(self, *args, **options):
+        site = default_site
+        if options['site']:
+            try:
+                site = get_site_dict()[options['site']]
+            except KeyError:
+                raise CommandError('FileBrowser site "%s" does not exist.' % options['site'])
+
+        if not VERSIONS_BASEDIR:
+            raise CommandError('fb_version_cleanup requires FILEBROWSER_VERSIONS_BASEDIR (versions can\'t be told apart from originals otherwise).')
+        versions_basedir = FileObject('', site=site).versions_basedir
+        path = options['path'] if options['path'] is not None else versions_basedir
+        if not (path.rstrip('/') + '/').startswith(versions_basedir.rstrip('/') + '/'):
+            raise CommandError('"%s" is not within VERSIONS_BASEDIR ("%s").' % (path, versions_basedir))
+        if not site.storage.isdir(path):
+            raise CommandError('"%s" is no directory.' % path)
+
+        dry_run = options['dry_run']
+        if options['interactive'] and not dry_run:
+            self.stdout.write('Orphaned and outdated versions within "%s" will be removed.\n' % path)
+            if input('"y" for Yes or "n" for No (leave blank for "n"): ') != 'y':
+                self.stdout.write('No files removed.\n')
+                return
+
+        checker = VersionChecker(site)
+        self.count, self.size = 0, 0
+        batch = []
+        for fileobject in FileListing(path, site=site).walk_iter():
+            if fileobject.is_folder:
+                continue
+            reason = checker.check(fileobject)
+            if reason is None:
+                continue
+            if options['verbosity'] > 1:
+                self.stdout.write('%s: %s\n' % (reason, fileobject.path))
+            if dry_run:
+                self.count += 1
+                self.size += fileobject.filesize or 0
+                continue
+            batch.append(fileobject)
+            if len(batch) >= options['batch_size']:
+                self.remove(site, batch)
+                batch = []
+        if batch:
+            self.remove(site, batch)
+
+        if dry_run:
+            self.stdout.write('%d version(s) would be removed (%s).\n' % (self.count, filesizeformat(self.size)))
+        else:
+            self.stdout.write('%d version(s) removed, %s reclaimed.\n' % (self.count, filesizeformat(self.size)))
+
+    def remove(self, site, versions):
+        "Removes versions and forgets the versions of their originals"
+        originals = set()
+        for version in versions:
+            size = version.filesize or 0
+            try:
+                site.storage.delete(version.path)
+            except (OSError, IOError) as e:
+                self.stderr.write('Error removing %s: %s\n' % (version.path, e))
+                continue
+            self.count += 1
+            self.size += size
+            try:
+                originals.add(version.original.path)
+            except Exception:
+                pass
+        for original in originals:
+            receivers.forget_versions(site, original)
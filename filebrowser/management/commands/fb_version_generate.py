@@ -1,14 +1,20 @@
 # coding: utf-8
 
+import io
+import multiprocessing
 import os
 import re
+import threading
+import time
 
-from django.conf import settings
+import django
 from django.core.management.base import BaseCommand, CommandError
 from django.utils.six.moves import input
 
-from filebrowser.base import FileListing
-from filebrowser.settings import EXTENSION_LIST, EXCLUDE, DIRECTORY, VERSIONS
+from filebrowser.base import FileListing, FileObject
+from filebrowser.settings import EXTENSION_LIST, EXCLUDE, VERSIONS
+from filebrowser.sites import site as default_site, get_site_dict
+from filebrowser.version_queue import get_site
 
 
 filter_re = []
@@ -19,23 +25,178 @@ for k, v in VERSIONS.items():
     filter_re.append(re.compile(exp))
 
 
+def generate_versions(site, path, version_suffixes, mode):
+    """
+    Generates the versions of path (all of them, only missing versions with
+    mode "missing" or missing and outdated versions with mode "stale").
+    Returns (path, number of versions generated, error or None).
+    """
+    try:
+        fileobject = FileObject(path, site=site)
+        if mode == 'missing':
+            version_suffixes = [v for v in version_suffixes if not site.storage.isfile(fileobject.version_path(v))]
+        elif mode == 'stale':
+            version_suffixes = [v[0] for v in fileobject._find_versions(version_suffixes)[1]]
+        if version_suffixes:
+            versions = fileobject.versions_generate(version_suffixes, force=True)
+            if not all(version.path for version in versions.values()):
+                return path, 0, 'the image could not be opened'
+        return path, len(version_suffixes), None
+    except Exception as e:
+        return path, 0, '%s: %s' % (e.__class__.__name__, e)
+
+
+def generate_versions_in_worker(app_name, site_name, path, version_suffixes, mode):
+    "generate_versions with a worker process"
+    try:
+        site = get_site(app_name, site_name)
+    except KeyError:
+        return path, 0, 'FileBrowser site "%s" does not exist.' % site_name
+    return generate_versions(site, path, version_suffixes, mode)
+
+
+class Progress(object):
+    "Counts the images done and writes the throughput"
+
+    def __init__(self, stdout, interval=10.0):
+        self.stdout = stdout
+        self.interval = interval
+        self.start = self.last = time.time()
+        self.images = self.versions = self.skipped = self.failed = 0
+
+    def add(self, versions, error):
+        self.images += 1
+        self.versions += versions
+        if error:
+            self.failed += 1
+
+    def write(self, force=False):
+        now = time.time()
+        if not force and now - self.last < self.interval:
+            return
+        self.last = now
+        seconds = max(now - self.start, 0.001)
+        self.stdout.write('%d images (%d versions generated, %d skipped, %d failed) in %.1f seconds: %.1f images/s, %.1f versions/s\n' % (
+            self.images, self.versions, self.skipped, self.failed, seconds, self.images / seconds, self.versions / seconds))
+
+
 class Command(BaseCommand):
-    args = '<media_path>'
     help = "(Re)Generate image versions."
 
-    def handle(self, *args, **options):
-        media_path = ""
-
-        if len(args):
-            media_path = args[0]
-            path = media_path
-        else:
-            path = DIRECTORY
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', default=None,
+                            help='Path relative to the storage location (defaults to site.directory).')
+        parser.add_argument('--site', default=None,
+                            help='Name of the FileBrowser site (defaults to the default site).')
+        parser.add_argument('--suffix', action='append', dest='versions', default=[],
+                            help='Suffix of a version to generate (can be used several times, defaults to all versions).')
+        parser.add_argument('--workers', type=int, default=0,
+                            help='Number of worker processes (default: 0, generates versions with this process).')
+        modes = parser.add_mutually_exclusive_group()
+        modes.add_argument('--only-missing', action='store_true', default=False,
+                           help='Only generate versions which do not exist.')
+        modes.add_argument('--only-stale', action='store_true', default=False,
+                           help='Only generate versions which do not exist or are older than their image.')
+        parser.add_argument('--checkpoint', default=None,
+                            help='File with the images done, which are skipped when running again (e.g. after an interruption).')
+        parser.add_argument('--noinput', '--no-input', action='store_false', dest='interactive', default=True,
+                            help='Do not ask for the version (generates all versions without --suffix).')
 
-        if not os.path.isdir(os.path.join(settings.MEDIA_ROOT, path)):
-            raise CommandError('<media_path> must be a directory in MEDIA_ROOT (If you don\'t add a media_path the default path is DIRECTORY).\n"%s" is no directory.' % path)
+    def handle(self, *args, **options):
+        site = default_site
+        if options['site']:
+            try:
+                site = get_site_dict()[options['site']]
+            except KeyError:
+                raise CommandError('FileBrowser site "%s" does not exist.' % options['site'])
+
+        path = options['path'] if options['path'] is not None else site.directory
+        if not site.storage.isdir(path):
+            raise CommandError('"%s" is no directory (If you don\'t add a path the default path is site.directory).' % path)
+
+        for version_name in options['versions']:
+            if version_name not in VERSIONS:
+                raise CommandError('Version "%s" doesn\'t exist.' % version_name)
+        version_suffixes = options['versions']
+        if not version_suffixes and options['interactive']:
+            version_suffixes = self.select_version()
+        if not version_suffixes:
+            version_suffixes = list(VERSIONS)
+
+        done = set()
+        checkpoint = None
+        if options['checkpoint']:
+            if os.path.exists(options['checkpoint']):
+                with io.open(options['checkpoint'], encoding='utf-8') as f:
+                    done = set(line.rstrip('\n') for line in f)
+            checkpoint = io.open(options['checkpoint'], 'a', encoding='utf-8')
+
+        mode = 'missing' if options['only_missing'] else 'stale' if options['only_stale'] else None
+        progress = Progress(self.stdout)
+        verbose = options['verbosity'] > 1
+
+        def finished(result):
+            image_path, versions, error = result
+            progress.add(versions, error)
+            if error:
+                self.stderr.write('Error with %s: %s\n' % (image_path, error))
+            else:
+                if verbose:
+                    self.stdout.write('%d version(s) generated for: %s\n' % (versions, image_path))
+                if checkpoint is not None:
+                    checkpoint.write(image_path + u'\n')
+                    checkpoint.flush()
+
+        def images():
+            filelisting = FileListing(path, filter_func=self.filter_images, site=site)
+            for fileobject in filelisting.files_walk_iter():
+                if fileobject.filetype != "Image":
+                    continue
+                if fileobject.path in done:
+                    progress.skipped += 1
+                    continue
+                yield fileobject.path
 
-        # get version name
+        try:
+            if options['workers'] > 0:
+                self.generate_with_pool(site, images(), version_suffixes, mode, options['workers'], finished, progress)
+            else:
+                for image_path in images():
+                    finished(generate_versions(site, image_path, version_suffixes, mode))
+                    progress.write()
+        finally:
+            if checkpoint is not None:
+                checkpoint.close()
+        progress.write(force=True)
+
+    def generate_with_pool(self, site, image_paths, version_suffixes, mode, workers, finished, progress):
+        "Generates versions with a pool of (spawned) worker processes, while walking"
+        context = multiprocessing.get_context('spawn') if hasattr(multiprocessing, 'get_context') else multiprocessing
+        pool = context.Pool(workers, initializer=django.setup)
+        # Only a few images per worker are queued, not the whole walk
+        slots = threading.BoundedSemaphore(workers * 4)
+
+        def callback(result):
+            try:
+                finished(result)
+            finally:
+                slots.release()
+
+        try:
+            for image_path in image_paths:
+                while not slots.acquire(False):
+                    progress.write()
+                    time.sleep(0.05)
+                pool.apply_async(generate_versions_in_worker, (site.app_name, site.name, image_path, version_suffixes, mode), callback=callback)
+                progress.write()
+            pool.close()
+            pool.join()
+        except KeyboardInterrupt:
+            pool.terminate()
+            raise
+
+    def select_version(self):
+        "Asks for a version, returns a list with the version (or an empty list for all versions)"
         while 1:
             self.stdout.write('\nSelect a version you want to generate:\n')
             for version in VERSIONS:
@@ -44,48 +205,10 @@ class Command(BaseCommand):
             version_name = input('(leave blank to generate all versions): ')
 
             if version_name == "":
-                selected_version = None
-                break
-            else:
-                try:
-                    tmp = VERSIONS[version_name]
-                    selected_version = version_name
-                    break
-                except:
-                    self.stderr.write('Error: Version "%s" doesn\'t exist.\n' % version_name)
-                    version_name = None
-                    continue
-
-        # filelisting
-        filelisting = FileListing(path, filter_func=self.filter_images)  # FIXME filterfunc: no hidden files, exclude list, no versions, just images!
-        for fileobject in filelisting.files_walk_filtered():
-            if fileobject.filetype == "Image":
-                if selected_version:
-                    self.stdout.write('generating version "%s" for: %s\n' % (selected_version, fileobject.path))
-                    versionobject = fileobject.version_generate(selected_version)  # FIXME force?
-                else:
-                    self.stdout.write('generating all versions for: %s\n' % fileobject.path)
-                    for version in VERSIONS:
-                        versionobject = fileobject.version_generate(version)  # FIXME force?
-
-        # # walkt throu the filebrowser directory
-        # # for all/new files (except file versions itself and excludes)
-        # for dirpath,dirnames,filenames in os.walk(path, followlinks=True):
-        #     rel_dir = os.path.relpath(dirpath, os.path.realpath(settings.MEDIA_ROOT))
-        #     for filename in filenames:
-        #         filtered = False
-        #         # no "hidden" files (stating with ".")
-        #         if filename.startswith('.'):
-        #             continue
-        #         # check the exclude list
-        #         for re_prefix in filter_re:
-        #             if re_prefix.search(filename):
-        #                 filtered = True
-        #         if filtered:
-        #             continue
-        #         (tmp, extension) = os.path.splitext(filename)
-        #         if extension in EXTENSIONS["Image"]:
-        #             self.createVersions(os.path.join(rel_dir, filename), selected_version)
+                return []
+            if version_name in VERSIONS:
+                return [version_name]
+            self.stderr.write('Error: Version "%s" doesn\'t exist.\n' % version_name)
 
     def filter_images(self, item):
         filtered = item.filename.startswith('.')
@@ -1,35 +1,138 @@
 # coding: utf-8
+import collections
 import os
 import re
-import sys
 
-from django.conf import settings
 from django.core.management.base import BaseCommand, CommandError
 from django.utils.six.moves import input
 
-from filebrowser.settings import EXCLUDE, EXTENSIONS
+from filebrowser import receivers
+from filebrowser.base import FileListing
+from filebrowser.settings import EXCLUDE, VERSIONS_BASEDIR
+from filebrowser.sites import site as default_site, get_site_dict
 
 
-class Command(BaseCommand):
-    args = '<media_path>'
-    help = "Remove Image-Versions within FILEBROWSER_DIRECTORY/MEDIA_ROOT."
-
-    def handle(self, *args, **options):
-
-        media_path = ""
-
-        if len(args):
-            media_path = args[0]
-
-        path = os.path.join(settings.MEDIA_ROOT, media_path)
+filter_re = []
+for exp in EXCLUDE:
+    filter_re.append(re.compile(exp))
 
-        if not os.path.isdir(path):
-            raise CommandError('<media_path> must be a directory in MEDIA_ROOT. "%s" is no directory.' % path)
 
-        self.stdout.write("\n%s\n" % self.help)
-        self.stdout.write("in this case: %s\n" % path)
+class Command(BaseCommand):
+    help = "Remove Image-Versions within VERSIONS_BASEDIR (or site.directory without VERSIONS_BASEDIR)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', default=None,
+                            help='Path relative to the storage location (defaults to VERSIONS_BASEDIR or site.directory).')
+        parser.add_argument('--site', default=None,
+                            help='Name of the FileBrowser site (defaults to the default site).')
+        parser.add_argument('--suffix', default=None,
+                            help='Name of the version to remove (as defined with VERSIONS).')
+        parser.add_argument('--prefixed', action='store_true', default=False,
+                            help='Versions are named with the version name as prefix (older versions of the FileBrowser).')
+        parser.add_argument('--dry-run', action='store_true', default=False,
+                            help='Only count (and with --verbosity 2 list) the files which would be removed.')
+        parser.add_argument('--batch-size', type=int, default=100,
+                            help='Number of files removed at once (default: 100).')
+        parser.add_argument('--noinput', '--no-input', action='store_false', dest='interactive', default=True,
+                            help='Do not ask for anything (requires --suffix).')
 
-        # get suffix or prefix
+    def handle(self, *args, **options):
+        site = default_site
+        if options['site']:
+            try:
+                site = get_site_dict()[options['site']]
+            except KeyError:
+                raise CommandError('FileBrowser site "%s" does not exist.' % options['site'])
+
+        path = options['path']
+        if path is None:
+            path = VERSIONS_BASEDIR or site.directory
+        if not site.storage.isdir(path):
+            raise CommandError('"%s" is no directory.' % path)
+
+        interactive = options['interactive']
+        version_name = options['suffix']
+        search_for_prefix = options['prefixed']
+        if not version_name:
+            if not interactive:
+                raise CommandError('--suffix is required with --noinput.')
+            self.stdout.write("\n%s\n" % self.help)
+            self.stdout.write("in this case: %s\n" % path)
+            search_for_prefix = self.select_prefix_or_suffix() == "p"
+            version_name = self.select_version_name()
+
+        dry_run = options['dry_run']
+        verbose = options['verbosity'] > 1
+        if dry_run or interactive:
+            # Counting is another walk, matches are not kept in memory
+            count = self.preview(site, path, version_name, search_for_prefix, verbose)
+            if dry_run:
+                self.stdout.write('%d file(s) would be removed.\n' % count)
+                return
+            if count == 0:
+                self.stdout.write('0 files removed.\n\n')
+                return
+            self.stdout.write('%d file(s) will be removed.\n\n' % count)
+            self.stdout.write('Are Sure you want to delete these files?\n')
+            if input('"y" for Yes or "n" for No (leave blank for "n"): ') != "y":
+                self.stdout.write('No files removed.\n\n')
+                return
+
+        self.count = 0
+        batch = []
+        for fileobject in self.get_files(site, path, version_name, search_for_prefix):
+            batch.append(fileobject)
+            if len(batch) >= options['batch_size']:
+                self.remove(site, batch, verbose)
+                batch = []
+        if batch:
+            self.remove(site, batch, verbose)
+        self.stdout.write('%d file(s) removed.\n\n' % self.count)
+
+    def preview(self, site, path, version_name, search_for_prefix, verbose):
+        "Counts the matching files, writes all of them with verbose or the first/last 5 otherwise"
+        count = 0
+        first = []
+        last = collections.deque(maxlen=5)
+        for fileobject in self.get_files(site, path, version_name, search_for_prefix):
+            count += 1
+            if verbose:
+                self.stdout.write('%s\n' % fileobject.path)
+            elif len(first) < 5:
+                first.append(fileobject.path)
+            else:
+                last.append(fileobject.path)
+        if not verbose and count:
+            self.stdout.write('\nFiles to remove:\n')
+            for current_file in first:
+                self.stdout.write('%s\n' % current_file)
+            if count > 10:
+                self.stdout.write('...\n')
+            for current_file in last:
+                self.stdout.write('%s\n' % current_file)
+        return count
+
+    def remove(self, site, fileobjects, verbose):
+        "Removes files with site.storage and forgets the versions of their originals"
+        originals = set()
+        for fileobject in fileobjects:
+            try:
+                site.storage.delete(fileobject.path)
+            except (OSError, IOError) as e:
+                self.stderr.write('Error removing %s: %s\n' % (fileobject.path, e))
+                continue
+            self.count += 1
+            if verbose:
+                self.stdout.write('Removed %s\n' % fileobject.path)
+            if fileobject.is_version:
+                try:
+                    originals.add(fileobject.original.path)
+                except Exception:
+                    pass
+        for original in originals:
+            receivers.forget_versions(site, original)
+
+    def select_prefix_or_suffix(self):
         default_prefix_or_suffix = "s"
         while 1:
             self.stdout.write('\nOlder versions of the FileBrowser used to prefix the filename with the version name.\n')
@@ -39,93 +142,39 @@ class Command(BaseCommand):
             if default_prefix_or_suffix and prefix_or_suffix == '':
                 prefix_or_suffix = default_prefix_or_suffix
             if prefix_or_suffix != "s" and prefix_or_suffix != "p":
-                sys.stderr.write('Error: "p" and "s" are the only valid inputs.\n')
-                prefix_or_suffix = None
+                self.stderr.write('Error: "p" and "s" are the only valid inputs.\n')
                 continue
-            break
+            return prefix_or_suffix
 
-        # get version name
+    def select_version_name(self):
         while 1:
             version_name = input('\nversion name as defined with VERSIONS: ')
 
             if version_name == "":
                 self.stderr.write('Error: You have to enter a version name.\n')
-                version_name = None
                 continue
-            else:
-                break
-
-        # get list of all matching files
-        files = self.get_files(path, version_name, (prefix_or_suffix == "p"))
-
-        # output (short version) of files to be deleted
-        if len(files) > 15:
-            self.stdout.write('\nFirst/Last 5 files to remove:\n')
-            for current_file in files[:5]:
-                self.stdout.write('%s\n' % current_file)
-            self.stdout.write('...\n')
-            self.stdout.write('...\n')
-            for current_file in files[len(files) - 5:]:
-                self.stdout.write('%s\n' % current_file)
-        else:
-            self.stdout.write('\nFiles to remove:\n')
-            for current_file in files:
-                self.stdout.write('%s\n' % current_file)
+            return version_name
 
-        # no files...done
-        if len(files) == 0:
-            self.stdout.write('0 files removed.\n\n')
-            return
-        else:
-            self.stdout.write('%d file(s) will be removed.\n\n' % len(files))
-
-        # ask to make sure
-        do_remove = ""
-        self.stdout.write('Are Sure you want to delete these files?\n')
-        do_remove = input('"y" for Yes or "n" for No (leave blank for "n"): ')
-
-        # if "yes" we delete. any different case we finish without removing anything
-        if do_remove == "y":
-            for current_file in files:
-                os.remove(current_file)
-            self.stdout.write('%d file(s) removed.\n\n' % len(files))
-        else:
-            self.stdout.write('No files removed.\n\n')
-        return
-
-    # get files mathing:
-    # path: search recoursive in this path (os.walk)
+    # get files matching (while walking path with site.storage):
     # version_name: string is pre/suffix of filename
     # search_for_prefix: if true we match against the start of the filename (default is the end)
-    def get_files(self, path, version_name, search_for_prefix):
-        file_list = []
-        # Precompile regular expressions
-        filter_re = []
-        for exp in EXCLUDE:
-            filter_re.append(re.compile(exp))
-
-        # walkt throu the filebrowser directory
-        # for all/new files (except file versions itself and excludes)
-        for dirpath, dirnames, filenames in os.walk(path, followlinks=True):
-            for filename in filenames:
-                filtered = False
-                # no "hidden" files (stating with ".")
-                if filename.startswith('.'):
-                    continue
-                # check the exclude list
-                for re_prefix in filter_re:
-                    if re_prefix.search(filename):
-                        filtered = True
-                if filtered:
-                    continue
-                (filename_noext, extension) = os.path.splitext(filename)
-                # images only
-                if extension in EXTENSIONS["Image"]:
-                    # if image matches with version_name we add it to the file_list
-                    if search_for_prefix:
-                        if filename_noext.startswith(version_name + "_"):
-                            file_list.append(os.path.join(dirpath, filename))
-                    elif filename_noext.endswith("_" + version_name):
-                        file_list.append(os.path.join(dirpath, filename))
-
-        return file_list
+    def get_files(self, site, path, version_name, search_for_prefix):
+        for fileobject in FileListing(path, site=site).walk_iter():
+            if fileobject.is_folder:
+                continue
+            filename = fileobject.filename
+            # no "hidden" files (stating with ".")
+            if filename.startswith('.'):
+                continue
+            # check the exclude list
+            if any(re_prefix.search(filename) for re_prefix in filter_re):
+                continue
+            # images only
+            if fileobject.filetype != "Image":
+                continue
+            filename_noext = os.path.splitext(filename)[0]
+            if search_for_prefix:
+                if filename_noext.startswith(version_name + "_"):
+                    yield fileobject
+            elif filename_noext.endswith("_" + version_name):
+                yield fileobject
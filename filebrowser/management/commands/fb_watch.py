@@ -0,0 +1,60 @@
+# coding: utf-8
+
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from filebrowser.base import FileObject
+from filebrowser.sites import site as default_site, get_site_dict
+from filebrowser.watcher import get_watcher, watch, PollingWatcher
+
+
+class Command(BaseCommand):
+    help = ("Watch site.storage.location + site.directory for changes made outside of the FileBrowser "
+            "(e.g. deploy scripts or rsync) and apply them to the index of the site.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--site', default=None,
+                            help='Name of the FileBrowser site (defaults to the default site).')
+        parser.add_argument('--polling', action='store_true', default=False,
+                            help='Poll for changes (instead of using inotify).')
+        parser.add_argument('--interval', type=float, default=2.0,
+                            help='Seconds between polls (default: 2).')
+        parser.add_argument('--delay', type=float, default=1.0,
+                            help='Apply changes once there have not been any changes for DELAY seconds (default: 1).')
+        parser.add_argument('--max-delay', type=float, default=10.0,
+                            help='Apply changes after MAX_DELAY seconds at the latest (default: 10).')
+
+    def handle(self, *args, **options):
+        site = default_site
+        if options['site']:
+            try:
+                site = get_site_dict()[options['site']]
+            except KeyError:
+                raise CommandError('FileBrowser site "%s" does not exist.' % options['site'])
+
+        if not hasattr(site.storage, 'location'):
+            raise CommandError('fb_watch requires a storage with a location on the server (e.g. FileSystemStorage).')
+
+        roots = [site.storage.path(site.directory)]
+        versions_basedir = FileObject('', site=site).versions_basedir
+        if versions_basedir and site.storage.isdir(versions_basedir):
+            roots.append(site.storage.path(versions_basedir))
+        roots = [r.rstrip(os.sep) for r in roots]
+
+        watcher = get_watcher(roots, polling=options['polling'])
+        if isinstance(watcher, PollingWatcher):
+            self.stdout.write('Polling for changes every %s seconds: %s\n' % (options['interval'], ', '.join(roots)))
+        else:
+            self.stdout.write('Watching for changes with inotify: %s\n' % ', '.join(roots))
+
+        def applied(count):
+            self.stdout.write('%d changed path(s) applied.\n' % count)
+
+        try:
+            watch(site, watcher, delay=options['delay'], max_delay=options['max_delay'],
+                  interval=options['interval'], callback=applied)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            watcher.close()
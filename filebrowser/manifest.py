@@ -0,0 +1,88 @@
+# coding: utf-8
+
+import hashlib
+import time
+
+from django.core.cache import caches
+from django.utils.encoding import force_bytes
+
+
+def options_signature(options):
+    "A signature of version options, which is the same with every process"
+    def represent(value):
+        if isinstance(value, dict):
+            return '{%s}' % ','.join('%s:%s' % (represent(k), represent(v)) for k, v in sorted(value.items()))
+        if isinstance(value, (list, tuple)):
+            return '[%s]' % ','.join(represent(v) for v in value)
+        if callable(value):
+            return '%s.%s' % (getattr(value, '__module__', ''), getattr(value, '__name__', value.__class__.__name__))
+        return repr(value)
+    return hashlib.md5(force_bytes(represent(options))).hexdigest()
+
+
+class VersionManifest(object):
+    """
+    Records the versions of originals with a cache (an alias of CACHES), so
+    that up to date versions are found without any storage calls.
+
+    The entry of an original contains its date and the path and options
+    signature of every version. Entries are forgotten with changes of an
+    original made through the FileBrowser (see filebrowser.receivers).
+    """
+
+    def __init__(self, cache, site, timeout=None):
+        self.cache = caches[cache]
+        self.site = site
+        self.timeout = timeout
+        self.key_prefix = 'filebrowser:%s:%s:manifest' % (site.app_name, site.name)
+
+    def _generation(self):
+        "Version of the keys, increased in order to forget all entries below a folder"
+        cache_key = '%s:generation' % self.key_prefix
+        generation = self.cache.get(cache_key)
+        if generation is None:
+            self.cache.add(cache_key, int(time.time() * 1000), None)
+            generation = self.cache.get(cache_key)
+        return generation
+
+    def _key(self, path):
+        return '%s:%s:%s' % (self.key_prefix, self._generation(), hashlib.md5(force_bytes(path)).hexdigest())
+
+    def versions(self, fileobject):
+        """
+        Returns a dict with the options signature for every version path of
+        fileobject (an empty dict without an entry or with an outdated entry,
+        if the date of fileobject is already known).
+        """
+        entry = self.cache.get(self._key(fileobject.path))
+        if entry is None:
+            return {}
+        try:
+            date = fileobject._date
+        except AttributeError:
+            date = entry['date']
+        if date != entry['date']:
+            return {}
+        return entry['versions']
+
+    def add(self, fileobject, versions):
+        "Records versions (a dict with the options signature for every version path) of fileobject"
+        if not versions:
+            return
+        key = self._key(fileobject.path)
+        entry = self.cache.get(key)
+        if entry is None or entry['date'] != fileobject.date:
+            entry = {'date': fileobject.date, 'versions': {}}
+        entry['versions'].update(versions)
+        self.cache.set(key, entry, self.timeout)
+
+    def forget(self, path, recursive=False):
+        "Forgets the versions of path (with recursive, of everything below path)"
+        if recursive:
+            cache_key = '%s:generation' % self.key_prefix
+            try:
+                self.cache.incr(cache_key)
+            except ValueError:
+                self.cache.set(cache_key, int(time.time() * 1000), None)
+        else:
+            self.cache.delete(self._key(path))
@@ -0,0 +1,94 @@
+# coding: utf-8
+
+import os
+
+from django.dispatch import receiver
+
+from filebrowser import signals
+
+
+# Keep the storage cache (see filebrowser.storage.CachedStorage), the version
+# manifest (see filebrowser.manifest) and the metadata index (see filebrowser.index)
+# of a site up to date with changes made through the FileBrowser, without
+# rescanning site.storage.
+# These functions are also used by changes detected otherwise (e.g. fb_watch).
+
+
+def invalidate(site, path):
+    "Forgets the cached storage data for path"
+    invalidate = getattr(site.storage, 'invalidate', None)
+    if invalidate is not None:
+        invalidate(path)
+
+
+def forget_versions(site, path, recursive=False):
+    "Forgets the versions of path recorded with the version manifest and the index"
+    manifest = getattr(site, 'manifest', None)
+    if manifest is not None:
+        manifest.forget(path, recursive=recursive)
+    index = getattr(site, 'index', None)
+    if index is not None:
+        index.forget_versions(path, recursive=recursive)
+
+
+def path_changed(site, path, recursive=False):
+    "path has been created or modified (with recursive, including everything below path)"
+    invalidate(site, path)
+    forget_versions(site, path, recursive=recursive and site.storage.isdir(path))
+    index = getattr(site, 'index', None)
+    if index is not None:
+        index.update(path, recursive=recursive)
+        index.update(os.path.dirname(path))
+
+
+def path_deleted(site, path):
+    "path (and everything below path) has been deleted"
+    invalidate(site, path)
+    forget_versions(site, path, recursive=True)
+    index = getattr(site, 'index', None)
+    if index is not None:
+        index.delete(path)
+        index.update(os.path.dirname(path))
+
+
+def path_moved(site, path, new_path):
+    "path (and everything below path) has been moved to new_path"
+    invalidate(site, path)
+    invalidate(site, new_path)
+    forget_versions(site, path, recursive=site.storage.isdir(new_path))
+    forget_versions(site, new_path)
+    index = getattr(site, 'index', None)
+    if index is not None:
+        index.rename(path, new_path)
+        index.update(os.path.dirname(path))
+        index.update(os.path.dirname(new_path))
+
+
+# SIGNAL RECEIVERS
+
+@receiver(signals.filebrowser_post_upload)
+def post_upload(sender, file, site, **kwargs):
+    path_changed(site, file.path)
+
+
+@receiver(signals.filebrowser_post_createdir)
+def post_createdir(sender, path, site, **kwargs):
+    path_changed(site, path)
+
+
+@receiver(signals.filebrowser_post_delete)
+def post_delete(sender, path, site, **kwargs):
+    path_deleted(site, path)
+
+
+@receiver(signals.filebrowser_post_rename)
+def post_rename(sender, path, new_name, site, **kwargs):
+    path_moved(site, path, os.path.join(os.path.dirname(path), new_name))
+
+
+@receiver(signals.filebrowser_actions_post_apply)
+def actions_post_apply(sender, site, **kwargs):
+    # Actions might change files (and delete their versions), so all of them are read again
+    fileobjects = kwargs.get('fileobjects', kwargs.get('fileobject')) or []
+    for fileobject in fileobjects:
+        path_changed(site, fileobject.path)
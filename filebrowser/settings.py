@@ -16,6 +16,9 @@ EXTENSIONS = getattr(settings, "FILEBROWSER_EXTENSIONS", {
     'Video': ['.mov', '.mp4', '.m4v', '.webm', '.wmv', '.mpeg', '.mpg', '.avi', '.rm'],
     'Audio': ['.mp3', '.wav', '.aiff', '.midi', '.m4p']
 })
+# Filetype for each (lower case) extension, used to look up FileObject.filetype.
+# Sites with other EXTENSIONS get their own map (see FileBrowserSite.extensions).
+EXTENSION_MAP = dict((extension.lower(), filetype) for filetype, extensions in EXTENSIONS.items() for extension in extensions)
 # Define different formats for allowed selections.
 # This has to be a subset of EXTENSIONS.
 # e.g., add ?type=image to the browse-URL ...
@@ -43,15 +46,55 @@ VERSIONS = getattr(settings, "FILEBROWSER_VERSIONS", {
 })
 # Quality of saved versions
 VERSION_QUALITY = getattr(settings, 'FILEBROWSER_VERSION_QUALITY', 90)
+# Images (versions and images changed with actions) up to this size in bytes are encoded in memory before
+# being saved with the storage, larger images are spilled to a temporary file.
+VERSION_SPOOL_SIZE = getattr(settings, 'FILEBROWSER_VERSION_SPOOL_SIZE', 4 * 1024 * 1024)
 # Versions available within the Admin-Interface.
 ADMIN_VERSIONS = getattr(settings, 'FILEBROWSER_ADMIN_VERSIONS', ['thumbnail', 'small', 'medium', 'big', 'large'])
 # Which Version should be used as Admin-thumbnail.
 ADMIN_THUMBNAIL = getattr(settings, 'FILEBROWSER_ADMIN_THUMBNAIL', 'admin_thumbnail')
 
+# Decode images with a smaller size (JPEG draft mode) or reduce them right after
+# decoding, if all versions being generated are much smaller than the original.
+# Can be disabled for a single version with 'draft': False in VERSIONS.
+VERSION_DRAFT = getattr(settings, 'FILEBROWSER_VERSION_DRAFT', True)
 VERSION_PROCESSORS = getattr(settings, 'FILEBROWSER_VERSION_PROCESSORS', [
     'filebrowser.utils.scale_and_crop',
 ])
 VERSION_NAMER = getattr(settings, 'FILEBROWSER_VERSION_NAMER', 'filebrowser.namers.VersionNamer')
+# Generate missing versions with the version templatetag in the background (with a
+# pool of worker processes) instead of while rendering the template. Until a version
+# is ready, the templatetag returns the version of PLACEHOLDER (or the original image).
+VERSIONS_ASYNC = getattr(settings, 'FILEBROWSER_VERSIONS_ASYNC', False)
+# Number of worker processes with VERSIONS_ASYNC (0 generates versions with a
+# thread of the current process).
+VERSIONS_ASYNC_WORKERS = getattr(settings, 'FILEBROWSER_VERSIONS_ASYNC_WORKERS', 2)
+# Number of threads generating the missing admin thumbnails of a page of the browse view
+# before rendering (0 or 1, the default, generates them one after the other).
+BROWSE_THUMBNAIL_WORKERS = getattr(settings, 'FILEBROWSER_BROWSE_THUMBNAIL_WORKERS', 0)
+# max-age (in seconds) of versions served with the fb_version_serve view (see the version_url templatetag).
+VERSIONS_SERVE_MAX_AGE = getattr(settings, 'FILEBROWSER_VERSIONS_SERVE_MAX_AGE', 60 * 60 * 24 * 365)
+# Let the web server send versions served with the fb_version_serve view: 'X-Accel-Redirect'
+# (nginx, with the URL of the version) or 'X-Sendfile' (Apache, lighttpd, with the path of the version).
+# Leave empty in order to stream versions with Django.
+VERSIONS_SERVE_SENDFILE = getattr(settings, 'FILEBROWSER_VERSIONS_SERVE_SENDFILE', None)
+# Class (dotted path) locking a version while it is generated, so that a version is
+# generated by a single process only (see filebrowser.locks). Leave empty in order to use
+# file locks with FileSystemStorage and cache locks (STORAGE_CACHE or default) otherwise.
+VERSION_LOCK = getattr(settings, 'FILEBROWSER_VERSION_LOCK', None)
+# Seconds to wait for a version being generated by another process.
+VERSION_LOCK_TIMEOUT = getattr(settings, 'FILEBROWSER_VERSION_LOCK_TIMEOUT', 10)
+# Cache (an alias of CACHES) for a manifest of the versions of every original, so that
+# up to date versions are found without storage calls. Changes made outside of the
+# FileBrowser need fb_watch. Leave empty in order to check versions with site.storage.
+VERSION_MANIFEST = getattr(settings, 'FILEBROWSER_VERSION_MANIFEST', None)
+# Timeout (in seconds) for the entries of VERSION_MANIFEST, None keeps them until they are invalidated.
+VERSION_MANIFEST_TIMEOUT = getattr(settings, 'FILEBROWSER_VERSION_MANIFEST_TIMEOUT', None)
+# Path (relative to the storage location) of a content-addressed store of versions, so that
+# versions of identical originals are generated only once (with hard links, FileSystemStorage only,
+# see filebrowser.version_store).
+# Leave empty in order to generate the versions of every original.
+VERSION_STORE = getattr(settings, 'FILEBROWSER_VERSION_STORE', None)
 
 # PLACEHOLDER
 
@@ -95,6 +138,24 @@ DEFAULT_SORTING_ORDER = getattr(settings, "FILEBROWSER_DEFAULT_SORTING_ORDER", "
 FOLDER_REGEX = getattr(settings, "FILEBROWSER_FOLDER_REGEX", r'^[\w._\ /-]+$')
 # Traverse directories when searching
 SEARCH_TRAVERSE = getattr(settings, "FILEBROWSER_SEARCH_TRAVERSE", False)
+# Cache (an alias of CACHES) for the results of storage calls (exists, isdir, isfile, size,
+# modified_time and listdir) across requests. Leave empty in order to cache them
+# during a single request only.
+STORAGE_CACHE = getattr(settings, "FILEBROWSER_STORAGE_CACHE", None)
+# Timeout (in seconds) for the results of storage calls with STORAGE_CACHE.
+STORAGE_CACHE_TIMEOUT = getattr(settings, "FILEBROWSER_STORAGE_CACHE_TIMEOUT", 60)
+# Cache (an alias of CACHES) for image dimensions, with the path and modification date
+# of the image. Leave empty in order to read the dimensions (the header of the image) every time.
+DIMENSIONS_CACHE = getattr(settings, "FILEBROWSER_DIMENSIONS_CACHE", None)
+# Timeout (in seconds) for dimensions with DIMENSIONS_CACHE (None caches them forever).
+DIMENSIONS_CACHE_TIMEOUT = getattr(settings, "FILEBROWSER_DIMENSIONS_CACHE_TIMEOUT", None)
+# Number of threads reading folders ahead when walking a directory tree (e.g. with
+# SEARCH_TRAVERSE). Helps with storages with a high latency, e.g. network filesystems.
+# 0 or 1 reads one folder after the other.
+WALK_WORKERS = getattr(settings, "FILEBROWSER_WALK_WORKERS", 0)
+# Path to a SQLite database for the metadata index of FileBrowser sites (see filebrowser.index)
+# Leave empty in order to disable the index (files are listed with site.storage)
+INDEX_DATABASE = getattr(settings, "FILEBROWSER_INDEX_DATABASE", None)
 # Default Upload and Version Permissions
 DEFAULT_PERMISSIONS = getattr(settings, "FILEBROWSER_DEFAULT_PERMISSIONS", 0o755)
 # Overwrite existing files on upload
@@ -105,6 +166,13 @@ OVERWRITE_EXISTING = getattr(settings, "FILEBROWSER_OVERWRITE_EXISTING", True)
 # Directory to Save temporary uploaded files (FileBrowseUploadField)
 # Relative to site.storage.location.
 UPLOAD_TEMPDIR = getattr(settings, 'FILEBROWSER_UPLOAD_TEMPDIR', '_temp')
+# Versions generated right after an image has been uploaded (a list of version suffixes),
+# instead of when they are shown for the first time. Can be defined per site with
+# site.upload_versions.
+UPLOAD_VERSIONS = getattr(settings, 'FILEBROWSER_UPLOAD_VERSIONS', [])
+# Generate UPLOAD_VERSIONS in the background (see VERSIONS_ASYNC_WORKERS) instead of
+# with the upload request.
+UPLOAD_VERSIONS_ASYNC = getattr(settings, 'FILEBROWSER_UPLOAD_VERSIONS_ASYNC', False)
 
 # EXTRA TRANSLATION STRINGS
 
@@ -1,7 +1,9 @@
 # coding: utf-8
 
+import hashlib
 import os
 import re
+from multiprocessing.pool import ThreadPool
 from time import gmtime, strftime, localtime, time
 
 from django import forms
@@ -10,9 +12,12 @@ from django.contrib.admin.views.decorators import staff_member_required
 from django.core.files.storage import DefaultStorage, default_storage, FileSystemStorage
 from django.core.paginator import Paginator, InvalidPage, EmptyPage
 from django.urls import reverse, get_urlconf, get_resolver
-from django.http import HttpResponseRedirect, HttpResponseBadRequest
+from django.http import FileResponse, Http404, HttpResponseRedirect, HttpResponseBadRequest
 from django.shortcuts import render, HttpResponse
 from django.template import RequestContext as Context
+from django.utils.cache import get_conditional_response
+from django.utils.encoding import force_bytes
+from django.utils.http import http_date, quote_etag
 from django.utils.translation import ugettext as _
 from django.views.decorators.cache import never_cache
 from django.views.decorators.csrf import csrf_exempt
@@ -22,14 +27,21 @@ except ImportError:
     from django.utils.encoding import smart_unicode as smart_text
 
 from filebrowser import signals
-from filebrowser.base import FileListing, FileObject
+from filebrowser.base import FileListing, FileObject, find_versions
 from filebrowser.decorators import path_exists, file_exists
-from filebrowser.storage import FileSystemStorageMixin
+from filebrowser.index import FileIndex
+from filebrowser.manifest import VersionManifest, options_signature
+from filebrowser.storage import CachedStorage, FileSystemStorageMixin
 from filebrowser.templatetags.fb_tags import query_helper
 from filebrowser.utils import convert_filename
-from filebrowser.settings import (DIRECTORY, EXTENSIONS, SELECT_FORMATS, ADMIN_VERSIONS, ADMIN_THUMBNAIL, MAX_UPLOAD_SIZE, NORMALIZE_FILENAME,
+from filebrowser.version_store import VersionStore
+from filebrowser import version_queue
+from filebrowser.settings import (DIRECTORY, EXTENSIONS, EXTENSION_MAP, SELECT_FORMATS, ADMIN_VERSIONS, ADMIN_THUMBNAIL, MAX_UPLOAD_SIZE, NORMALIZE_FILENAME,
                                   CONVERT_FILENAME, SEARCH_TRAVERSE, EXCLUDE, VERSIONS, VERSIONS_BASEDIR, EXTENSION_LIST, DEFAULT_SORTING_BY, DEFAULT_SORTING_ORDER,
-                                  LIST_PER_PAGE, OVERWRITE_EXISTING, DEFAULT_PERMISSIONS, UPLOAD_TEMPDIR)
+                                  LIST_PER_PAGE, OVERWRITE_EXISTING, DEFAULT_PERMISSIONS, UPLOAD_TEMPDIR, INDEX_DATABASE,
+                                  STORAGE_CACHE, STORAGE_CACHE_TIMEOUT, VERSION_MANIFEST, VERSION_MANIFEST_TIMEOUT, UPLOAD_VERSIONS,
+                                  UPLOAD_VERSIONS_ASYNC, VERSIONS_ASYNC, BROWSE_THUMBNAIL_WORKERS,
+                                  VERSIONS_SERVE_MAX_AGE, VERSIONS_SERVE_SENDFILE, VERSION_STORE)
 
 try:
     import json
@@ -183,6 +195,11 @@ class FileBrowserSite(object):
 
         # Per-site settings:
         self.directory = DIRECTORY
+        self.extensions = EXTENSIONS
+        self.upload_versions = UPLOAD_VERSIONS
+        self.index = FileIndex(INDEX_DATABASE, site=self) if INDEX_DATABASE else None
+        self.manifest = VersionManifest(VERSION_MANIFEST, site=self, timeout=VERSION_MANIFEST_TIMEOUT) if VERSION_MANIFEST else None
+        self.version_store = VersionStore(VERSION_STORE, site=self) if VERSION_STORE else None
 
     def _directory_get(self):
         "Set directory"
@@ -194,6 +211,33 @@ class FileBrowserSite(object):
 
     directory = property(_directory_get, _directory_set)
 
+    def _storage_get(self):
+        "Get storage"
+        return self._storage
+
+    def _storage_set(self, val):
+        "Set storage (wrapped with CachedStorage)"
+        if not isinstance(val, CachedStorage):
+            val = CachedStorage(val, cache=STORAGE_CACHE, timeout=STORAGE_CACHE_TIMEOUT,
+                                key_prefix='filebrowser:%s:%s' % (self.app_name, self.name))
+        self._storage = val
+
+    storage = property(_storage_get, _storage_set)
+
+    def _extensions_get(self):
+        "Get extensions"
+        return self._extensions
+
+    def _extensions_set(self, val):
+        "Set extensions (and the map of lower case extensions to filetypes)"
+        self._extensions = val
+        if val is EXTENSIONS:
+            self.extension_map = EXTENSION_MAP
+        else:
+            self.extension_map = dict((extension.lower(), filetype) for filetype, extensions in val.items() for extension in extensions)
+
+    extensions = property(_extensions_get, _extensions_set)
+
     def get_urls(self):
         "URLs for a filebrowser.site"
         from django.conf.urls import url
@@ -208,6 +252,7 @@ class FileBrowserSite(object):
             url(r'^detail/$', file_exists(self, path_exists(self, filebrowser_view(self.detail))), name="fb_detail"),
             url(r'^version/$', file_exists(self, path_exists(self, filebrowser_view(self.version))), name="fb_version"),
             url(r'^upload_file/$', staff_member_required(csrf_exempt(self._upload_file)), name="fb_do_upload"),
+            url(r'^versions/(?P<version_suffix>[^/]+)/(?P<path>.+)$', self.serve_version, name="fb_version_serve"),
         ]
         return urlpatterns
 
@@ -295,12 +340,6 @@ class FileBrowserSite(object):
             sorting_order=query.get('ot', DEFAULT_SORTING_ORDER),
             site=self)
 
-        files = []
-        if SEARCH_TRAVERSE and query.get("q"):
-            listing = filelisting.files_walk_filtered()
-        else:
-            listing = filelisting.files_listing_filtered()
-
         # If we do a search, precompile the search pattern now
         do_search = query.get("q")
         if do_search:
@@ -309,6 +348,22 @@ class FileBrowserSite(object):
         filter_type = query.get('filter_type')
         filter_date = query.get('filter_date')
 
+        index_query = filelisting.index_query(recursive=bool(SEARCH_TRAVERSE and do_search))
+        if index_query is not None:
+            # filter, sort and paginate with the metadata index
+            listing = index_query.filter(exclude=[re.compile(r'^\.')] + filter_re)
+            files = listing.filter(filetype=filter_type, filter_date=filter_date, search=re_q if do_search else None)
+            if not index_query.is_ordered:
+                files = filelisting.sort_lazily(files)
+            return self._browse_render(request, query, filelisting, listing, files)
+
+        # filter first, then only sort as far as needed for the requested page
+        files = []
+        if SEARCH_TRAVERSE and do_search:
+            listing = filelisting.files_walk_filtered(sort=False)
+        else:
+            listing = filelisting.files_listing_filtered(sort=False)
+
         for fileobject in listing:
             # date/type filter
             append = False
@@ -321,6 +376,11 @@ class FileBrowserSite(object):
             if append:
                 files.append(fileobject)
 
+        files = filelisting.sort_lazily(files)
+        return self._browse_render(request, query, filelisting, listing, files)
+
+    def _browse_render(self, request, query, filelisting, listing, files):
+        "Paginate the filtered files and render the browse view"
         filelisting.results_total = len(listing)
         filelisting.results_current = len(files)
 
@@ -330,6 +390,7 @@ class FileBrowserSite(object):
             page = p.page(page_nr)
         except (EmptyPage, InvalidPage):
             page = p.page(p.num_pages)
+        self._prefetch_thumbnails(page.object_list)
 
         request.current_app = self.name
         return render(request, 'filebrowser/index.html', {
@@ -344,6 +405,35 @@ class FileBrowserSite(object):
             'filebrowser_site': self
         })
 
+    def _prefetch_thumbnails(self, fileobjects):
+        """
+        Finds the admin thumbnails of a page at once (see find_versions) and
+        generates the missing ones with a pool of threads, so that the version
+        templatetag of every row gets the thumbnail without storage calls.
+        """
+        fileobjects = [fileobject for fileobject in fileobjects if fileobject.site is self]
+        found = find_versions(fileobjects, [ADMIN_THUMBNAIL])
+        if VERSIONS_ASYNC:
+            # missing thumbnails are queued with the templatetag
+            return
+        missing = [fileobject for fileobject in fileobjects if fileobject.path in found and found[fileobject.path][ADMIN_THUMBNAIL] is None]
+        if len(missing) < 2 or BROWSE_THUMBNAIL_WORKERS < 2:
+            return
+
+        def generate(fileobject):
+            try:
+                fileobject.versions_generate([ADMIN_THUMBNAIL])
+            except Exception:
+                # errors are handled with the version templatetag
+                pass
+
+        pool = ThreadPool(min(BROWSE_THUMBNAIL_WORKERS, len(missing)))
+        try:
+            pool.map(generate, missing)
+        finally:
+            pool.close()
+            pool.join()
+
     def createdir(self, request):
         "Create Directory"
         from filebrowser.forms import CreateDirForm
@@ -406,10 +496,9 @@ class FileBrowserSite(object):
                 sorting_by=query.get('o', 'filename'),
                 sorting_order=query.get('ot', DEFAULT_SORTING_ORDER),
                 site=self)
-            filelisting = filelisting.files_walk_total()
-            if len(filelisting) > 100:
-                additional_files = len(filelisting) - 100
-                filelisting = filelisting[:100]
+            filelisting, total = filelisting.files_walk_head(100)
+            if total > 100:
+                additional_files = total - 100
             else:
                 additional_files = None
         else:
@@ -491,6 +580,14 @@ class FileBrowserSite(object):
         else:
             form = ChangeForm(initial={"name": fileobject.filename}, path=path, fileobject=fileobject, filebrowser_site=self)
 
+        if fileobject.filetype == "Image":
+            # Generate the versions shown with the detail page at once, decoding the image only once
+            try:
+                fileobject.versions_generate([v for v in [ADMIN_THUMBNAIL] + list(ADMIN_VERSIONS) if v in VERSIONS])
+            except Exception:
+                # errors are handled with the version templatetag
+                pass
+
         request.current_app = self.name
         return render(request, 'filebrowser/detail.html', {
             'form': form,
@@ -520,6 +617,47 @@ class FileBrowserSite(object):
             'filebrowser_site': self
         })
 
+    def serve_version(self, request, version_suffix, path):
+        """
+        Serves a version of an image (path is relative to site.directory),
+        which is generated with the first request. This view is not restricted
+        to staff members, like the versions within MEDIA_URL.
+
+        The ETag is derived from the modification date of the image and the
+        options of the version, so that clients revalidate without generating
+        the version.
+        """
+        if version_suffix not in VERSIONS:
+            raise Http404("Version does not exist.")
+        path = os.path.normpath(path).replace('\\', '/')
+        if os.path.isabs(path) or any(part.startswith('.') for part in path.split('/')):
+            raise Http404("File does not exist.")
+        fileobject = FileObject(os.path.join(self.directory, path), site=self)
+        if fileobject.filetype != "Image" or fileobject.is_version or not fileobject.exists or fileobject.is_folder:
+            raise Http404("File does not exist.")
+
+        last_modified = int(fileobject.date)
+        signature = options_signature(fileobject._get_options(version_suffix))
+        etag = quote_etag(hashlib.md5(force_bytes('%s:%s:%s:%s' % (fileobject.path, version_suffix, last_modified, signature))).hexdigest())
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is None:
+            version = fileobject.version_generate(version_suffix)
+            if not version.path:
+                raise Http404("Version could not be generated.")
+            content_type = version.mimetype[0] or 'application/octet-stream'
+            if VERSIONS_SERVE_SENDFILE == 'X-Accel-Redirect':
+                response = HttpResponse(content_type=content_type)
+                response['X-Accel-Redirect'] = version.url
+            elif VERSIONS_SERVE_SENDFILE:
+                response = HttpResponse(content_type=content_type)
+                response[VERSIONS_SERVE_SENDFILE] = version.path_full
+            else:
+                response = FileResponse(self.storage.open(version.path), content_type=content_type)
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+        response['Cache-Control'] = 'public, max-age=%d' % VERSIONS_SERVE_MAX_AGE
+        return response
+
     def _upload_file(self, request):
         """
         Upload file to the server.
@@ -572,6 +710,7 @@ class FileBrowserSite(object):
                 old_file = smart_text(file_path)
                 new_file = smart_text(uploadedfile)
                 self.storage.move(new_file, old_file, allow_overwrite=True)
+                file_name = old_file
                 full_path = FileObject(smart_text(old_file), site=self).path_full
             else:
                 file_name = smart_text(uploadedfile)
@@ -584,11 +723,28 @@ class FileBrowserSite(object):
 
             f = FileObject(smart_text(file_name), site=self)
             signals.filebrowser_post_upload.send(sender=request, path=folder, file=f, site=self)
+            if not temp_filename:
+                self._generate_upload_versions(f, filedata)
 
             # let Ajax Upload know whether we saved it or not
             ret_json = {'success': True, 'filename': f.filename, 'temp_filename': temp_filename}
             return HttpResponse(json.dumps(ret_json), content_type="application/json")
 
+    def _generate_upload_versions(self, fileobject, filedata):
+        "Generate the versions of an uploaded image (see UPLOAD_VERSIONS)"
+        if not self.upload_versions or fileobject.filetype != "Image":
+            return
+        if UPLOAD_VERSIONS_ASYNC:
+            for version_suffix in self.upload_versions:
+                version_queue.queue.add(fileobject, version_suffix)
+            return
+        try:
+            # the uploaded file is read instead of site.storage
+            fileobject.versions_generate(self.upload_versions, source=filedata)
+        except Exception:
+            # errors are handled with the version templatetag
+            pass
+
 storage = DefaultStorage()
 # Default FileBrowser site
 site = FileBrowserSite(name='filebrowser', storage=storage)
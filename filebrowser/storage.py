@@ -1,14 +1,48 @@
 # coding: utf-8
 
+import calendar
+import datetime
+import hashlib
 import os
 import shutil
+import threading
+import time
 
+from django.core.cache import caches
 from django.core.files.move import file_move_safe
-from django.utils.encoding import smart_text
+from django.core.signals import request_finished, request_started
+from django.dispatch import receiver
+from django.utils.encoding import force_bytes, force_text, smart_text
 
 from filebrowser.base import FileObject
 from filebrowser.settings import DEFAULT_PERMISSIONS
 
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+
+class StorageEntry(object):
+    """
+    An entry of StorageMixin.scandir for storages without os.scandir (with
+    the attribute name and the methods is_dir() and stat(), like os.DirEntry).
+    """
+
+    def __init__(self, name, is_dir, size=0, mtime=0):
+        self.name = name
+        self._is_dir = is_dir
+        self._stat = os.stat_result((0, 0, 0, 0, 0, 0, size, mtime, mtime, mtime))
+
+    def is_dir(self):
+        return self._is_dir
+
+    def stat(self):
+        return self._stat
+
 
 class StorageMixin(object):
     """
@@ -27,6 +61,13 @@ class StorageMixin(object):
         """
         raise NotImplementedError()
 
+    def scandir(self, name):
+        """
+        Returns a list of the entries of directory name. Every entry provides
+        the attribute name and the methods is_dir() and stat(), like os.DirEntry.
+        """
+        raise NotImplementedError()
+
     def move(self, old_file_name, new_file_name, allow_overwrite=False):
         """
         Moves safely a file from one location to another.
@@ -53,6 +94,13 @@ class StorageMixin(object):
         """
         raise NotImplementedError()
 
+    def read_header(self, name, size):
+        """
+        Returns the first size bytes of name without reading the whole file
+        (e.g. for image dimensions, see filebrowser.dimensions).
+        """
+        raise NotImplementedError()
+
 
 class FileSystemStorageMixin(StorageMixin):
 
@@ -62,6 +110,11 @@ class FileSystemStorageMixin(StorageMixin):
     def isfile(self, name):
         return os.path.isfile(self.path(name))
 
+    def scandir(self, name):
+        if scandir is None:
+            raise NotImplementedError()
+        return list(scandir(self.path(name)))
+
     def move(self, old_file_name, new_file_name, allow_overwrite=False):
         file_move_safe(self.path(old_file_name), self.path(new_file_name), allow_overwrite=True)
 
@@ -75,6 +128,10 @@ class FileSystemStorageMixin(StorageMixin):
         full_path = FileObject(smart_text(name), site=self).path_full
         os.chmod(full_path, DEFAULT_PERMISSIONS)
 
+    def read_header(self, name, size):
+        with open(self.path(name), 'rb') as f:
+            return f.read(size)
+
 
 class S3BotoStorageMixin(StorageMixin):
 
@@ -99,6 +156,26 @@ class S3BotoStorageMixin(StorageMixin):
             return True
         return False
 
+    def scandir(self, name):
+        # A single listing of the prefix (with keys and "subdirectories")
+        prefix = self._normalize_name(self._clean_name(name))
+        if prefix and not prefix.endswith('/'):
+            prefix += '/'
+        entries = []
+        for item in self.bucket.list(self._encode_name(prefix), '/'):
+            entry_name = item.name[len(prefix):]
+            if not entry_name.rstrip('/'):
+                # the key of the directory itself
+                continue
+            last_modified = getattr(item, 'last_modified', None)
+            if last_modified is None:
+                # a common prefix
+                entries.append(StorageEntry(entry_name.rstrip('/'), True))
+            else:
+                mtime = calendar.timegm(datetime.datetime.strptime(last_modified[:19], '%Y-%m-%dT%H:%M:%S').timetuple())
+                entries.append(StorageEntry(entry_name, False, item.size, mtime))
+        return entries
+
     def move(self, old_file_name, new_file_name, allow_overwrite=False):
 
         if self.exists(new_file_name):
@@ -131,3 +208,166 @@ class S3BotoStorageMixin(StorageMixin):
         # is set in settings.py with AWS_DEFAULT_ACL.
         # More info: http://django-common-configs.readthedocs.org/en/latest/configs/storage.html
         pass
+
+    def read_header(self, name, size):
+        # Ranged GET, instead of downloading the whole key
+        key_name = self._encode_name(self._normalize_name(self._clean_name(name)))
+        key = self.bucket.get_key(key_name)
+        if key is None:
+            raise IOError("File does not exist: %s" % name)
+        return key.get_contents_as_string(headers={'Range': 'bytes=0-%d' % (size - 1)})
+
+
+# Results of storage calls during the current request (see CachedStorage),
+# None outside of requests (e.g. with management commands).
+_request_cache = threading.local()
+
+
+@receiver(request_started)
+def start_request_cache(sender, **kwargs):
+    _request_cache.data = {}
+
+
+@receiver(request_finished)
+def end_request_cache(sender, **kwargs):
+    _request_cache.data = None
+
+
+_MISSING = object()
+
+
+class CachedStorage(object):
+    """
+    Wraps a storage and caches the results of exists, isdir, isfile, size,
+    modified_time and listdir: during a request and, with cache (an alias
+    of CACHES), across requests for timeout seconds.
+
+    Writing through CachedStorage (or calling invalidate, see
+    filebrowser.receivers) forgets the results for a path, everything below
+    it and its parent folder. All other attributes are the ones of storage.
+    """
+
+    def __init__(self, storage, cache=None, timeout=60, key_prefix='filebrowser'):
+        self.storage = storage
+        self.cache = caches[cache] if cache else None
+        self.timeout = timeout
+        self.key_prefix = key_prefix
+
+    def __getattr__(self, name):
+        if name == 'storage':
+            raise AttributeError(name)
+        return getattr(self.storage, name)
+
+    def __repr__(self):
+        return "<%s: %r>" % (self.__class__.__name__, self.storage)
+
+    # CACHE HELPERS
+    # _generation
+    # _cached
+    # invalidate
+
+    def _generation(self, memo):
+        """
+        Version of the keys in cache, which is increased with every
+        invalidation (the keys of a path and everything below it can't
+        be deleted from a cache).
+        """
+        key = (id(self), 'generation', None)
+        if memo is not None and key in memo:
+            return memo[key]
+        cache_key = '%s:generation' % self.key_prefix
+        generation = self.cache.get(cache_key)
+        if generation is None:
+            # start with a new number, so that keys of an evicted generation are not used again
+            self.cache.add(cache_key, int(time.time() * 1000), None)
+            generation = self.cache.get(cache_key)
+        if memo is not None:
+            memo[key] = generation
+        return generation
+
+    def _cached(self, method, name):
+        name = force_text(name)
+        memo = getattr(_request_cache, 'data', None)
+        key = (id(self), method, name)
+        if memo is not None and key in memo:
+            return memo[key]
+        value = _MISSING
+        if self.cache is not None:
+            cache_key = '%s:%s:%s:%s' % (self.key_prefix, self._generation(memo), method, hashlib.md5(force_bytes(name)).hexdigest())
+            value = self.cache.get(cache_key, _MISSING)
+        if value is _MISSING:
+            value = getattr(self.storage, method)(name)
+            if self.cache is not None:
+                self.cache.set(cache_key, value, self.timeout)
+        if memo is not None:
+            memo[key] = value
+        return value
+
+    def invalidate(self, name):
+        "Forgets the results for name, everything below name and its parent folder"
+        name = force_text(name).rstrip('/')
+        parent = os.path.dirname(name)
+        memo = getattr(_request_cache, 'data', None)
+        if memo is not None:
+            for key in list(memo):
+                storage_id, method, path = key
+                if storage_id == id(self) and path is not None:
+                    path = path.rstrip('/')
+                    if path == name or path == parent or path.startswith(name + '/') or not name:
+                        del memo[key]
+            memo.pop((id(self), 'generation', None), None)
+        if self.cache is not None:
+            cache_key = '%s:generation' % self.key_prefix
+            try:
+                self.cache.incr(cache_key)
+            except ValueError:
+                self.cache.set(cache_key, int(time.time() * 1000), None)
+
+    # CACHED METHODS
+
+    def exists(self, name):
+        return self._cached('exists', name)
+
+    def isdir(self, name):
+        return self._cached('isdir', name)
+
+    def isfile(self, name):
+        return self._cached('isfile', name)
+
+    def size(self, name):
+        return self._cached('size', name)
+
+    def modified_time(self, name):
+        return self._cached('modified_time', name)
+
+    def listdir(self, path):
+        return self._cached('listdir', path)
+
+    # WRITE METHODS
+
+    def open(self, name, mode='rb'):
+        if set(mode) & set('wa+'):
+            self.invalidate(name)
+        return self.storage.open(name, mode)
+
+    def save(self, name, content, max_length=None):
+        name = self.storage.save(name, content, max_length=max_length)
+        self.invalidate(name)
+        return name
+
+    def delete(self, name):
+        self.storage.delete(name)
+        self.invalidate(name)
+
+    def move(self, old_file_name, new_file_name, allow_overwrite=False):
+        self.storage.move(old_file_name, new_file_name, allow_overwrite=allow_overwrite)
+        self.invalidate(old_file_name)
+        self.invalidate(new_file_name)
+
+    def makedirs(self, name):
+        self.storage.makedirs(name)
+        self.invalidate(name)
+
+    def rmtree(self, name):
+        self.storage.rmtree(name)
+        self.invalidate(name)
@@ -5,7 +5,7 @@ from django.template import TemplateSyntaxError
 from django.utils.http import urlquote
 from django.utils.safestring import mark_safe
 
-from filebrowser.settings import EXTENSIONS, SELECT_FORMATS
+from filebrowser.settings import EXTENSIONS, EXTENSION_MAP, SELECT_FORMATS
 
 
 register = template.Library()
@@ -143,20 +143,19 @@ def selectable(parser, token):
 register.tag(selectable)
 
 
-def get_file_extensions(qs):
+def get_file_extensions(qs, site=None):
     extensions = []
     if "type" in qs and qs.get("type") in SELECT_FORMATS:
+        site_extensions = getattr(site, 'extensions', EXTENSIONS)
         for format in SELECT_FORMATS.get(qs.get("type"), []):
-            extensions.extend(EXTENSIONS[format])
+            extensions.extend(site_extensions[format])
     else:
-        for k, v in EXTENSIONS.items():
-            for item in v:
-                if item:
-                    extensions.append(item)
+        extension_map = getattr(site, 'extension_map', EXTENSION_MAP)
+        extensions = [item for item in extension_map if item]
     return extensions
 
 
 # Django 1.9 auto escapes simple_tag unless marked as safe
 @register.simple_tag(name='get_file_extensions')
-def get_file_extensions_safe(qs):
-    return mark_safe(get_file_extensions(qs))
+def get_file_extensions_safe(qs, site=None):
+    return mark_safe(get_file_extensions(qs, site))
@@ -3,10 +3,14 @@
 from django.conf import settings
 from django.core.files import File
 from django.template import Library, Node, Variable, VariableDoesNotExist, TemplateSyntaxError
+from django.urls import reverse
 
-from filebrowser.settings import VERSIONS, PLACEHOLDER, SHOW_PLACEHOLDER, FORCE_PLACEHOLDER
+from filebrowser.settings import VERSIONS, PLACEHOLDER, SHOW_PLACEHOLDER, FORCE_PLACEHOLDER, VERSIONS_ASYNC
 from filebrowser.base import FileObject
+from filebrowser.manifest import options_signature
 from filebrowser.sites import get_default_site
+from filebrowser.utils import path_strip
+from filebrowser.version_queue import get_version
 
 
 register = Library()
@@ -28,18 +32,27 @@ class VersionNode(Node):
             return ""
         if version_suffix not in VERSIONS:
             return ""  # FIXME: should this throw an error?
+        site = context.get('filebrowser_site', get_default_site())
+        fileobject = None
         if isinstance(source, FileObject):
+            # keeps the data of the FileObject (e.g. versions found with find_versions)
+            if source.site is site:
+                fileobject = source
             source = source.path
         elif isinstance(source, File):
             source = source.name
         else:  # string
             source = source
-        site = context.get('filebrowser_site', get_default_site())
-        if FORCE_PLACEHOLDER or (SHOW_PLACEHOLDER and not site.storage.isfile(source)):
+        if FORCE_PLACEHOLDER or (SHOW_PLACEHOLDER and not self.isfile(fileobject, source, site)):
             source = PLACEHOLDER
-        fileobject = FileObject(source, site=site)
+            fileobject = None
+        if fileobject is None:
+            fileobject = FileObject(source, site=site)
         try:
-            version = fileobject.version_generate(version_suffix)
+            if VERSIONS_ASYNC:
+                version = get_version(fileobject, version_suffix)
+            else:
+                version = fileobject.version_generate(version_suffix)
             if self.var_name:
                 context[self.var_name] = version
             else:
@@ -51,6 +64,12 @@ class VersionNode(Node):
                 context[self.var_name] = ""
         return ""
 
+    def isfile(self, fileobject, source, site):
+        if fileobject is not None:
+            # without storage calls in listings
+            return fileobject.exists and not fileobject.is_folder
+        return site.storage.isfile(source)
+
 
 def version(parser, token):
     """
@@ -113,5 +132,32 @@ def version_setting(parser, token):
         raise TemplateSyntaxError("%s tag received bad version_suffix %s" % (tag, version_suffix))
     return VersionSettingNode(version_suffix)
 
+
+def version_url(context, source, version_suffix):
+    """
+    URL of a version, served (and generated with the first request) with the
+    view fb_version_serve, so that versions are not generated when rendering.
+    {% version_url fileobject version_suffix %}
+
+    The URL changes with the modification date of the image and the options
+    of the version, so that it can be cached (see VERSIONS_SERVE_MAX_AGE).
+    """
+    site = context.get('filebrowser_site', get_default_site())
+    if isinstance(source, File):
+        source = source.name
+    if not isinstance(source, FileObject) or source.site is not site:
+        source = FileObject(u'%s' % source, site=site)
+    if version_suffix not in VERSIONS or not source.path:
+        return ""
+    url = reverse('filebrowser:fb_version_serve', current_app=site.name, kwargs={
+        'version_suffix': version_suffix,
+        'path': path_strip(source.path, site.directory).lstrip('/'),
+    })
+    token = options_signature(source._get_options(version_suffix))[:8]
+    if source.date:
+        token = '%d-%s' % (source.date, token)
+    return url + '?t=%s' % token
+
 register.tag(version)
 register.tag(version_setting)
+register.simple_tag(takes_context=True)(version_url)
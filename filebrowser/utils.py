@@ -1,15 +1,18 @@
 # coding: utf-8
 
+import io
 import re
 import os
+import tempfile
 import unicodedata
 import math
 
+from django.core.files import File
 from django.utils import six
 from django.utils.module_loading import import_string
 
 from filebrowser.settings import STRICT_PIL, NORMALIZE_FILENAME, CONVERT_FILENAME
-from filebrowser.settings import VERSION_PROCESSORS
+from filebrowser.settings import VERSION_PROCESSORS, VERSION_SPOOL_SIZE
 
 if STRICT_PIL:
     from PIL import Image
@@ -20,6 +23,26 @@ else:
         import Image
 
 
+class SpooledImageFile(tempfile.SpooledTemporaryFile):
+    """
+    A SpooledTemporaryFile without a fileno while it is in memory (PIL asks
+    for the fileno when saving, which would spill the file to disk).
+    """
+
+    def fileno(self):
+        if not self._rolled:
+            raise io.UnsupportedOperation('fileno')
+        return tempfile.SpooledTemporaryFile.fileno(self)
+
+
+def spooled_file():
+    """
+    A temporary file for an encoded image, which stays in memory up to
+    VERSION_SPOOL_SIZE bytes (wrapped with File in order to pass it to storage.save).
+    """
+    return File(SpooledImageFile(max_size=VERSION_SPOOL_SIZE))
+
+
 def convert_filename(value):
     """
     Convert Filename.
@@ -73,20 +96,22 @@ def process_image(source, processor_options, processors=None):
     return image
 
 
-def scale_and_crop(im, width=None, height=None, opts='', **kwargs):
+def scale_and_crop_geometry(size, width=None, height=None, opts=''):
     """
-    Scale and Crop.
+    Returns (resize, box) for scaling and cropping an image with size: the size
+    to resize the image to and the box to crop the resized image to (each None,
+    if the image is not resized/cropped).
     """
-    x, y = [float(v) for v in im.size]
+    x, y = [float(v) for v in size]
     width = float(width or 0)
     height = float(height or 0)
 
     if (x, y) == (width, height):
-        return im
+        return None, None
 
     if 'upscale' not in opts:
         if (x < width or not width) and (y < height or not height):
-            return im
+            return None, None
 
     if width:
         xr = float(width)
@@ -102,14 +127,28 @@ def scale_and_crop(im, width=None, height=None, opts='', **kwargs):
     else:
         r = min(xr / x, yr / y)
 
+    resize = None
     if r < 1.0 or (r > 1.0 and 'upscale' in opts):
-        im = im.resize((int(math.ceil(x * r)), int(math.ceil(y * r))), resample=Image.ANTIALIAS)
+        resize = (int(math.ceil(x * r)), int(math.ceil(y * r)))
+        x, y = [float(v) for v in resize]
 
+    box = None
     if 'crop' in opts:
-        x, y = [float(v) for v in im.size]
         ex, ey = (x - min(x, xr)) / 2, (y - min(y, yr)) / 2
         if ex or ey:
-            im = im.crop((int(ex), int(ey), int(ex + xr), int(ey + yr)))
+            box = (int(ex), int(ey), int(ex + xr), int(ey + yr))
+    return resize, box
+
+
+def scale_and_crop(im, width=None, height=None, opts='', **kwargs):
+    """
+    Scale and Crop.
+    """
+    resize, box = scale_and_crop_geometry(im.size, width, height, opts)
+    if resize:
+        im = im.resize(resize, resample=Image.ANTIALIAS)
+    if box:
+        im = im.crop(box)
     return im
 
 scale_and_crop.valid_options = ('crop', 'upscale')
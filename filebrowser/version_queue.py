@@ -0,0 +1,123 @@
+# coding: utf-8
+
+import logging
+import multiprocessing
+import os
+import threading
+
+from multiprocessing.pool import ThreadPool
+
+import django
+from django.urls import get_resolver, get_urlconf
+
+from filebrowser.base import FileObject
+from filebrowser.settings import PLACEHOLDER, VERSIONS_ASYNC_WORKERS
+
+
+logger = logging.getLogger(__name__)
+
+
+def get_site(app_name, site_name):
+    "Returns a FileBrowser site by name in a worker process (raises KeyError)"
+    from filebrowser.sites import get_site_dict
+    # Sites are instantiated with the urlconf
+    get_resolver(get_urlconf()).app_dict
+    return get_site_dict(app_name)[site_name]
+
+
+def generate_version(app_name, site_name, path, version_suffix):
+    """
+    Generates a version of path with the FileBrowser site site_name (runs in a
+    worker of VersionQueue). Returns the path of the version or None.
+    """
+    try:
+        site = get_site(app_name, site_name)
+        return FileObject(path, site=site).version_generate(version_suffix).path
+    except Exception:
+        logger.exception("Generating version %s of %s failed", version_suffix, path)
+        return None
+
+
+class VersionQueue(object):
+    """
+    Generates versions in the background with a pool of worker processes
+    (or a single thread of the current process with workers=0).
+
+    A version which is already waiting for a worker is not added again.
+    """
+
+    def __init__(self, workers=VERSIONS_ASYNC_WORKERS):
+        self.workers = workers
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.pool = None
+        self.pid = None
+
+    def _get_pool(self):
+        # A pool is not usable after a fork (e.g. with a preforking server)
+        if self.pool is None or self.pid != os.getpid():
+            if self.workers:
+                # Workers are spawned (forking a threaded server is not safe) and
+                # set up Django before anything else is imported
+                context = multiprocessing.get_context('spawn') if hasattr(multiprocessing, 'get_context') else multiprocessing
+                self.pool = context.Pool(self.workers, initializer=django.setup)
+            else:
+                self.pool = ThreadPool(1)
+            self.pid = os.getpid()
+            self.pending = {}
+        return self.pool
+
+    def add(self, fileobject, version_suffix):
+        "Queues the version version_suffix of fileobject, returns False if it is already queued"
+        site = fileobject.site
+        key = (site.app_name, site.name, fileobject.version_path(version_suffix))
+        with self.lock:
+            pool = self._get_pool()
+            if key in self.pending:
+                return False
+            self.pending[key] = pool.apply_async(
+                generate_version, (site.app_name, site.name, fileobject.path, version_suffix),
+                callback=lambda result: self._done(key, site))
+        return True
+
+    def _done(self, key, site):
+        with self.lock:
+            self.pending.pop(key, None)
+        # The version may have been cached as missing
+        invalidate = getattr(site.storage, 'invalidate', None)
+        if invalidate is not None:
+            invalidate(key[2])
+
+    def is_pending(self, fileobject, version_suffix):
+        site = fileobject.site
+        return (site.app_name, site.name, fileobject.version_path(version_suffix)) in self.pending
+
+    def join(self):
+        "Waits for all queued versions (the pool is started again with the next version)"
+        with self.lock:
+            pool, self.pool = self.pool, None
+        if pool is not None:
+            pool.close()
+            pool.join()
+        with self.lock:
+            self.pending = {}
+
+
+queue = VersionQueue()
+
+
+def get_version(fileobject, version_suffix):
+    """
+    Returns the version version_suffix of fileobject, if it exists and is
+    up to date. Otherwise, the version is queued and the version of
+    PLACEHOLDER (or fileobject without PLACEHOLDER) is returned.
+    """
+    versions, pending = fileobject._find_versions([version_suffix])
+    if not pending:
+        return versions[version_suffix]
+    if fileobject.path == PLACEHOLDER:
+        return fileobject.version_generate(version_suffix)
+    queue.add(fileobject, version_suffix)
+    if PLACEHOLDER:
+        return FileObject(PLACEHOLDER, site=fileobject.site).version_generate(version_suffix)
+    return fileobject
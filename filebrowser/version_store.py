@@ -0,0 +1,108 @@
+# coding: utf-8
+
+import errno
+import hashlib
+import os
+import uuid
+
+from django.core.files.storage import FileSystemStorage
+from django.utils.encoding import force_bytes
+
+from filebrowser.base import FileObject
+from filebrowser.manifest import options_signature
+from filebrowser.settings import VERSION_QUALITY
+
+
+class VersionStore(object):
+    """
+    Content-addressed store of versions within location (a path relative
+    to the storage location), keyed by a hash of the content of the
+    original and the options of the version.
+
+    Versions of identical originals (e.g. the same image uploaded to
+    several folders) are generated only once: every version path is a hard
+    link to the version within the store. This requires FileSystemStorage
+    (and os.link), the store is not used with other storages (hardlinks is
+    False), since copies would take the same space as generating versions.
+    """
+
+    chunk_size = 64 * 1024
+
+    def __init__(self, location, site):
+        self.location = location
+        self.site = site
+        storage = getattr(site.storage, 'storage', site.storage)
+        self.hardlinks = hasattr(os, 'link') and isinstance(storage, FileSystemStorage)
+
+    def content_hash(self, fileobject, source=None):
+        "sha1 of the content of fileobject (or of source, e.g. an uploaded file)"
+        digest = hashlib.sha1()
+        f = source if source is not None else self.site.storage.open(fileobject.path)
+        try:
+            f.seek(0)
+            for chunk in iter(lambda: f.read(self.chunk_size), b''):
+                digest.update(chunk)
+        finally:
+            if source is None:
+                f.close()
+            else:
+                f.seek(0)
+        return digest.hexdigest()
+
+    def path(self, content_hash, version_path, options):
+        "Path of a version within the store"
+        extension = os.path.splitext(version_path)[1].lower()
+        key = hashlib.sha1(force_bytes('%s:%s:%s:%s' % (content_hash, options_signature(options), extension, VERSION_QUALITY))).hexdigest()
+        return os.path.join(self.location, key[:2], key + extension)
+
+    def is_stored(self, path):
+        return os.path.normpath(path).startswith(os.path.normpath(self.location) + os.sep)
+
+    def is_unreferenced(self, fileobject):
+        "True for versions within the store without any version path linking to them (with hard links only)"
+        if not self.hardlinks or not self.is_stored(fileobject.path):
+            return False
+        try:
+            return os.stat(self.site.storage.path(fileobject.path)).st_nlink < 2
+        except OSError:
+            return False
+
+    def link(self, path, version_path):
+        """
+        Replaces version_path with a hard link to path.
+        The version is touched, so that it is not older than its original.
+        """
+        folder, name = os.path.split(version_path)
+        tmp_path = os.path.join(folder, '.%s.%s.tmp' % (name, uuid.uuid4().hex))
+        tmp_full = self.site.storage.path(tmp_path)
+        try:
+            os.makedirs(os.path.dirname(tmp_full))
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        os.link(self.site.storage.path(path), tmp_full)
+        os.utime(tmp_full, None)
+        self.site.storage.move(tmp_path, version_path, allow_overwrite=True)
+
+    def share(self, fileobject, pending, versions, source=None):
+        """
+        Links the pending versions (a list of (version_suffix, version_path,
+        options)) of fileobject which are already in the store and adds them
+        to versions. Returns the versions still pending and a dict with the
+        path within the store for every pending version path.
+        """
+        content_hash = self.content_hash(fileobject, source)
+        paths = dict((version_path, self.path(content_hash, version_path, options)) for version_suffix, version_path, options in pending)
+        remaining = []
+        for version_suffix, version_path, options in pending:
+            if self.site.storage.exists(paths[version_path]):
+                self.link(paths[version_path], version_path)
+                versions[version_suffix] = FileObject(version_path, site=self.site)
+            else:
+                remaining.append((version_suffix, version_path, options))
+        return remaining, paths
+
+    def add(self, version_path, path):
+        "Adds a generated version to the store (as path)"
+        if not self.site.storage.exists(path):
+            self.link(version_path, path)
@@ -0,0 +1,301 @@
+# coding: utf-8
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import sys
+import time
+
+from filebrowser import receivers
+from filebrowser.base import FileObject
+
+
+# inotify(7) event masks
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+
+WATCH_MASK = (IN_CLOSE_WRITE | IN_ATTRIB | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE |
+              IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+
+EVENT_HEADER = struct.Struct('iIII')
+
+
+def _encode(path):
+    if isinstance(path, bytes):
+        return path
+    return path.encode(sys.getfilesystemencoding())
+
+
+def _decode(path):
+    if isinstance(path, bytes):
+        return path.decode(sys.getfilesystemencoding())
+    return path
+
+
+def _walk(root):
+    """
+    Yields root and all directories below root. Symbolic links are followed,
+    but directories which have already been visited (e.g. with symbolic
+    links creating cycles) are not read again.
+    """
+    visited = set()
+    for dirpath, dirnames, filenames in os.walk(root, followlinks=True):
+        try:
+            st = os.stat(dirpath)
+        except OSError:
+            dirnames[:] = []
+            continue
+        key = (st.st_dev, st.st_ino)
+        if key in visited:
+            dirnames[:] = []
+            continue
+        visited.add(key)
+        yield dirpath
+
+
+class InotifyWatcher(object):
+    """
+    Watches the directories below roots with inotify (Linux only).
+
+    Raises OSError if inotify is not available (or if there are not enough
+    inotify watches, see /proc/sys/fs/inotify/max_user_watches).
+    """
+
+    def __init__(self, roots):
+        libc_name = ctypes.util.find_library('c')
+        self.libc = ctypes.CDLL(libc_name, use_errno=True) if libc_name else None
+        if self.libc is None or not hasattr(self.libc, 'inotify_init1'):
+            raise OSError(errno.ENOSYS, 'inotify is not available')
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | getattr(os, 'O_CLOEXEC', 0))
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self.roots = roots
+        self.watches = {}
+        for root in roots:
+            self.add_tree(root)
+
+    def close(self):
+        os.close(self.fd)
+
+    def add_watch(self, path):
+        wd = self.libc.inotify_add_watch(self.fd, _encode(path), WATCH_MASK)
+        if wd < 0:
+            error = ctypes.get_errno()
+            if error in (errno.ENOENT, errno.ENOTDIR):
+                return
+            raise OSError(error, 'inotify_add_watch failed for %s' % path)
+        self.watches[wd] = path
+
+    def add_tree(self, path):
+        for dirpath in _walk(path):
+            self.add_watch(dirpath)
+
+    def changes(self, timeout):
+        """
+        Returns (changed, created) with the set of changed paths and the set
+        of new directories among them (waits at most timeout seconds)
+        """
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return set(), set()
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except OSError as e:
+            if e.errno == errno.EAGAIN:
+                return set(), set()
+            raise
+        changed = set()
+        created = set()
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, offset)
+            name = data[offset + EVENT_HEADER.size:offset + EVENT_HEADER.size + length].rstrip(b'\0')
+            offset += EVENT_HEADER.size + length
+            if mask & IN_Q_OVERFLOW:
+                # Events have been lost, so everything needs to be read again
+                changed.update(self.roots)
+                created.update(self.roots)
+                continue
+            directory = self.watches.get(wd)
+            if mask & IN_IGNORED:
+                self.watches.pop(wd, None)
+                continue
+            if directory is None:
+                continue
+            path = os.path.join(directory, _decode(name)) if name else directory
+            if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                self.add_tree(path)
+                created.add(path)
+            changed.add(path)
+        return changed, created
+
+
+class PollingWatcher(object):
+    """
+    Watches the directories below roots by polling the modification time of
+    every directory. Only directories with a new modification time are read
+    again, so files changed in place (without being created, renamed or
+    deleted) are not detected.
+    """
+
+    def __init__(self, roots):
+        self.roots = roots
+        self.snapshot = {}
+        for root in roots:
+            self.snapshot.update(self._scan_tree(root))
+
+    def close(self):
+        pass
+
+    def _scan(self, directory):
+        "dict with (is_dir, mtime, size) for directory and its entries"
+        result = {}
+        try:
+            st = os.stat(directory)
+            names = os.listdir(directory)
+        except OSError:
+            return result
+        result[directory] = (True, st.st_mtime, None)
+        for name in names:
+            path = os.path.join(directory, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            is_dir = os.path.isdir(path)
+            result[path] = (is_dir, st.st_mtime, None if is_dir else st.st_size)
+        return result
+
+    def _scan_tree(self, root):
+        result = {}
+        for dirpath in _walk(root):
+            result.update(self._scan(dirpath))
+        return result
+
+    def changes(self, timeout):
+        """
+        Returns (changed, created) with the set of changed paths and the set
+        of new directories among them (polls once after timeout seconds)
+        """
+        time.sleep(timeout)
+        changed = set()
+        created = set()
+        directories = [p for p, (is_dir, mtime, size) in self.snapshot.items() if is_dir]
+        for directory in directories:
+            old = self.snapshot.get(directory)
+            try:
+                mtime = os.stat(directory).st_mtime
+            except OSError:
+                mtime = None
+            if old is None or mtime == old[1]:
+                continue
+            # read the entries of the directory again
+            old_entries = dict((p, v) for p, v in self.snapshot.items() if p == directory or os.path.dirname(p) == directory)
+            new_entries = self._scan(directory)
+            for p, (is_dir, _, _) in list(new_entries.items()):
+                if is_dir and p != directory and p not in old_entries:
+                    new_entries.update(self._scan_tree(p))
+                    created.add(p)
+            for p in old_entries:
+                del self.snapshot[p]
+                if old_entries[p][0] and p != directory and p not in new_entries:
+                    # forget everything below a deleted directory
+                    prefix = p + os.sep
+                    for q in [q for q in self.snapshot if q.startswith(prefix)]:
+                        del self.snapshot[q]
+            self.snapshot.update(new_entries)
+            for p in set(old_entries) | set(new_entries):
+                if old_entries.get(p) != new_entries.get(p):
+                    changed.add(p)
+        return changed, created
+
+
+def get_watcher(roots, polling=False):
+    "Returns an InotifyWatcher (or a PollingWatcher if inotify is not available)"
+    if not polling:
+        try:
+            return InotifyWatcher(roots)
+        except OSError:
+            pass
+    return PollingWatcher(roots)
+
+
+def apply_changes(site, paths, created=()):
+    """
+    Applies changed paths (absolute paths on the server) to site, see
+    filebrowser.receivers. Changed versions update their original.
+    Only new directories (created) are read again with everything below them,
+    other paths (e.g. the parent folder of a new file) only by themselves.
+    """
+    location = site.storage.location
+
+    def storage_path(path):
+        path = os.path.relpath(path, location).replace(os.sep, '/')
+        return '' if path == '.' else path
+
+    created = set(storage_path(path) for path in created)
+    storage_paths = set()
+    for path in paths:
+        path = storage_path(path)
+        fileobject = FileObject(path, site=site)
+        if fileobject.is_version:
+            try:
+                path = fileobject.original.path
+            except (TypeError, AttributeError):
+                # not a version of an original (e.g. a folder)
+                continue
+        storage_paths.add(path)
+
+    # Parents first, so that recursive updates are not repeated for their children
+    done = []
+    for path in sorted(storage_paths):
+        if any(path.startswith(d + '/') for d in done):
+            continue
+        if site.storage.exists(path):
+            recursive = path in created and site.storage.isdir(path)
+            receivers.path_changed(site, path, recursive=recursive)
+            if recursive:
+                done.append(path)
+        else:
+            receivers.path_deleted(site, path)
+            done.append(path)
+    return len(storage_paths)
+
+
+def watch(site, watcher, delay=1.0, max_delay=10.0, interval=1.0, callback=None):
+    """
+    Collects changes from watcher and applies them to site in batches. A batch
+    is applied once there haven't been any changes for delay seconds (or at
+    the latest after max_delay seconds). Runs forever.
+    """
+    pending = set()
+    pending_created = set()
+    first = last = None
+    while True:
+        changed, created = watcher.changes(min(interval, delay))
+        now = time.time()
+        if changed:
+            pending.update(changed)
+            pending_created.update(created)
+            last = now
+            first = first or now
+        if pending and (now - last >= delay or now - first >= max_delay):
+            count = apply_changes(site, pending, pending_created)
+            if callback:
+                callback(count)
+            pending = set()
+            pending_created = set()
+            first = last = None
@@ -5,9 +5,10 @@ import ntpath
 import posixpath
 import shutil
 
+from django.test import override_settings
 from mock import patch
 
-from filebrowser.base import FileObject, FileListing
+from filebrowser.base import FileObject, FileListing, LazySortedList
 from filebrowser.sites import site
 from filebrowser.settings import VERSIONS
 from tests import FilebrowserTestCase as TestCase
@@ -104,6 +105,22 @@ class FileObjectAttributeTests(TestCase):
         self.assertEqual(self.F_IMAGE.extension, '.jpg')
         self.assertEqual(self.F_IMAGE.mimetype, ('image/jpeg', None))
 
+    def test_lazy_attributes(self):
+        """
+        FileObject uses __slots__ and computes attributes on first access
+        """
+        f = FileObject('_test/uploads/folder/testimage.jpg', site=site)
+        self.assertFalse(hasattr(f, '__dict__'))
+        self.assertFalse(hasattr(f, '_mimetype'))
+        self.assertEqual(f.mimetype, ('image/jpeg', None))
+        self.assertEqual(f._mimetype, ('image/jpeg', None))
+
+        f._prefill(exists=True, filesize=1)
+        with patch.object(site.storage, 'size', side_effect=AssertionError):
+            self.assertEqual(f.filesize, 1)
+        del f.filesize
+        self.assertEqual(f.filesize, 870037)
+
     def test_general_attributes(self):
         """
         FileObject general attributes
@@ -121,6 +138,21 @@ class FileObjectAttributeTests(TestCase):
         # FIXME: test date/datetime
         self.assertEqual(self.F_IMAGE.exists, True)
 
+    def test_filetype_extensions(self):
+        """
+        FileObject filetype with (per-site) EXTENSIONS
+        """
+        self.assertEqual(FileObject('_test/uploads/folder/TESTIMAGE.JPG', site=site).filetype, 'Image')
+        self.assertEqual(FileObject('_test/uploads/folder/testimage.raw', site=site).filetype, '')
+        extensions = site.extensions
+        site.extensions = {'Image': ['.RAW']}
+        try:
+            self.assertEqual(site.extension_map, {'.raw': 'Image'})
+            self.assertEqual(FileObject('_test/uploads/folder/testimage.raw', site=site).filetype, 'Image')
+            self.assertEqual(FileObject('_test/uploads/folder/testimage.jpg', site=site).filetype, '')
+        finally:
+            site.extensions = extensions
+
     def test_path_url_attributes(self):
         """
         FileObject path and url attributes
@@ -413,6 +445,61 @@ class FileListingTests(TestCase):
         self.assertEqual(self.F_LISTING_FOLDER.results_listing_total(), 2)
         self.assertEqual(self.F_LISTING_FOLDER.results_listing_filtered(), 2)
 
+    def test_listing_stat_data(self):
+        """
+        FileListing fills in the stat data from one directory scan
+
+        # entries
+        # files_listing_total
+        """
+        self.assertEqual(self.F_LISTING_IMAGE.entries(), [])
+        self.assertEqual([e.name for e in self.F_LISTING_FOLDER.entries()], [u'folder', u'testimage.jpg'])
+
+        with patch('os.path.exists', side_effect=AssertionError), \
+                patch('os.path.getsize', side_effect=AssertionError), \
+                patch('os.path.getmtime', side_effect=AssertionError):
+            files = self.F_LISTING_FOLDER.files_listing_total()
+            self.assertEqual([f.is_folder for f in files], [False, True])
+            self.assertEqual([f.exists for f in files], [True, True])
+            self.assertEqual(files[0].filesize, 870037)
+            self.assertEqual(files[0].filetype, 'Image')
+
+        for f in files:
+            f_storage = FileObject(f.path, site=site)
+            self.assertEqual(f.filesize, f_storage.filesize)
+            self.assertEqual(f.date, f_storage.date)
+
+    @override_settings(USE_TZ=True, TIME_ZONE='America/New_York')
+    def test_listing_date_time_zone(self):
+        """
+        FileListing fills in the same date as FileObject with a time zone other than UTC
+        """
+        for f in self.F_LISTING_FOLDER.files_listing_total():
+            self.assertEqual(f.date, FileObject(f.path, site=site).date)
+
+    def test_sort_lazily(self):
+        """
+        FileListing.sort_lazily (LazySortedList) returns the same order as sort_by_attr
+        """
+        class Item(object):
+            def __init__(self, name, size):
+                self.filename, self.filesize = name, size
+
+        items = [Item('item%d' % i, i % 7) for i in range(100)]
+        for order in ('asc', 'desc'):
+            filelisting = FileListing(self.DIRECTORY, sorting_by='filesize', sorting_order=order)
+            expected = filelisting.sort_by_attr(items, 'filesize')
+            if order == 'desc':
+                expected.reverse()
+            for start, stop in ((0, 10), (10, 20), (95, 105), (0, 100)):
+                lazy = filelisting.sort_lazily(items)
+                self.assertIsInstance(lazy, LazySortedList)
+                self.assertEqual(lazy[start:stop], expected[start:stop])
+            self.assertEqual(lazy[5], expected[5])
+            self.assertEqual(lazy[-1], expected[-1])
+            self.assertEqual(list(lazy), expected)
+            self.assertEqual(len(lazy), 100)
+
     def test_walk(self):
         """
         FileObject walk
@@ -431,6 +518,36 @@ class FileListingTests(TestCase):
         self.assertEqual(self.F_LISTING_FOLDER.results_walk_total(), 4)
         self.assertEqual(self.F_LISTING_FOLDER.results_walk_filtered(), 4)
 
+    def test_walk_iter(self):
+        """
+        FileListing walk_iter, files_walk_iter and files_walk_head
+
+        # max_depth
+        # symbolic links creating a cycle
+        """
+        self.assertEqual([f.path for f in self.F_LISTING_FOLDER.walk_iter(max_depth=1)], [u'_test/uploads/folder', u'_test/uploads/testimage.jpg'])
+        self.assertEqual([f.path for f in self.F_LISTING_FOLDER.files_walk_iter()], [u'_test/uploads/folder/subfolder/testimage.jpg', u'_test/uploads/folder/subfolder', u'_test/uploads/folder', u'_test/uploads/testimage.jpg'])
+
+        files, total = self.F_LISTING_FOLDER.files_walk_head(2)
+        self.assertEqual(total, 4)
+        self.assertEqual([f.path for f in files], [f.path for f in self.F_LISTING_FOLDER.files_walk_total()[:2]])
+        filelisting = FileListing(self.DIRECTORY, sorting_by='filename_lower', sorting_order='asc')
+        self.assertEqual([f.path for f in filelisting.files_walk_head(3)[0]], [f.path for f in filelisting.files_walk_total()[:3]])
+
+        # reading folders with a pool of threads
+        os.makedirs(os.path.join(self.SUBFOLDER_PATH, 'a', 'b'))
+        os.makedirs(os.path.join(self.SUBFOLDER_PATH, 'c'))
+        self.assertEqual(
+            [f.path for f in self.F_LISTING_FOLDER.walk_iter(workers=4)],
+            [f.path for f in self.F_LISTING_FOLDER.walk_iter(workers=0)])
+        shutil.rmtree(os.path.join(self.SUBFOLDER_PATH, 'a'))
+        shutil.rmtree(os.path.join(self.SUBFOLDER_PATH, 'c'))
+
+        if not hasattr(os, 'symlink'):
+            return
+        os.symlink(self.FOLDER_PATH, os.path.join(self.SUBFOLDER_PATH, 'cycle'))
+        self.assertEqual(self.F_LISTING_FOLDER.walk(), [u'folder/subfolder/cycle', u'folder/subfolder/testimage.jpg', u'folder/subfolder', u'folder', u'testimage.jpg'])
+
 
 class FileObjecNamerTests(TestCase):
 
@@ -3,12 +3,18 @@
 import os
 import sys
 import shutil
+import time
 
 from django.conf import settings
 from django.core.management import call_command
+from django.core.management.base import CommandError
 from django.utils.six import StringIO
+from django.template.defaultfilters import filesizeformat
+from mock import patch
 
+from filebrowser.manifest import VersionManifest, options_signature
 from filebrowser.settings import DIRECTORY
+from filebrowser.sites import site
 from tests import FilebrowserTestCase as TestCase
 
 
@@ -33,3 +39,145 @@ class VersionGenerateCommandTests(TestCase):
         call_command('fb_version_generate', DIRECTORY)
 
         self.assertTrue(os.path.exists(self.version_file))
+
+    def test_fb_version_generate_noinput(self):
+        call_command('fb_version_generate', DIRECTORY, suffix=['large', 'small'], interactive=False, stdout=StringIO())
+
+        self.assertTrue(os.path.exists(self.version_file))
+        self.assertTrue(os.path.exists(self.version_file.replace('_large', '_small')))
+        self.assertFalse(os.path.exists(self.version_file.replace('_large', '_medium')))
+
+    def test_fb_version_generate_modes(self):
+        call_command('fb_version_generate', DIRECTORY, suffix=['large'], interactive=False, stdout=StringIO())
+        for options, count in (({}, 1), ({'only_missing': True}, 0), ({'only_stale': True}, 0)):
+            with patch('filebrowser.base.FileObject.versions_generate') as versions_generate:
+                call_command('fb_version_generate', DIRECTORY, suffix=['large'], interactive=False, stdout=StringIO(), **options)
+            self.assertEqual(versions_generate.call_count, count)
+
+        # outdated versions are generated again with --only-stale
+        os.utime(os.path.join(self.FOLDER_PATH, 'testimage.jpg'), (time.time() + 10, time.time() + 10))
+        stdout = StringIO()
+        call_command('fb_version_generate', DIRECTORY, suffix=['large'], interactive=False, only_stale=True, stdout=stdout)
+        self.assertIn('1 images (1 versions generated, 0 skipped, 0 failed)', stdout.getvalue())
+
+    def test_fb_version_generate_checkpoint(self):
+        checkpoint = os.path.join(self.TEST_PATH, 'checkpoint.txt')
+        call_command('fb_version_generate', DIRECTORY, suffix=['large'], interactive=False, checkpoint=checkpoint, stdout=StringIO())
+        with open(checkpoint) as f:
+            self.assertEqual(f.read(), '_test/uploads/folder/testimage.jpg\n')
+
+        os.remove(self.version_file)
+        stdout = StringIO()
+        call_command('fb_version_generate', DIRECTORY, suffix=['large'], interactive=False, checkpoint=checkpoint, stdout=stdout)
+        self.assertFalse(os.path.exists(self.version_file))
+        self.assertIn('0 images (0 versions generated, 1 skipped, 0 failed)', stdout.getvalue())
+
+    def test_fb_version_generate_workers(self):
+        call_command('fb_version_generate', DIRECTORY, suffix=['large'], interactive=False, workers=2, stdout=StringIO())
+
+        self.assertTrue(os.path.exists(self.version_file))
+
+
+class VersionCleanupCommandTests(TestCase):
+
+    def setUp(self):
+        super(VersionCleanupCommandTests, self).setUp()
+        shutil.copy(self.STATIC_IMG_PATH, self.FOLDER_PATH)
+        self.version = self.F_IMAGE.version_generate('large')
+        self.versions_folder = os.path.dirname(self.version.path_full)
+        # versions of a deleted image and of a version not in VERSIONS anymore
+        shutil.copy(self.version.path_full, os.path.join(self.versions_folder, 'deleted_large.jpg'))
+        shutil.copy(self.version.path_full, os.path.join(self.versions_folder, 'testimage_removedversion.jpg'))
+
+    def test_fb_version_cleanup(self):
+        stdout = StringIO()
+        call_command('fb_version_cleanup', interactive=False, stdout=stdout)
+
+        self.assertEqual(os.listdir(self.versions_folder), ['testimage_large.jpg'])
+        self.assertIn('2 version(s) removed, %s reclaimed' % filesizeformat(2 * self.version.filesize), stdout.getvalue())
+
+    def test_fb_version_cleanup_dry_run(self):
+        stdout = StringIO()
+        call_command('fb_version_cleanup', dry_run=True, stdout=stdout)
+
+        self.assertEqual(len(os.listdir(self.versions_folder)), 3)
+        self.assertIn('2 version(s) would be removed', stdout.getvalue())
+
+    def test_fb_version_cleanup_outdated_options(self):
+        manifest, site.manifest = site.manifest, VersionManifest('default', site=site)
+        try:
+            site.manifest.add(self.F_IMAGE, {self.version.path: options_signature({'width': 1})})
+            call_command('fb_version_cleanup', interactive=False, stdout=StringIO())
+        finally:
+            site.manifest = manifest
+
+        self.assertEqual(os.listdir(self.versions_folder), [])
+
+    def test_fb_version_cleanup_temporary_files(self):
+        "Temporary files of versions being saved are only removed when they are old"
+        saving = os.path.join(self.versions_folder, '.testimage_small.jpg.0123.tmp')
+        stale = os.path.join(self.versions_folder, '.testimage_small.jpg.4567.tmp')
+        shutil.copy(self.version.path_full, saving)
+        shutil.copy(self.version.path_full, stale)
+        os.utime(stale, (0, 0))
+        call_command('fb_version_cleanup', interactive=False, stdout=StringIO())
+
+        self.assertEqual(sorted(os.listdir(self.versions_folder)), ['.testimage_small.jpg.0123.tmp', 'testimage_large.jpg'])
+
+
+class VersionRemoveCommandTests(TestCase):
+
+    def setUp(self):
+        super(VersionRemoveCommandTests, self).setUp()
+        shutil.copy(self.STATIC_IMG_PATH, self.FOLDER_PATH)
+        self.large = self.F_IMAGE.version_generate('large')
+        self.small = self.F_IMAGE.version_generate('small')
+
+    def test_fb_version_remove(self):
+        stdout = StringIO()
+        call_command('fb_version_remove', suffix='large', interactive=False, batch_size=1, stdout=stdout)
+
+        self.assertFalse(site.storage.exists(self.large.path))
+        self.assertTrue(site.storage.exists(self.small.path))
+        self.assertTrue(site.storage.exists(self.F_IMAGE.path))
+        self.assertIn('1 file(s) removed.', stdout.getvalue())
+
+    def test_fb_version_remove_dry_run(self):
+        stdout = StringIO()
+        call_command('fb_version_remove', suffix='small', dry_run=True, stdout=stdout)
+
+        self.assertTrue(site.storage.exists(self.small.path))
+        self.assertIn('1 file(s) would be removed.', stdout.getvalue())
+
+    def test_fb_version_remove_interactive(self):
+        stdout = StringIO()
+        with patch('filebrowser.management.commands.fb_version_remove.input', side_effect=['s', 'large', 'n']):
+            call_command('fb_version_remove', stdout=stdout)
+        self.assertTrue(site.storage.exists(self.large.path))
+        self.assertIn('1 file(s) will be removed.', stdout.getvalue())
+        self.assertIn('No files removed.', stdout.getvalue())
+
+        with patch('filebrowser.management.commands.fb_version_remove.input', side_effect=['y']):
+            call_command('fb_version_remove', suffix='large', stdout=StringIO())
+        self.assertFalse(site.storage.exists(self.large.path))
+
+    def test_fb_version_remove_interactive_sample(self):
+        "Only a sample of the files to remove is listed before confirming (all of them with --verbosity 2)"
+        versions_folder = os.path.dirname(self.large.path)
+        for i in range(12):
+            shutil.copy(self.STATIC_IMG_PATH, site.storage.path(os.path.join(versions_folder, 'image%02d_large.jpg' % i)))
+        stdout = StringIO()
+        with patch('filebrowser.management.commands.fb_version_remove.input', side_effect=['n']):
+            call_command('fb_version_remove', suffix='large', stdout=stdout)
+        self.assertIn('13 file(s) will be removed.', stdout.getvalue())
+        self.assertIn('...', stdout.getvalue())
+        self.assertEqual(stdout.getvalue().count('_large.jpg'), 10)
+
+        stdout = StringIO()
+        with patch('filebrowser.management.commands.fb_version_remove.input', side_effect=['n']):
+            call_command('fb_version_remove', suffix='large', verbosity=2, stdout=stdout)
+        self.assertEqual(stdout.getvalue().count('_large.jpg'), 13)
+
+    def test_fb_version_remove_noinput_requires_suffix(self):
+        with self.assertRaises(CommandError):
+            call_command('fb_version_remove', interactive=False, stdout=StringIO())
@@ -0,0 +1,95 @@
+# coding: utf-8
+
+import shutil
+import struct
+
+from django.core.cache import cache
+from django.utils.six import BytesIO
+from mock import patch
+
+from filebrowser.base import FileObject
+from filebrowser.dimensions import parse_dimensions, probe_dimensions
+from filebrowser.settings import STRICT_PIL
+from filebrowser.sites import site
+from tests import FilebrowserTestCase as TestCase
+
+if STRICT_PIL:
+    from PIL import Image
+else:
+    try:
+        from PIL import Image
+    except ImportError:
+        import Image
+
+
+def encode(size, format, **kwargs):
+    f = BytesIO()
+    Image.new('RGB', size).save(f, format=format, **kwargs)
+    return f.getvalue()
+
+
+class ParseDimensionsTests(TestCase):
+
+    def test_formats(self):
+        self.assertEqual(parse_dimensions(encode((300, 200), 'JPEG')), (300, 200))
+        self.assertEqual(parse_dimensions(encode((300, 200), 'JPEG', progressive=True)), (300, 200))
+        self.assertEqual(parse_dimensions(encode((300, 200), 'PNG')), (300, 200))
+        self.assertEqual(parse_dimensions(encode((300, 200), 'GIF')), (300, 200))
+        self.assertEqual(parse_dimensions(b'not an image'), None)
+
+    def test_webp(self):
+        lossy = b'RIFF\0\0\0\0WEBPVP8 \0\0\0\0\0\0\0\x9d\x01\x2a' + struct.pack('<HH', 300, 200)
+        self.assertEqual(parse_dimensions(lossy), (300, 200))
+        lossless = b'RIFF\0\0\0\0WEBPVP8L\0\0\0\0\x2f' + struct.pack('<I', 299 | (199 << 14))
+        self.assertEqual(parse_dimensions(lossless), (300, 200))
+        extended = b'RIFF\0\0\0\0WEBPVP8X\0\0\0\0\0\0\0\0' + struct.pack('<I', 299)[:3] + struct.pack('<I', 199)[:3]
+        self.assertEqual(parse_dimensions(extended), (300, 200))
+
+    def test_truncated(self):
+        self.assertEqual(parse_dimensions(encode((300, 200), 'JPEG')[:20]), None)
+        self.assertEqual(parse_dimensions(encode((300, 200), 'PNG')[:20]), None)
+
+
+class ProbeDimensionsTests(TestCase):
+
+    def setUp(self):
+        super(ProbeDimensionsTests, self).setUp()
+        shutil.copy(self.STATIC_IMG_PATH, self.FOLDER_PATH)
+
+    def test_header_only(self):
+        with patch.object(site.storage, 'open') as storage_open:
+            self.assertEqual(probe_dimensions(site.storage, self.F_IMAGE.path), (1000, 750))
+        self.assertEqual(storage_open.call_count, 0)
+
+    def test_large_metadata(self):
+        # a comment segment of 10KB before the frame header
+        data = encode((300, 200), 'JPEG')
+        data = data[:2] + b'\xff\xfe' + struct.pack('>H', 10002) + b'x' * 10000 + data[2:]
+        with open(self.F_IMAGE.path_full, 'wb') as f:
+            f.write(data)
+        with patch.object(site.storage, 'read_header', wraps=site.storage.read_header) as read_header:
+            self.assertEqual(probe_dimensions(site.storage, self.F_IMAGE.path), (300, 200))
+        self.assertEqual(read_header.call_count, 2)
+
+    def test_other_formats(self):
+        with open(self.F_IMAGE.path_full, 'wb') as f:
+            f.write(encode((300, 200), 'BMP'))
+        self.assertEqual(probe_dimensions(site.storage, self.F_IMAGE.path), (300, 200))
+        self.assertEqual(probe_dimensions(site.storage, self.F_MISSING.path), None)
+
+    def test_cache(self):
+        cache.clear()
+        with patch('filebrowser.dimensions.DIMENSIONS_CACHE', 'default'):
+            self.assertEqual(FileObject(self.F_IMAGE.path, site=site).dimensions, (1000, 750))
+            with patch('filebrowser.dimensions.probe_dimensions') as probe:
+                f_image = FileObject(self.F_IMAGE.path, site=site)
+                self.assertEqual(f_image.dimensions, (1000, 750))
+                self.assertEqual(f_image.orientation, 'Landscape')
+            self.assertEqual(probe.call_count, 0)
+
+            # a changed image is probed again
+            with open(self.F_IMAGE.path_full, 'wb') as f:
+                f.write(encode((300, 400), 'JPEG'))
+            f_image = FileObject(self.F_IMAGE.path, site=site)
+            f_image._date = f_image.date + 10
+            self.assertEqual(f_image.dimensions, (300, 400))
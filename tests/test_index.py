@@ -0,0 +1,177 @@
+# coding: utf-8
+
+import os
+import re
+import shutil
+import tempfile
+
+from django.core.management import call_command
+from django.core.paginator import Paginator
+from django.core.urlresolvers import reverse
+from django.utils.six.moves.urllib.parse import urlencode
+from django.utils.six import StringIO
+from mock import patch
+
+from filebrowser.base import FileListing, FileObject
+from filebrowser.index import FileIndex
+from filebrowser.sites import site
+from tests import FilebrowserTestCase as TestCase
+
+
+class FileIndexTests(TestCase):
+    """
+    /_test/uploads/testimage.jpg
+    /_test/uploads/folder/
+    /_test/uploads/folder/subfolder/
+    /_test/uploads/folder/subfolder/testimage.jpg
+    /_test/uploads/folder/subfolder/.hidden.jpg
+    """
+
+    def setUp(self):
+        super(FileIndexTests, self).setUp()
+        shutil.copy(self.STATIC_IMG_PATH, self.SUBFOLDER_PATH)
+        shutil.copy(self.STATIC_IMG_PATH, self.DIRECTORY_PATH)
+        shutil.copy(self.STATIC_IMG_PATH, os.path.join(self.SUBFOLDER_PATH, '.hidden.jpg'))
+
+        self.database = tempfile.NamedTemporaryFile(suffix='.sqlite')
+        self.index = FileIndex(self.database.name, site=site)
+
+        patcher = patch.object(site, 'index', self.index)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        super(FileIndexTests, self).tearDown()
+        self.database.close()
+
+    def test_build(self):
+        self.assertFalse(self.index.covers(self.DIRECTORY))
+        self.assertEqual(self.index.build(), 5)
+        self.assertTrue(self.index.covers(self.DIRECTORY))
+        self.assertTrue(self.index.covers(os.path.join(self.DIRECTORY, 'folder')))
+        self.assertFalse(self.index.covers('_test/_versions'))
+
+        fileobject = self.index.query(os.path.join(self.DIRECTORY, 'folder/subfolder')).filter(filetype='Image')[0]
+        self.assertEqual(fileobject.filetype, 'Image')
+        self.assertEqual(fileobject.filesize, 870037)
+        self.assertEqual(fileobject.dimensions, (1000, 750))
+
+    def test_versions(self):
+        fileobject = FileObject(os.path.join(self.DIRECTORY, 'testimage.jpg'), site=site)
+        fileobject.version_generate('large')
+        self.index.build()
+        row = self.index.connection.execute(
+            "SELECT versions FROM filebrowser_file WHERE path = ?", (fileobject.path,)).fetchone()
+        self.assertEqual(row[0], 'large')
+
+    def test_known_versions(self):
+        "The versions recorded with the index are known to FileObjects read from the index and kept up to date"
+        fileobject = FileObject(os.path.join(self.DIRECTORY, 'testimage.jpg'), site=site)
+        fileobject.version_generate('large')
+        self.index.build()
+
+        def versions():
+            return self.index.connection.execute(
+                "SELECT versions FROM filebrowser_file WHERE path = ?", (fileobject.path,)).fetchone()[0]
+
+        indexed = self.index.query(self.DIRECTORY).filter(filetype='Image')[0]
+        self.assertEqual(indexed._known_versions[fileobject.version_path('large')].path, fileobject.version_path('large'))
+        self.assertIsNone(indexed._known_versions[fileobject.version_path('small')])
+        with patch.object(site.storage, 'isfile', side_effect=AssertionError):
+            self.assertEqual(indexed.version_generate('large').path, fileobject.version_path('large'))
+
+        indexed.version_generate('small')
+        self.assertEqual(versions(), 'large,small')
+
+        fileobject.delete_versions()
+        self.assertIsNone(versions())
+        indexed = self.index.query(self.DIRECTORY).filter(filetype='Image')[0]
+        self.assertIsNone(getattr(indexed, '_known_versions', None))
+
+        self.index.update(fileobject.path)
+        self.assertEqual(versions(), '')
+
+    def test_update_recursive_versions(self):
+        "Updating a folder finds the versions of its images without scanning VERSIONS_BASEDIR"
+        self.index.build()
+        fileobject = FileObject(os.path.join(self.DIRECTORY, 'folder/subfolder/testimage.jpg'), site=site)
+        fileobject.version_generate('large')
+        with patch.object(self.index, '_scan_versions', side_effect=AssertionError):
+            self.index.update(os.path.join(self.DIRECTORY, 'folder'), recursive=True)
+        row = self.index.connection.execute(
+            "SELECT versions FROM filebrowser_file WHERE path = ?", (fileobject.path,)).fetchone()
+        self.assertEqual(row[0], 'large')
+
+    def test_listing(self):
+        self.index.build()
+        filelisting = FileListing(self.DIRECTORY, sorting_by='filename_lower', sorting_order='asc', site=site)
+        self.assertEqual(filelisting.index, self.index)
+        with patch.object(FileListing, 'files_listing_storage', side_effect=AssertionError):
+            self.assertEqual([f.path for f in filelisting.files_listing_total()], [u'_test/uploads/folder', u'_test/uploads/testimage.jpg'])
+            self.assertEqual([f.path for f in filelisting.files_walk_total()], [
+                u'_test/uploads/folder/subfolder/.hidden.jpg', u'_test/uploads/folder',
+                u'_test/uploads/folder/subfolder', u'_test/uploads/folder/subfolder/testimage.jpg', u'_test/uploads/testimage.jpg'])
+
+    def test_filter_and_paginate(self):
+        self.index.build()
+        query = self.index.query(self.DIRECTORY, recursive=True).order_by('filename_lower', 'desc')
+        query = query.filter(exclude=[re.compile(r'^\.')])
+        self.assertEqual(query.count(), 4)
+        self.assertEqual(query.filter(filetype='Folder').count(), 2)
+        self.assertEqual(query.filter(search=re.compile('test')).count(), 2)
+        self.assertEqual(query.filter(filter_date='today').count(), 4)
+
+        p = Paginator(query, 3)
+        self.assertEqual(p.num_pages, 2)
+        self.assertEqual([f.filename for f in p.page(1)], [u'testimage.jpg', u'testimage.jpg', u'subfolder'])
+        self.assertEqual([f.filename for f in p.page(2)], [u'folder'])
+
+    def test_fb_index_build(self):
+        out = StringIO()
+        call_command('fb_index_build', stdout=out)
+        self.assertTrue(out.getvalue().startswith('5 files/folders indexed'))
+        self.assertTrue(self.index.covers(self.DIRECTORY))
+
+
+class FileIndexReceiverTests(TestCase):
+
+    def setUp(self):
+        super(FileIndexReceiverTests, self).setUp()
+        shutil.copy(self.STATIC_IMG_PATH, self.FOLDER_PATH)
+        self.client.login(username=self.user.username, password='password')
+
+        self.database = tempfile.NamedTemporaryFile(suffix='.sqlite')
+        self.index = FileIndex(self.database.name, site=site)
+        self.index.build()
+
+        patcher = patch.object(site, 'index', self.index)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        super(FileIndexReceiverTests, self).tearDown()
+        self.database.close()
+
+    def paths(self):
+        return [f.path for f in self.index.query(self.DIRECTORY, recursive=True).order_by('path')]
+
+    def test_upload(self):
+        url = '?'.join([reverse('filebrowser:fb_do_upload'), urlencode({'folder': self.F_SUBFOLDER.path_relative_directory})])
+        with open(self.STATIC_IMG_PATH, "rb") as f:
+            self.client.post(url, data={'qqfile': 'testimage.jpg', 'file': f}, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertIn(u'_test/uploads/folder/subfolder/testimage.jpg', self.paths())
+
+    def test_createdir(self):
+        self.client.post(reverse('filebrowser:fb_createdir'), {'name': 'create'})
+        self.assertIn(u'_test/uploads/create', self.paths())
+
+    def test_delete(self):
+        self.client.get(reverse('filebrowser:fb_delete'), {'dir': '', 'filename': 'folder'})
+        self.assertEqual(self.paths(), [])
+
+    def test_rename(self):
+        url = '?'.join([reverse('filebrowser:fb_detail'), urlencode({'dir': '', 'filename': 'folder'})])
+        self.client.post(url, {'name': 'renamed'})
+        self.assertEqual(self.paths(), [u'_test/uploads/renamed', u'_test/uploads/renamed/subfolder', u'_test/uploads/renamed/testimage.jpg'])
+
+        self.assertEqual(self.index.query(os.path.join(self.DIRECTORY, 'renamed')).count(), 2)
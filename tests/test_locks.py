@@ -0,0 +1,63 @@
+# coding: utf-8
+
+import os
+import shutil
+
+from django.core.cache import cache
+from mock import patch
+
+from filebrowser.locks import CacheLock, FileLock, get_lock
+from filebrowser.sites import site
+from tests import FilebrowserTestCase as TestCase
+
+
+class LockTests(TestCase):
+
+    def setUp(self):
+        super(LockTests, self).setUp()
+        self.path = os.path.join('_test', '_versions', 'folder', 'testimage_large.jpg')
+        cache.clear()
+
+    def check_lock(self, lock_class):
+        lock = lock_class(site, self.path)
+        other = lock_class(site, self.path)
+        self.assertTrue(lock.acquire(0))
+        self.assertFalse(other.acquire(0))
+        self.assertFalse(other.acquire(0.1))
+        # other paths are not locked
+        self.assertTrue(lock_class(site, self.path + 'x').acquire(0))
+        lock.release()
+        self.assertTrue(other.acquire(0))
+        other.release()
+
+    def test_file_lock(self):
+        self.check_lock(FileLock)
+
+    def test_file_lock_removes_file(self):
+        lock = FileLock(site, self.path)
+        lock.acquire()
+        self.assertTrue(os.path.exists(lock.path))
+        lock.release()
+        self.assertFalse(os.path.exists(lock.path))
+
+    def test_cache_lock(self):
+        self.check_lock(CacheLock)
+
+    def test_get_lock(self):
+        self.assertIsInstance(get_lock(site, self.path), FileLock)
+        with patch('filebrowser.locks.VERSION_LOCK', 'filebrowser.locks.CacheLock'):
+            self.assertIsInstance(get_lock(site, self.path), CacheLock)
+
+    def test_version_generate_timeout(self):
+        "A version locked by another process is not generated without the lock"
+        shutil.copy(self.STATIC_IMG_PATH, self.FOLDER_PATH)
+        version_path = self.F_IMAGE.version_path('large')
+        lock = get_lock(site, version_path)
+        self.assertTrue(lock.acquire(0))
+        try:
+            with patch('filebrowser.base.VERSION_LOCK_TIMEOUT', 0.1):
+                version = self.F_IMAGE.version_generate('large')
+        finally:
+            lock.release()
+        self.assertEqual(version.path, '')
+        self.assertFalse(site.storage.exists(version_path))
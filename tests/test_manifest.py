@@ -0,0 +1,69 @@
+# coding: utf-8
+
+import shutil
+
+from django.core.cache import cache
+from mock import patch
+
+from filebrowser import receivers
+from filebrowser.base import FileObject
+from filebrowser.manifest import VersionManifest, options_signature
+from filebrowser.sites import site
+from filebrowser.utils import scale_and_crop
+from tests import FilebrowserTestCase as TestCase
+
+
+class VersionManifestTests(TestCase):
+
+    def setUp(self):
+        super(VersionManifestTests, self).setUp()
+        shutil.copy(self.STATIC_IMG_PATH, self.FOLDER_PATH)
+        cache.clear()
+        manifest, site.manifest = site.manifest, VersionManifest('default', site=site)
+        self.addCleanup(setattr, site, 'manifest', manifest)
+
+    def storage_calls(self, fileobject, version_suffix, extra_options=None):
+        "Number of calls of isfile and modified_time with version_generate"
+        with patch.object(site.storage, 'isfile', wraps=site.storage.isfile) as isfile:
+            with patch.object(site.storage, 'modified_time', wraps=site.storage.modified_time) as modified_time:
+                fileobject.version_generate(version_suffix, extra_options)
+        return isfile.call_count + modified_time.call_count
+
+    def test_without_storage_calls(self):
+        version = self.F_IMAGE.version_generate('large')
+        f_image = FileObject(self.F_IMAGE.path, site=site)
+        with patch.object(site.storage, 'isfile') as isfile:
+            with patch.object(site.storage, 'modified_time') as modified_time:
+                self.assertEqual(f_image.version_generate('large').path, version.path)
+        self.assertEqual(isfile.call_count, 0)
+        self.assertEqual(modified_time.call_count, 0)
+
+    def test_existing_versions_are_recorded(self):
+        self.F_IMAGE.version_generate('large')
+        site.manifest.forget(self.F_IMAGE.path)
+        self.assertNotEqual(self.storage_calls(FileObject(self.F_IMAGE.path, site=site), 'large'), 0)
+        self.assertEqual(self.storage_calls(FileObject(self.F_IMAGE.path, site=site), 'large'), 0)
+
+    def test_other_options(self):
+        self.F_IMAGE.version_generate('large')
+        self.assertNotEqual(self.storage_calls(FileObject(self.F_IMAGE.path, site=site), 'large', {'width': 100}), 0)
+
+    def test_changed_original(self):
+        self.F_IMAGE.version_generate('large')
+        receivers.path_changed(site, self.F_IMAGE.path)
+        self.assertNotEqual(self.storage_calls(FileObject(self.F_IMAGE.path, site=site), 'large'), 0)
+
+    def test_deleted_folder(self):
+        self.F_IMAGE.version_generate('large')
+        receivers.path_deleted(site, self.F_FOLDER.path)
+        self.assertNotEqual(self.storage_calls(FileObject(self.F_IMAGE.path, site=site), 'large'), 0)
+
+    def test_known_date(self):
+        self.F_IMAGE.version_generate('large')
+        f_image = FileObject(self.F_IMAGE.path, site=site)
+        f_image._prefill(date=f_image.date + 10)
+        self.assertNotEqual(self.storage_calls(f_image, 'large'), 0)
+
+    def test_options_signature(self):
+        self.assertEqual(options_signature({'width': 100, 'methods': [scale_and_crop]}), options_signature({'methods': [scale_and_crop], 'width': 100}))
+        self.assertNotEqual(options_signature({'width': 100}), options_signature({'width': 101}))
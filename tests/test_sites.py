@@ -3,6 +3,8 @@ from __future__ import with_statement
 import os
 import json
 import shutil
+import tempfile
+from multiprocessing.pool import ThreadPool
 
 from django.core.urlresolvers import reverse
 try:
@@ -13,6 +15,7 @@ from mock import patch
 
 from filebrowser.settings import VERSIONS, DEFAULT_PERMISSIONS
 from filebrowser.base import FileObject
+from filebrowser.index import FileIndex
 from filebrowser.sites import site
 from tests import FilebrowserTestCase as TestCase
 
@@ -51,6 +54,93 @@ class BrowseViewTests(TestCase):
         self.assertContains(response, '<input type="hidden" name="CKEditorFuncNum" value="1" />')
 
 
+    def test_get_with_index(self):
+        shutil.copy(self.STATIC_IMG_PATH, self.FOLDER_PATH)
+        database = tempfile.NamedTemporaryFile(suffix='.sqlite')
+        self.addCleanup(database.close)
+        index = FileIndex(database.name, site=site)
+        index.build()
+
+        with patch.object(site, 'index', index):
+            response = self.client.get(self.url, {'dir': 'folder', 'filter_type': 'Image'})
+        self.assertTrue(response.status_code == 200)
+        self.assertEqual([f.filename for f in response.context['page'].object_list], ['testimage.jpg'])
+        self.assertEqual(response.context['filelisting'].results_total, 2)
+        self.assertEqual(response.context['filelisting'].results_current, 1)
+
+    def test_get_prefetches_thumbnails(self):
+        for i in range(3):
+            shutil.copy(self.STATIC_IMG_PATH, os.path.join(self.FOLDER_PATH, 'testimage%d.jpg' % i))
+
+        with patch('filebrowser.sites.ThreadPool', wraps=ThreadPool) as thread_pool:
+            with patch('filebrowser.sites.BROWSE_THUMBNAIL_WORKERS', 4):
+                response = self.client.get(self.url, {'dir': 'folder'})
+        self.assertTrue(response.status_code == 200)
+        thread_pool.assert_called_once_with(3)
+        thumbnails = [f.version_path('admin_thumbnail') for f in response.context['page'].object_list if f.filetype == 'Image']
+        self.assertEqual(len(thumbnails), 3)
+        for thumbnail in thumbnails:
+            self.assertTrue(site.storage.exists(thumbnail))
+            self.assertIn(site.storage.url(thumbnail), response.content.decode('utf-8'))
+
+        # the thumbnails exist: a constant number of storage calls
+        with patch.object(site.storage, 'isfile', wraps=site.storage.isfile) as isfile:
+            with patch.object(site.storage, 'modified_time', wraps=site.storage.modified_time) as modified_time:
+                with patch.object(site.storage, 'scandir', wraps=site.storage.scandir) as scandir:
+                    self.client.get(self.url, {'dir': 'folder'})
+        self.assertEqual(isfile.call_count, 0)
+        self.assertEqual(modified_time.call_count, 0)
+        self.assertEqual(scandir.call_count, 2)  # the folder and the folder of its versions
+
+
+class ServeVersionViewTests(TestCase):
+    def setUp(self):
+        super(ServeVersionViewTests, self).setUp()
+        shutil.copy(self.STATIC_IMG_PATH, self.FOLDER_PATH)
+        self.url = reverse('filebrowser:fb_version_serve', kwargs={'version_suffix': 'large', 'path': 'folder/testimage.jpg'})
+
+    def test_get(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+        self.assertEqual(response['Cache-Control'], 'public, max-age=31536000')
+        with open(os.path.join(self.VERSIONS_PATH, 'folder', 'testimage_large.jpg'), 'rb') as f:
+            self.assertEqual(b''.join(response.streaming_content), f.read())
+
+        # revalidation without generating the version
+        with patch.object(FileObject, 'version_generate') as version_generate:
+            not_modified = self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+            self.assertEqual(not_modified.status_code, 304)
+            not_modified = self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+            self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(version_generate.call_count, 0)
+
+        # another ETag with changed options
+        versions = dict(VERSIONS, large=dict(VERSIONS['large'], width=600))
+        with patch.dict('filebrowser.base.VERSIONS', versions):
+            response_changed = self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response_changed.status_code, 200)
+        self.assertNotEqual(response_changed['ETag'], response['ETag'])
+
+    @patch('filebrowser.sites.VERSIONS_SERVE_SENDFILE', 'X-Accel-Redirect')
+    def test_x_accel_redirect(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-Accel-Redirect'], '/media/_test/_versions/folder/testimage_large.jpg')
+        self.assertEqual(response.content, b'')
+
+    @patch('filebrowser.sites.VERSIONS_SERVE_SENDFILE', 'X-Sendfile')
+    def test_x_sendfile(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response['X-Sendfile'], os.path.join(self.VERSIONS_PATH, 'folder', 'testimage_large.jpg'))
+
+    def test_not_found(self):
+        for version_suffix, path in [('unknown', 'folder/testimage.jpg'), ('large', 'folder/missing.jpg'),
+                                     ('large', 'folder'), ('large', '../uploads/folder/testimage.jpg')]:
+            url = reverse('filebrowser:fb_version_serve', kwargs={'version_suffix': version_suffix, 'path': path})
+            self.assertEqual(self.client.get(url).status_code, 404)
+
+
 class CreateDirViewTests(TestCase):
     def setUp(self):
         super(CreateDirViewTests, self).setUp()
@@ -178,6 +268,38 @@ class UploadFileViewTests(TestCase):
 
         self.assertEqual(len(site.storage.listdir(self.F_SUBFOLDER)[1]), 2)
 
+    def upload_with_versions(self, upload_versions):
+        url = '?'.join([self.url, urlencode({'folder': self.F_SUBFOLDER.path_relative_directory})])
+        old_upload_versions, site.upload_versions = site.upload_versions, upload_versions
+        try:
+            with open(self.STATIC_IMG_PATH, "rb") as f:
+                self.client.post(url, data={'qqfile': 'testimage.jpg', 'file': f}, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        finally:
+            site.upload_versions = old_upload_versions
+        return FileObject(os.path.join(self.F_SUBFOLDER.path, 'testimage.jpg'), site=site)
+
+    def test_upload_versions(self):
+        with patch.object(site.storage, 'open', wraps=site.storage.open) as storage_open:
+            uploaded = self.upload_with_versions(['thumbnail', 'small'])
+        self.assertTrue(site.storage.isfile(uploaded.version_path('thumbnail')))
+        self.assertTrue(site.storage.isfile(uploaded.version_path('small')))
+        # the uploaded file is decoded, not the stored one
+        self.assertNotIn(uploaded.path, [call[0][0] for call in storage_open.call_args_list])
+
+    @patch('filebrowser.sites.OVERWRITE_EXISTING', True)
+    def test_upload_versions_overwrite_existing(self):
+        shutil.copy(self.STATIC_IMG_PATH, self.SUBFOLDER_PATH)
+        uploaded = self.upload_with_versions(['thumbnail'])
+        self.assertTrue(site.storage.isfile(uploaded.version_path('thumbnail')))
+
+    @patch('filebrowser.sites.UPLOAD_VERSIONS_ASYNC', True)
+    def test_upload_versions_async(self):
+        with patch('filebrowser.version_queue.queue') as queue:
+            uploaded = self.upload_with_versions(['thumbnail', 'small'])
+        self.assertEqual([(call[0][0].path, call[0][1]) for call in queue.add.call_args_list],
+                         [(uploaded.path, 'thumbnail'), (uploaded.path, 'small')])
+        self.assertFalse(site.storage.isfile(uploaded.version_path('thumbnail')))
+
     @patch('filebrowser.utils.CONVERT_FILENAME', False)
     @patch('filebrowser.utils.NORMALIZE_FILENAME', False)
     def test_convert_false_normalize_false(self):
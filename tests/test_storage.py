@@ -0,0 +1,83 @@
+# coding: utf-8
+
+import os
+import shutil
+
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.urls import reverse
+from mock import patch
+
+from filebrowser.sites import site
+from filebrowser.storage import CachedStorage, end_request_cache, start_request_cache
+from tests import FilebrowserTestCase as TestCase
+
+
+class CachedStorageTests(TestCase):
+
+    def setUp(self):
+        super(CachedStorageTests, self).setUp()
+        shutil.copy(self.STATIC_IMG_PATH, self.FOLDER_PATH)
+        self.path = os.path.join(self.DIRECTORY, 'folder', 'testimage.jpg')
+        self.folder = os.path.join(self.DIRECTORY, 'folder')
+        self.raw_storage = site.storage.storage
+        self.addCleanup(end_request_cache, None)
+        cache.clear()
+
+    def test_site_storage(self):
+        self.assertIsInstance(site.storage, CachedStorage)
+        self.assertEqual(site.storage.location, self.raw_storage.location)
+
+    def test_outside_of_requests(self):
+        storage = CachedStorage(self.raw_storage)
+        with patch.object(self.raw_storage, 'isfile', return_value=True) as isfile:
+            storage.isfile(self.path)
+            storage.isfile(self.path)
+        self.assertEqual(isfile.call_count, 2)
+
+    def test_request_cache(self):
+        storage = CachedStorage(self.raw_storage)
+        start_request_cache(None)
+        with patch.object(self.raw_storage, 'size', wraps=self.raw_storage.size) as size:
+            self.assertEqual(storage.size(self.path), 870037)
+            self.assertEqual(storage.size(self.path), 870037)
+            self.assertEqual(size.call_count, 1)
+
+            # writing through the storage forgets the path and its parent
+            self.assertEqual(storage.listdir(self.folder), ([u'subfolder'], [u'testimage.jpg']))
+            storage.delete(self.path)
+            storage.save(self.path, ContentFile(b'new'))
+            storage.save(os.path.join(self.folder, 'new.txt'), ContentFile(b'new'))
+            self.assertEqual(storage.size(self.path), 3)
+            self.assertEqual(size.call_count, 2)
+            self.assertEqual(sorted(storage.listdir(self.folder)[1]), [u'new.txt', u'testimage.jpg'])
+
+            storage.rmtree(self.folder)
+            self.assertFalse(storage.exists(self.path))
+            self.assertFalse(storage.isdir(self.folder))
+
+        end_request_cache(None)
+        with patch.object(self.raw_storage, 'exists', return_value=True):
+            self.assertTrue(storage.exists(self.path))
+
+    def test_shared_cache(self):
+        storage = CachedStorage(self.raw_storage, cache='default', timeout=60)
+        self.assertTrue(storage.isfile(self.path))
+        with patch.object(self.raw_storage, 'isfile', side_effect=AssertionError):
+            self.assertTrue(storage.isfile(self.path))
+            self.assertTrue(CachedStorage(self.raw_storage, cache='default').isfile(self.path))
+
+        os.remove(os.path.join(self.FOLDER_PATH, 'testimage.jpg'))
+        self.assertTrue(storage.isfile(self.path))
+        storage.invalidate(self.path)
+        self.assertFalse(storage.isfile(self.path))
+
+    def test_browse_request(self):
+        """
+        The storage root is checked only once per request
+        """
+        self.client.login(username=self.user.username, password='password')
+        with patch.object(self.raw_storage, 'isdir', wraps=self.raw_storage.isdir) as isdir:
+            response = self.client.get(reverse('filebrowser:fb_browse'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len([c for c in isdir.call_args_list if c[0][0] == self.DIRECTORY]), 1)
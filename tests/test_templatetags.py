@@ -20,3 +20,11 @@ class GetFileExtensionsTemplateTagTests(TestCase):
             get_file_extensions(QueryDict('type=image')),
             ['.jpg', '.jpeg', '.gif', '.png', '.tif', '.tiff']
         )
+
+    def test_get_site_extensions(self):
+        class Site(object):
+            extensions = {'Image': ['.jpg'], 'Document': ['.pdf']}
+            extension_map = {'.jpg': 'Image', '.pdf': 'Document'}
+
+        self.assertEqual(sorted(get_file_extensions('', Site())), ['.jpg', '.pdf'])
+        self.assertEqual(get_file_extensions(QueryDict('type=image'), Site()), ['.jpg'])
@@ -0,0 +1,66 @@
+# coding: utf-8
+
+import os
+import shutil
+
+from django.core.management import call_command
+from django.utils.six import StringIO
+from mock import patch
+
+from filebrowser.base import FileObject
+from filebrowser.sites import site
+from filebrowser.version_store import VersionStore
+from tests import FilebrowserTestCase as TestCase
+
+
+class VersionStoreTests(TestCase):
+
+    def setUp(self):
+        super(VersionStoreTests, self).setUp()
+        shutil.copy(self.STATIC_IMG_PATH, self.FOLDER_PATH)
+        shutil.copy(self.STATIC_IMG_PATH, self.SUBFOLDER_PATH)
+        self.F_COPY = FileObject(os.path.join(self.F_SUBFOLDER.path, 'testimage.jpg'), site=site)
+        self.store = VersionStore('_test/_versions/_store', site=site)
+        patcher = patch.object(site, 'version_store', self.store)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def stored(self):
+        return [os.path.join(folder, name) for folder, dirs, files in os.walk(os.path.join(self.VERSIONS_PATH, '_store')) for name in files]
+
+    def test_shared_versions(self):
+        version = self.F_IMAGE.version_generate('large')
+        self.assertEqual(len(self.stored()), 1)
+
+        with patch.object(FileObject, '_open_image') as open_image:
+            versions = self.F_COPY.versions_generate(['large'])
+        self.assertEqual(open_image.call_count, 0)
+        self.assertEqual(versions['large'].path, self.F_COPY.version_path('large'))
+        self.assertEqual(os.stat(versions['large'].path_full).st_ino, os.stat(version.path_full).st_ino)
+        # the version is up to date
+        self.assertEqual(self.F_COPY._find_versions(['large'])[1], [])
+
+    def test_different_options(self):
+        self.F_IMAGE.version_generate('large')
+        self.F_COPY.version_generate('small')
+        self.F_COPY.version_generate('large', extra_options={'width': 300})
+        self.assertEqual(len(self.stored()), 3)
+
+    def test_without_hardlinks(self):
+        "Versions are not copied from the store (they are generated) without hard links"
+        self.store.hardlinks = False
+        version = self.F_IMAGE.version_generate('large')
+        copy = self.F_COPY.version_generate('large')
+        self.assertEqual(self.stored(), [])
+        self.assertNotEqual(os.stat(copy.path_full).st_ino, os.stat(version.path_full).st_ino)
+
+    def test_cleanup_unreferenced(self):
+        self.F_IMAGE.version_generate('large')
+        self.F_COPY.version_generate('large')
+        self.F_IMAGE.delete_versions()
+        call_command('fb_version_cleanup', interactive=False, stdout=StringIO())
+        self.assertEqual(len(self.stored()), 1)
+
+        self.F_COPY.delete_versions()
+        call_command('fb_version_cleanup', interactive=False, stdout=StringIO())
+        self.assertEqual(self.stored(), [])
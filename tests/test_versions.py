@@ -1,15 +1,21 @@
 # coding: utf-8
 import os
 import shutil
+import threading
+import time
 
 from django.conf import settings
 from django.template import Context, Template, TemplateSyntaxError
 from mock import patch
 
 from tests import FilebrowserTestCase as TestCase
-from filebrowser.settings import STRICT_PIL
+from filebrowser.base import FileObject, find_versions
+from filebrowser.manifest import options_signature
+from filebrowser.settings import STRICT_PIL, VERSIONS
+from filebrowser.sites import site
 from filebrowser import utils
 from filebrowser.utils import scale_and_crop, process_image
+from filebrowser.version_queue import VersionQueue
 
 if STRICT_PIL:
     from PIL import Image
@@ -168,6 +174,145 @@ class ScaleAndCropTests(TestCase):
         self.assertEqual(version.size, (500, 375))
 
 
+class VersionsGenerateTests(TestCase):
+
+    def setUp(self):
+        super(VersionsGenerateTests, self).setUp()
+        shutil.copy(self.STATIC_IMG_PATH, self.FOLDER_PATH)
+
+    def test_versions_generate(self):
+        suffixes = ['admin_thumbnail', 'small', 'medium', 'large']
+        with patch('filebrowser.base.Image.open', wraps=Image.open) as image_open:
+            versions = self.F_IMAGE.versions_generate(suffixes)
+        self.assertEqual(image_open.call_count, 1)
+        self.assertEqual(sorted(versions), sorted(suffixes))
+
+        sizes = dict((suffix, Image.open(v.path_full).size) for suffix, v in versions.items())
+        for suffix in suffixes:
+            self.F_IMAGE.site.storage.delete(versions[suffix].path)
+            version = self.F_IMAGE.version_generate(suffix)
+            self.assertEqual(version.path, versions[suffix].path)
+            self.assertEqual(Image.open(version.path_full).size, sizes[suffix])
+
+        # existing versions are not generated again
+        with patch('filebrowser.base.Image.open', wraps=Image.open) as image_open:
+            self.F_IMAGE.versions_generate(suffixes)
+        self.assertEqual(image_open.call_count, 0)
+
+    def test_versions_generate_draft(self):
+        from PIL import JpegImagePlugin
+        draft = JpegImagePlugin.JpegImageFile.draft
+        with patch.object(JpegImagePlugin.JpegImageFile, 'draft', autospec=True, side_effect=draft) as image_draft:
+            version = self.F_IMAGE.version_generate('thumbnail')
+        self.assertEqual(image_draft.call_count, 1)
+        self.assertEqual(image_draft.call_args[0][2], (160, 120))
+        self.assertEqual(Image.open(version.path_full).size, (60, 60))
+
+        self.F_IMAGE.site.storage.delete(version.path)
+        versions = {'thumbnail': {'width': 60, 'height': 60, 'opts': 'crop', 'draft': False}}
+        with patch.dict('filebrowser.base.VERSIONS', versions, clear=True):
+            with patch.object(JpegImagePlugin.JpegImageFile, 'draft', autospec=True, side_effect=draft) as image_draft:
+                version = self.F_IMAGE.version_generate('thumbnail')
+        self.assertEqual(image_draft.call_count, 0)
+        self.assertEqual(Image.open(version.path_full).size, (60, 60))
+
+    def test_versions_generate_concurrently(self):
+        save_version = FileObject._save_version
+
+        def slow_save_version(fileobject, version, version_path):
+            time.sleep(0.2)
+            return save_version(fileobject, version, version_path)
+
+        results = []
+        with patch.object(FileObject, '_save_version', autospec=True, side_effect=slow_save_version) as _save_version:
+            threads = [threading.Thread(target=lambda: results.append(self.F_IMAGE.version_generate('large'))) for i in range(3)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(_save_version.call_count, 1)
+        self.assertEqual([v.path for v in results], [self.F_IMAGE.version_path('large')] * 3)
+
+    def test_versions_replaced(self):
+        version = self.F_IMAGE.version_generate('large')
+        os.utime(self.F_IMAGE.path_full, (time.time() + 10, time.time() + 10))
+        with patch.object(self.F_IMAGE.site.storage, 'delete') as delete:
+            self.F_IMAGE.version_generate('large')
+        self.assertEqual(delete.call_count, 0)
+        self.assertEqual(os.listdir(os.path.dirname(version.path_full)), ['testimage_large.jpg'])
+
+    def test_versions_spooled(self):
+        files = []
+
+        def spooled_file():
+            files.append(utils.spooled_file())
+            return files[-1]
+
+        with patch('filebrowser.base.spooled_file', side_effect=spooled_file):
+            version = self.F_IMAGE.version_generate('large')
+        self.assertFalse(files[0].file._rolled)
+        self.assertEqual(Image.open(version.path_full).size[0], 680)
+
+        # larger images are spilled to a temporary file
+        self.F_IMAGE.site.storage.delete(version.path)
+        with patch('filebrowser.utils.VERSION_SPOOL_SIZE', 1024):
+            with patch('filebrowser.base.spooled_file', side_effect=spooled_file):
+                version = self.F_IMAGE.version_generate('large')
+        self.assertTrue(files[1].file._rolled)
+        self.assertEqual(Image.open(version.path_full).size[0], 680)
+
+    def test_versions_generate_missing(self):
+        versions = self.F_MISSING.versions_generate(['small', 'large'])
+        self.assertEqual(versions['small'].path, "")
+        self.assertEqual(versions['large'].path, "")
+
+
+class FindVersionsTests(TestCase):
+
+    def setUp(self):
+        super(FindVersionsTests, self).setUp()
+        shutil.copy(self.STATIC_IMG_PATH, self.FOLDER_PATH)
+        shutil.copy(self.STATIC_IMG_PATH, os.path.join(self.FOLDER_PATH, 'testimage2.jpg'))
+        self.F_IMAGE2 = FileObject(os.path.join(self.F_IMAGE.head, 'testimage2.jpg'), site=site)
+
+    def test_find_versions(self):
+        large = self.F_IMAGE.version_generate('large')
+        self.F_IMAGE2.version_generate('small')
+        os.utime(self.F_IMAGE2.path_full, (time.time() + 10, time.time() + 10))
+        fileobjects = [FileObject(self.F_IMAGE.path, site=site), FileObject(self.F_IMAGE2.path, site=site), self.F_FOLDER]
+
+        with patch.object(site.storage, 'scandir', wraps=site.storage.scandir) as scandir:
+            with patch.object(site.storage, 'isfile', wraps=site.storage.isfile) as isfile:
+                versions = find_versions(fileobjects, ['small', 'large'])
+        self.assertEqual(scandir.call_count, 1)
+        self.assertEqual(isfile.call_count, 0)
+        self.assertEqual(sorted(versions), [self.F_IMAGE.path, self.F_IMAGE2.path])
+        self.assertEqual(versions[self.F_IMAGE.path]['large'].path, large.path)
+        self.assertEqual(versions[self.F_IMAGE.path]['small'], None)
+        # outdated
+        self.assertEqual(versions[self.F_IMAGE2.path]['small'], None)
+
+        # version_generate uses the results
+        with patch.object(site.storage, 'isfile') as isfile:
+            self.assertEqual(fileobjects[0].version_generate('large').path, large.path)
+        self.assertEqual(isfile.call_count, 0)
+        with patch.object(FileObject, '_save_version', autospec=True, return_value='') as save_version:
+            fileobjects[0].version_generate('small')
+            fileobjects[1].version_generate('small')
+        self.assertEqual(save_version.call_count, 2)
+
+    def test_find_versions_listdir(self):
+        large = self.F_IMAGE.version_generate('large')
+        with patch.object(site.storage, 'scandir', side_effect=NotImplementedError):
+            versions = find_versions([FileObject(self.F_IMAGE.path, site=site)], ['small', 'large'])
+        self.assertEqual(versions[self.F_IMAGE.path]['large'].path, large.path)
+        self.assertEqual(versions[self.F_IMAGE.path]['small'], None)
+
+    def test_find_versions_missing_folder(self):
+        versions = find_versions([self.F_IMAGE])
+        self.assertEqual(set(versions[self.F_IMAGE.path].values()), set([None]))
+
+
 class VersionTemplateTagTests(TestCase):
     """Test basic version uses
 
@@ -442,3 +587,87 @@ class VersionObjectTemplateTagTests(TestCase):
         r = t.render(c)
         self.assertEqual(c["version_large"].url, os.path.join(settings.MEDIA_URL, "_test/_versions/placeholders/testimage_large.jpg"))
         self.assertEqual(r, os.path.join(settings.MEDIA_URL, "_test/_versions/placeholders/testimage_large.jpg"))
+
+
+@patch('filebrowser.templatetags.fb_versions.VERSIONS_ASYNC', True)
+class VersionAsyncTemplateTagTests(TestCase):
+    """Test versions generated in the background
+
+    Eg:
+    FILEBROWSER_VERSIONS_ASYNC = True
+    {% version obj "large" %}
+
+    """
+
+    def setUp(self):
+        super(VersionAsyncTemplateTagTests, self).setUp()
+        shutil.copy(self.STATIC_IMG_PATH, self.FOLDER_PATH)
+
+        os.makedirs(self.PLACEHOLDER_PATH)
+        shutil.copy(self.STATIC_IMG_PATH, self.PLACEHOLDER_PATH)
+
+        self.queue = VersionQueue(workers=0)
+        patcher = patch('filebrowser.version_queue.queue', self.queue)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @patch('filebrowser.version_queue.PLACEHOLDER', '')
+    def test_original_until_generated(self):
+        t = Template('{% load fb_versions %}{% version obj "large" %}')
+        c = Context({"obj": self.F_IMAGE})
+        self.assertEqual(t.render(c), os.path.join(settings.MEDIA_URL, "_test/uploads/folder/testimage.jpg"))
+        self.queue.join()
+        self.assertTrue(os.path.exists(os.path.join(settings.MEDIA_ROOT, "_test/_versions/folder/testimage_large.jpg")))
+        self.assertEqual(t.render(c), os.path.join(settings.MEDIA_URL, "_test/_versions/folder/testimage_large.jpg"))
+
+    def test_placeholder_until_generated(self):
+        t = Template('{% load fb_versions %}{% version obj "large" as version_large %}{{ version_large.url }}')
+        c = Context({"obj": self.F_IMAGE})
+        self.assertEqual(t.render(c), os.path.join(settings.MEDIA_URL, "_test/_versions/placeholders/testimage_large.jpg"))
+        self.queue.join()
+        self.assertEqual(t.render(c), os.path.join(settings.MEDIA_URL, "_test/_versions/folder/testimage_large.jpg"))
+
+    def test_queued_once(self):
+        event = threading.Event()
+        with patch('filebrowser.version_queue.generate_version', side_effect=lambda *args: event.wait(5)) as generate_version:
+            self.assertTrue(self.queue.add(self.F_IMAGE, 'large'))
+            self.assertFalse(self.queue.add(self.F_IMAGE, 'large'))
+            self.assertTrue(self.queue.add(self.F_IMAGE, 'small'))
+            self.assertTrue(self.queue.is_pending(self.F_IMAGE, 'large'))
+            event.set()
+            self.queue.join()
+        self.assertEqual(generate_version.call_count, 2)
+        self.assertFalse(self.queue.is_pending(self.F_IMAGE, 'large'))
+
+
+class VersionUrlTemplateTagTests(TestCase):
+    """Test URLs of versions served with the fb_version_serve view
+
+    Eg:
+    {% version_url obj "large" %}
+
+    """
+
+    def setUp(self):
+        super(VersionUrlTemplateTagTests, self).setUp()
+        shutil.copy(self.STATIC_IMG_PATH, self.FOLDER_PATH)
+
+    def test_version_url(self):
+        t = Template('{% load fb_versions %}{% version_url obj "large" %}')
+        url = '/admin/filebrowser/versions/large/folder/testimage.jpg?t=%d-%s' % (
+            self.F_IMAGE.date, options_signature(VERSIONS['large'])[:8])
+        self.assertEqual(t.render(Context({"obj": self.F_IMAGE})), url)
+        self.assertEqual(t.render(Context({"obj": self.F_IMAGE.path})), url)
+        # nothing is generated when rendering
+        self.assertFalse(site.storage.exists(self.F_IMAGE.version_path('large')))
+
+    def test_version_url_options(self):
+        "The URL changes with the options of the version"
+        t = Template('{% load fb_versions %}{% version_url obj "large" %}')
+        url = t.render(Context({"obj": self.F_IMAGE}))
+        with patch.dict(VERSIONS['large'], {'width': 100}):
+            self.assertNotEqual(t.render(Context({"obj": self.F_IMAGE})), url)
+
+    def test_unknown_version(self):
+        t = Template('{% load fb_versions %}{% version_url obj "unknown" %}')
+        self.assertEqual(t.render(Context({"obj": self.F_IMAGE})), "")
@@ -0,0 +1,111 @@
+# coding: utf-8
+
+import os
+import shutil
+import tempfile
+
+from mock import patch
+
+from filebrowser.index import FileIndex
+from filebrowser.sites import site
+from filebrowser.watcher import InotifyWatcher, PollingWatcher, apply_changes, _walk
+from tests import FilebrowserTestCase as TestCase
+
+
+class WatcherTests(TestCase):
+
+    def setUp(self):
+        super(WatcherTests, self).setUp()
+        self.database = tempfile.NamedTemporaryFile(suffix='.sqlite')
+        self.index = FileIndex(self.database.name, site=site)
+        self.index.build()
+
+        patcher = patch.object(site, 'index', self.index)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        super(WatcherTests, self).tearDown()
+        self.database.close()
+
+    def paths(self):
+        return [f.path for f in self.index.query(self.DIRECTORY, recursive=True).order_by('path')]
+
+    def check_watcher(self, watcher):
+        try:
+            self.assertEqual(watcher.changes(0), (set(), set()))
+
+            image_path = os.path.join(self.SUBFOLDER_PATH, 'testimage.jpg')
+            shutil.copy(self.STATIC_IMG_PATH, image_path)
+            new_folder = os.path.join(self.DIRECTORY_PATH, 'new', 'nested')
+            os.makedirs(new_folder)
+            shutil.copy(self.STATIC_IMG_PATH, new_folder)
+            # make sure the modification time of the directories changes
+            os.utime(self.SUBFOLDER_PATH, (0, 0))
+            os.utime(self.DIRECTORY_PATH, (0, 0))
+
+            changed, created = set(), set()
+            for i in range(10):
+                c, n = watcher.changes(0.1)
+                changed |= c
+                created |= n
+            self.assertIn(image_path, changed)
+            self.assertIn(os.path.join(self.DIRECTORY_PATH, 'new'), changed)
+            self.assertIn(os.path.join(self.DIRECTORY_PATH, 'new'), created)
+            self.assertNotIn(self.SUBFOLDER_PATH, created)
+
+            apply_changes(site, changed, created)
+            self.assertEqual(self.paths(), [
+                u'_test/uploads/folder',
+                u'_test/uploads/folder/subfolder',
+                u'_test/uploads/folder/subfolder/testimage.jpg',
+                u'_test/uploads/new',
+                u'_test/uploads/new/nested',
+                u'_test/uploads/new/nested/testimage.jpg',
+            ])
+
+            shutil.rmtree(os.path.join(self.DIRECTORY_PATH, 'new'))
+            changed = set()
+            for i in range(10):
+                changed |= watcher.changes(0.1)[0]
+            apply_changes(site, changed)
+            self.assertNotIn(u'_test/uploads/new', self.paths())
+        finally:
+            watcher.close()
+
+    def test_polling(self):
+        self.check_watcher(PollingWatcher([self.DIRECTORY_PATH.rstrip(os.sep)]))
+
+    def test_inotify(self):
+        try:
+            watcher = InotifyWatcher([self.DIRECTORY_PATH.rstrip(os.sep)])
+        except OSError:
+            self.skipTest('inotify is not available')
+        self.check_watcher(watcher)
+
+    def test_apply_changes_recursive(self):
+        "Only new directories are read again with everything below them"
+        image_path = os.path.join(self.SUBFOLDER_PATH, 'testimage.jpg')
+        shutil.copy(self.STATIC_IMG_PATH, image_path)
+        new_folder = os.path.join(self.DIRECTORY_PATH, 'new')
+        os.makedirs(new_folder)
+        with patch('filebrowser.receivers.path_changed') as path_changed:
+            apply_changes(site, [self.SUBFOLDER_PATH.rstrip(os.sep), image_path, new_folder], [new_folder])
+        self.assertEqual(sorted((c[0][1], c[1]['recursive']) for c in path_changed.call_args_list), [
+            (u'_test/uploads/folder/subfolder', False),
+            (u'_test/uploads/folder/subfolder/testimage.jpg', False),
+            (u'_test/uploads/new', True),
+        ])
+
+    def test_walk_symlink_cycle(self):
+        link = os.path.join(self.SUBFOLDER_PATH, 'cycle')
+        try:
+            os.symlink(self.FOLDER_PATH, link)
+        except (AttributeError, NotImplementedError, OSError):
+            self.skipTest('symbolic links are not available')
+        self.assertEqual(sorted(_walk(self.FOLDER_PATH.rstrip(os.sep))), [
+            self.FOLDER_PATH.rstrip(os.sep),
+            self.SUBFOLDER_PATH.rstrip(os.sep),
+        ])
+        watcher = PollingWatcher([self.FOLDER_PATH.rstrip(os.sep)])
+        self.assertNotIn(os.path.join(link, 'subfolder'), watcher.snapshot)